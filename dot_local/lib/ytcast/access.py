@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Per-episode access counters recorded by serve.py and read by rotation.
+
+access.json (default <base-dir>/access.json), keyed by path relative to
+the base dir ("audio/<slug>/<file>"):
+  {"first": ts, "last": ts, "hits": n, "bytes": n, "size": n, "ranges": [[start, end), ...]}
+
+ranges is the merged set of byte ranges served to Range requests, so
+"played" can be told apart from "client fetched the first few KB to read
+the duration". Players stream with Range requests; a whole-file GET is an
+app auto-downloading the episode, which says nothing about it being played,
+so it only counts as a hit.
+"""
+import json
+import threading
+import time
+from pathlib import Path
+
+from paths import AUDIO_EXTS
+
+MAX_RANGES = 32
+
+# Retention tiers (lower = evicted first)
+STALE = 0      # never fetched N days after download, or played to the end
+NORMAL = 1
+PROTECTED = 2  # partially played and touched recently: never evicted
+
+def merge_range(ranges: list[list[int]], start: int, end: int) -> list[list[int]]:
+    out = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if out and a <= out[-1][1]:
+            out[-1][1] = max(out[-1][1], b)
+        else:
+            out.append([a, b])
+    # Keep it compact: close the smallest gaps first
+    while len(out) > MAX_RANGES:
+        i = min(range(len(out) - 1), key=lambda k: out[k + 1][0] - out[k][1])
+        out[i][1] = out[i + 1][1]
+        del out[i + 1]
+    return out
+
+def played_fraction(stats: dict) -> float:
+    size = stats.get("size") or 0
+    if size <= 0:
+        return 0.0
+    covered = sum(b - a for a, b in stats.get("ranges", []))
+    return min(1.0, covered / size)
+
+def tier(stats: dict | None, mtime: float, now: float, unplayed_days: float = 14, protect_days: float = 30) -> int:
+    if not stats:
+        return STALE if now - mtime > unplayed_days * 86400 else NORMAL
+    frac = played_fraction(stats)
+    if frac >= 0.95:
+        return STALE
+    if frac >= 0.02 and now - stats.get("last", 0) < protect_days * 86400:
+        return PROTECTED
+    return NORMAL
+
+def load(path: Path) -> dict[str, dict]:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+class AccessLog:
+    """Thread-safe counters, flushed to disk every `interval` seconds when dirty."""
+
+    def __init__(self, path: Path, interval: float = 30.0):
+        self.path = Path(path)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._data = load(self.path)
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="access-log", daemon=True)
+        self._thread.start()
+
+    def record(self, rel_path: str, start: int, count: int, size: int, ranged: bool):
+        if count <= 0 or not rel_path.lower().endswith(AUDIO_EXTS):
+            return
+        now = time.time()
+        with self._lock:
+            st = self._data.setdefault(rel_path, {"first": now, "hits": 0, "bytes": 0, "ranges": []})
+            st["last"] = now
+            st["hits"] += 1
+            st["bytes"] += count
+            st["size"] = size
+            if ranged:
+                st["ranges"] = merge_range(st["ranges"], start, start + count)
+            self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._data, separators=(",", ":"))
+            self._dirty = False
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(data, encoding="utf-8")
+        tmp.replace(self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def close(self):
+        self._stop.set()
+        self.flush()
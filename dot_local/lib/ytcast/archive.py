@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Helpers for yt-dlp --download-archive files (archive/<slug>.txt).
+Each line is "<extractor> <video_id>", e.g. "youtube dQw4w9WgXcQ".
+"""
+from collections import deque
+from pathlib import Path
+
+EXTRACTOR = "youtube"
+
+def load_ids(archive_file: Path) -> set[str]:
+    ids: set[str] = set()
+    try:
+        with archive_file.open("r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == EXTRACTOR:
+                    ids.add(parts[1])
+    except FileNotFoundError:
+        pass
+    return ids
+
+def append_ids(archive_file: Path, ids: list[str]):
+    if not ids:
+        return
+    with archive_file.open("a", encoding="utf-8") as f:
+        for vid in ids:
+            f.write(f"{EXTRACTOR} {vid}\n")
+
+def compact(archive_file: Path, window: int, keep: set[str] | frozenset[str] = frozenset()) -> int:
+    """
+    Trim archive_file to its last `window` ids plus any id in `keep`,
+    streaming (memory bounded by the window) and replacing it atomically.
+    Appends are chronological, so the tail covers everything the channel's
+    RSS can still list. Returns lines dropped.
+    """
+    tail: deque[str] = deque()
+    pinned: list[str] = []
+    total = 0
+    try:
+        with archive_file.open("r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                total += 1
+                tail.append(line if line.endswith("\n") else line + "\n")
+                if len(tail) > window:
+                    old = tail.popleft()
+                    parts = old.split()
+                    if len(parts) == 2 and parts[1] in keep:
+                        pinned.append(old)
+    except FileNotFoundError:
+        return 0
+
+    dropped = total - len(pinned) - len(tail)
+    if dropped <= 0:
+        return 0
+    tmp = archive_file.with_name(archive_file.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.writelines(pinned)
+        f.writelines(tail)
+    tmp.replace(archive_file)
+    return dropped
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+asyncio serving mode for serve.py (--mode asyncio), stdlib only.
+
+Same URLs and content-type rules as RSSHandler, but every client is a
+coroutine instead of an OS thread: HTTP/1.1 keep-alive, a cap on open
+connections, idle timeouts, and file bodies streamed with loop.sendfile()
+(zero-copy when possible, chunked + drain() otherwise).
+"""
+import asyncio
+import email.utils
+import mimetypes
+import os
+import posixpath
+import stat
+import time
+import urllib.parse
+from pathlib import Path
+
+from access import AccessLog
+from metrics import ServeMetrics, route_for
+from variants import RETRY_AFTER, VariantCache, parse_bitrate, split_variant
+from websub import MAX_BODY, WebSubCallback
+from serve import (
+    HOST_RE,
+    SEND_CHUNK,
+    FeedStore,
+    RangeNotSatisfiable,
+    file_etag,
+    if_range_matches,
+    parse_byte_range,
+    podcast_type,
+)
+
+MAX_HEAD = 16 * 1024
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Content Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+class Request:
+    __slots__ = ("method", "target", "version", "headers", "started")
+
+    def __init__(self, method: str, target: str, version: str, headers: dict[str, str]):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.started = time.perf_counter()
+
+    @property
+    def keep_alive(self) -> bool:
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+def parse_head(raw: bytes) -> Request:
+    lines = raw.decode("iso-8859-1").split("\r\n")
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise ValueError("bad request line")
+    headers: dict[str, str] = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError("bad header")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length", "")
+    if length and not (length.isascii() and length.isdigit()):
+        raise ValueError("bad content-length")
+    return Request(parts[0], parts[1], parts[2], headers)
+
+def open_file(path: Path):
+    """(file, fstat) of a regular file; OSError otherwise (missing, directory)."""
+    f = open(path, "rb")
+    try:
+        st = os.fstat(f.fileno())
+    except OSError:
+        f.close()
+        raise
+    if not stat.S_ISREG(st.st_mode):
+        f.close()
+        raise IsADirectoryError(path)
+    return f, st
+
+class AsyncServer:
+    def __init__(
+        self,
+        base_dir: Path,
+        feeds: FeedStore,
+        default_host: str,
+        access: AccessLog | None = None,
+        variants: VariantCache | None = None,
+        websub: WebSubCallback | None = None,
+        metrics: ServeMetrics | None = None,
+        max_conns: int = 64,
+        idle_timeout: float = 15.0,
+    ):
+        self.base_dir = base_dir
+        self.metrics = metrics or ServeMetrics()
+        self.access = access
+        self.variants = variants
+        self.websub = websub
+        self.feeds = feeds
+        self.default_host = default_host
+        self.max_conns = max_conns
+        self.idle_timeout = idle_timeout
+        self.active = 0
+
+    def resolve(self, path: str) -> Path | None:
+        path = posixpath.normpath(path)
+        parts = [p for p in path.split("/") if p and p not in (".", "..")]
+        full = self.base_dir.joinpath(*parts)
+        return full if parts else None
+
+    def request_host(self, req: Request) -> str:
+        host = req.headers.get("host", "").strip()
+        if host and len(host) <= 255 and HOST_RE.match(host):
+            return host
+        return self.default_host
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.active >= self.max_conns:
+            await self.respond(writer, 503, {"Retry-After": "5"}, keep_alive=False)
+            writer.close()
+            return
+        self.active += 1
+        # Backpressure: writes wait in drain() once this much is queued
+        writer.transport.set_write_buffer_limits(high=256 * 1024)
+        try:
+            while True:
+                try:
+                    raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 431, keep_alive=False)
+                    break
+                if len(raw) > MAX_HEAD:
+                    await self.respond(writer, 431, keep_alive=False)
+                    break
+                try:
+                    req = parse_head(raw[:-4])
+                except ValueError:
+                    await self.respond(writer, 400, keep_alive=False)
+                    break
+
+                # Only WebSub POSTs carry a body, but don't desync if one is sent
+                length = int(req.headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, keep_alive=False)
+                    break
+                try:
+                    # A client that stalls mid-body must not keep its slot forever
+                    body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout) if length else b""
+                except asyncio.TimeoutError:
+                    break
+
+                keep_alive = req.keep_alive
+                if req.method == "POST" and self.websub is not None:
+                    status = await self.websub_notify(req, writer, body, keep_alive)
+                elif req.method not in ("GET", "HEAD"):
+                    status = await self.respond(writer, 405, {"Allow": "GET, HEAD"}, keep_alive=keep_alive)
+                else:
+                    status = await self.dispatch(req, writer, keep_alive)
+                # None: a file body already recorded its time to headers
+                if status is not None:
+                    self.observe(req, status)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        headers: dict | None = None,
+        body: bytes = b"",
+        keep_alive: bool = True,
+        head: bool = False,
+    ) -> int:
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        headers = dict(headers or {})
+        if status != 204:
+            headers.setdefault("Content-Length", str(len(body)))
+        headers["Date"] = email.utils.formatdate(usegmt=True)
+        # CORS por si algún cliente lo necesita (no molesta)
+        headers["Access-Control-Allow-Origin"] = "*"
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1"))
+        if body and not head:
+            writer.write(body)
+        await writer.drain()
+        return status
+
+    def observe(self, req: Request, status: int):
+        path = urllib.parse.urlsplit(req.target).path
+        self.metrics.observe(route_for(path), status, time.perf_counter() - req.started)
+
+    async def dispatch(self, req: Request, writer: asyncio.StreamWriter, keep_alive: bool):
+        head = req.method == "HEAD"
+        url = urllib.parse.urlsplit(req.target)
+        br, path = split_variant(urllib.parse.unquote(url.path))
+        if br is None:
+            br = parse_bitrate(urllib.parse.parse_qs(url.query).get("br", [""])[0])
+        if self.variants is None:
+            br = None
+        if path == "/metrics":
+            body = await asyncio.to_thread(self.metrics.render)
+            headers = {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+            return await self.respond(writer, 200, headers, body, keep_alive=keep_alive, head=head)
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "feeds" and parts[1].endswith((".xml", ".opml")):
+            return await self.send_feed(req, writer, parts[1], keep_alive, head, br)
+        if len(parts) == 2 and parts[0] == "websub" and self.websub is not None:
+            # Hub verification of a (un)subscribe request
+            status, body = await asyncio.to_thread(self.websub.verify, parts[1], url.query)
+            return await self.respond(writer, status, {"Content-Type": "text/plain"}, body, keep_alive=keep_alive, head=head)
+
+        full = self.resolve(path)
+        if full is None:
+            return await self.respond(writer, 404, keep_alive=keep_alive)
+        return await self.send_file(req, writer, full, keep_alive, head, br)
+
+    async def websub_notify(self, req: Request, writer, body: bytes, keep_alive: bool):
+        parts = urllib.parse.unquote(urllib.parse.urlsplit(req.target).path).strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "websub":
+            return await self.respond(writer, 404, keep_alive=keep_alive)
+        # Content distribution: always 2xx, a bad signature is just ignored
+        await asyncio.to_thread(self.websub.notify, parts[1], body, req.headers.get("x-hub-signature"))
+        return await self.respond(writer, 204, keep_alive=keep_alive)
+
+    async def send_feed(self, req: Request, writer, name: str, keep_alive: bool, head: bool, br: str | None = None):
+        hit = await asyncio.to_thread(self.feeds.get, name, self.request_host(req), br)
+        if hit is None:
+            return await self.respond(writer, 404, keep_alive=keep_alive)
+        body, etag, mtime = hit
+        inm = req.headers.get("if-none-match")
+        if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+            return await self.respond(writer, 304, {"ETag": etag, "Content-Length": "0"}, keep_alive=keep_alive)
+        headers = {
+            "Content-Type": podcast_type(name),
+            "ETag": etag,
+            "Last-Modified": email.utils.formatdate(mtime, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if not head:
+            self.metrics.add_sent("feed", len(body))
+        return await self.respond(writer, 200, headers, body, keep_alive=keep_alive, head=head)
+
+    async def send_file(self, req: Request, writer, full: Path, keep_alive: bool, head: bool, br: str | None = None):
+        src = full
+        # Size of the original when a variant is served (access ranges are scaled to it)
+        orig_size = None
+        src_st = None
+        if br and self.variants.supported(full):
+            try:
+                src_st = await asyncio.to_thread(full.stat)
+            except OSError:
+                pass
+        if src_st is not None and stat.S_ISREG(src_st.st_mode):
+            try:
+                variant = await asyncio.to_thread(self.variants.get, full, br)
+            except OSError:
+                # Gone since the stat: the open below answers 404
+                variant = full
+            except RuntimeError:
+                return await self.respond(writer, 500, keep_alive=keep_alive)
+            if variant is None:
+                # Being made in the background; the full-size original would defeat ?br=
+                return await self.respond(writer, 503, {"Retry-After": str(RETRY_AFTER)}, keep_alive=keep_alive)
+            if variant != full:
+                full, orig_size = variant, src_st.st_size
+        # open/fstat can block on the SMB mount: keep them off the event loop
+        try:
+            f, st = await asyncio.to_thread(open_file, full)
+        except OSError:
+            return await self.respond(writer, 404, keep_alive=keep_alive)
+
+        with f:
+            size = st.st_size
+            etag = file_etag(st)
+
+            inm = req.headers.get("if-none-match")
+            if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+                return await self.respond(writer, 304, {"ETag": etag, "Content-Length": "0"}, keep_alive=keep_alive)
+
+            rng = None
+            if if_range_matches(req.headers.get("if-range"), etag, st.st_mtime):
+                try:
+                    rng = parse_byte_range(req.headers.get("range"), size)
+                except RangeNotSatisfiable:
+                    return await self.respond(writer, 416, {"Content-Range": f"bytes */{size}"}, keep_alive=keep_alive)
+
+            name = full.name
+            headers = {
+                "Content-Type": podcast_type(name) or mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "Accept-Ranges": "bytes",
+                "ETag": etag,
+                "Last-Modified": email.utils.formatdate(st.st_mtime, usegmt=True),
+            }
+            if rng is None:
+                status, start, count = 200, 0, size
+            else:
+                status, start, count = 206, rng[0], rng[1] - rng[0] + 1
+                headers["Content-Range"] = f"bytes {rng[0]}-{rng[1]}/{size}"
+            headers["Content-Length"] = str(count)
+
+            await self.respond(writer, status, headers, keep_alive=keep_alive)
+            self.observe(req, status)
+            if head or count == 0:
+                return None
+            loop = asyncio.get_running_loop()
+            sent = 0
+            try:
+                with self.metrics.stream():
+                    while sent < count:
+                        n = await loop.sendfile(
+                            writer.transport, f, offset=start + sent, count=min(SEND_CHUNK, count - sent), fallback=True
+                        )
+                        if not n:
+                            break
+                        sent += n
+            finally:
+                self.metrics.add_sent(route_for(urllib.parse.urlsplit(req.target).path), sent)
+                if self.access is not None:
+                    self.record_access(src, start, sent, size, rng is not None, orig_size)
+
+    def record_access(self, src: Path, start: int, sent: int, size: int, ranged: bool, orig_size: int | None = None):
+        if orig_size is not None:
+            # Variant: scale to the original's byte offsets so "played" stays comparable
+            ratio = orig_size / size if size else 0
+            start, sent, size = int(start * ratio), int(sent * ratio), orig_size
+        self.access.record(src.relative_to(self.base_dir).as_posix(), start, sent, size, ranged)
+
+async def serve(
+    base_dir: Path,
+    port: int,
+    feeds: FeedStore,
+    default_host: str,
+    access: AccessLog | None = None,
+    variants: VariantCache | None = None,
+    websub: WebSubCallback | None = None,
+    metrics: ServeMetrics | None = None,
+    max_conns: int = 64,
+    idle_timeout: float = 15.0,
+):
+    app = AsyncServer(
+        base_dir,
+        feeds,
+        default_host,
+        access=access,
+        variants=variants,
+        websub=websub,
+        metrics=metrics,
+        max_conns=max_conns,
+        idle_timeout=idle_timeout,
+    )
+    server = await asyncio.start_server(app.handle, "0.0.0.0", port, limit=MAX_HEAD)
+    async with server:
+        await server.serve_forever()
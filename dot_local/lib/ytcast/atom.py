@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+YouTube channel Atom feeds, shared by download.py (RSS poll), websub.py
+(push notifications) and generate_artwork.py (newest video).
+
+iter_entries() is a pull parser: each <entry> becomes a compact Entry as
+soon as it is closed and is then dropped from the tree, so memory stays
+flat however long a (backfilled) feed is, and a caller that stops
+iterating stops the parsing too.
+"""
+import heapq
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import BinaryIO, Collection, Iterable, Iterator, NamedTuple
+
+NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+ENTRY = f"{{{NS['atom']}}}entry"
+PUBLISHED = f"{{{NS['atom']}}}published"
+LINK = f"{{{NS['atom']}}}link"
+VIDEO_ID = f"{{{NS['yt']}}}videoId"
+CHUNK = 64 * 1024
+
+class Entry(NamedTuple):
+    published: str  # ISO 8601 as in the feed, "" if missing
+    video_id: str
+    url: str  # watch URL
+
+def iso_key(published: str) -> float:
+    """Epoch seconds of an ISO 8601 timestamp, 0.0 if missing/invalid."""
+    if not published:
+        return 0.0
+    try:
+        if published.endswith("Z"):
+            published = published[:-1] + "+00:00"
+        return datetime.fromisoformat(published).timestamp()
+    except ValueError:
+        return 0.0
+
+def sort_key(published: str) -> str:
+    """
+    Order key for <published>: UTC timestamps (what YouTube sends) compare
+    as strings, so only other offsets pay for a datetime parse.
+    """
+    head, tail = published[:19], published[19:]
+    if tail in ("+00:00", "Z") and head[4:5] == "-" and head[10:11] == "T":
+        return head
+    ts = iso_key(published)
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S") if ts else ""
+
+def _chunks(source: bytes | BinaryIO) -> Iterator[bytes]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for i in range(0, len(view), CHUNK):
+            yield view[i:i + CHUNK]
+        return
+    while chunk := source.read(CHUNK):
+        yield chunk
+
+def _entry(elem: ET.Element) -> Entry | None:
+    published = vid = watch = ""
+    # One pass over the children instead of a findall per field
+    for child in elem:
+        tag = child.tag
+        if tag == VIDEO_ID:
+            vid = (child.text or "").strip()
+        elif tag == PUBLISHED:
+            published = (child.text or "").strip()
+        elif tag == LINK and not watch and child.get("rel") == "alternate":
+            href = child.get("href", "")
+            if "watch?v=" in href:
+                watch = href
+    if not watch and vid:
+        watch = f"https://www.youtube.com/watch?v={vid}"
+    if not watch or not vid:
+        return None
+    return Entry(published, vid, watch)
+
+def iter_entries(source: bytes | BinaryIO, stop_at: Collection[str] | None = None) -> Iterator[Entry]:
+    """
+    Entries in document order. stop_at: ids already handled; parsing stops
+    at the first one, as everything after it is older (YouTube lists
+    newest first). Raises ET.ParseError on malformed XML.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != ENTRY:
+                continue
+            entry = _entry(elem)
+            # Done with this <entry>: drop it (and anything before it) from the tree
+            root.clear()
+            if entry is None:
+                continue
+            if stop_at is not None and entry.video_id in stop_at:
+                return
+            yield entry
+    parser.close()
+
+def newest(entries: Iterable[Entry], k: int) -> list[Entry]:
+    """The k newest entries, newest first: a size-k heap instead of a full sort."""
+    if k == 1:
+        best = max(entries, key=lambda e: sort_key(e.published), default=None)
+        return [best] if best is not None else []
+    return heapq.nlargest(k, entries, key=lambda e: sort_key(e.published))
+
+def parse(source: bytes | BinaryIO, limit: int = 0, stop_at: Collection[str] | None = None) -> list[Entry]:
+    """Entries newest first; limit > 0 keeps only the newest `limit`."""
+    entries = iter_entries(source, stop_at)
+    if limit > 0:
+        return newest(entries, limit)
+    return sorted(entries, key=lambda e: sort_key(e.published), reverse=True)
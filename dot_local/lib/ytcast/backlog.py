@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Global download queue for budgeted runs (download.py --order).
+
+Candidates from every channel are ranked as one list: newest upload first
+("newest"), or by the channel's "priority" in channels.json (default 1,
+higher first) and newest first within a priority ("priority"). A Budget
+stops new downloads from starting once the wall-clock deadline or the byte
+budget would be overrun, judging by the average download so far; running
+ones always finish. What was not reached (or failed, up to MAX_TRIES) is
+saved to ~/.local/state/ytcast/backlog.json and the next run starts from it.
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import atom
+from paths import state_dir
+
+ORDERS = ("newest", "priority")
+MAX_TRIES = 5
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+class Candidate(NamedTuple):
+    slug: str
+    entry: atom.Entry
+    # failed attempts so far
+    tries: int = 0
+
+def parse_duration(value: str) -> float:
+    """ "90", "45m", "1.5h" -> seconds """
+    m = re.fullmatch(r"\s*([\d.]+)\s*([smh]?)\s*", value, re.IGNORECASE)
+    if not m:
+        raise argparse.ArgumentTypeError(f"duración inválida: {value}")
+    return float(m.group(1)) * DURATION_UNITS[m.group(2).lower()]
+
+def rank(candidates: list[Candidate], order: str, priorities: dict[str, float] | None = None) -> list[Candidate]:
+    """Best first."""
+    newest_first = sorted(candidates, key=lambda c: atom.sort_key(c.entry.published), reverse=True)
+    if order == "priority":
+        # Stable: newest first survives within a priority
+        priorities = priorities or {}
+        newest_first.sort(key=lambda c: priorities.get(c.slug, 1), reverse=True)
+    return newest_first
+
+def default_backlog_path() -> Path:
+    return state_dir() / "backlog.json"
+
+class Backlog:
+    """backlog.json: [{"slug", "published", "id", "url", "tries"}], best first."""
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path else default_backlog_path()
+
+    def load(self) -> list[Candidate]:
+        try:
+            rows = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return []
+        out = []
+        for r in rows if isinstance(rows, list) else []:
+            try:
+                out.append(Candidate(r["slug"], atom.Entry(r.get("published", ""), r["id"], r["url"]), int(r.get("tries", 0))))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return out
+
+    def save(self, candidates: list[Candidate]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        rows = [
+            {"slug": c.slug, "published": c.entry.published, "id": c.entry.video_id, "url": c.entry.url, "tries": c.tries}
+            for c in candidates
+        ]
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(json.dumps(rows, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(self.path)
+
+class Budget:
+    def __init__(self, seconds: float | None = None, max_bytes: int | None = None):
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.max_bytes = max_bytes or None
+        self.used_bytes = 0
+        self.jobs = 0
+        self.job_seconds = 0.0
+        # Why the last allows() said no: "tiempo" / "bytes"
+        self.reason: str | None = None
+
+    def record(self, seconds: float, nbytes: int):
+        """One download finished (failed ones too: they took time)."""
+        self.jobs += 1
+        self.job_seconds += seconds
+        self.used_bytes += nbytes
+
+    def allows(self, running: int) -> bool:
+        """Whether one more download fits, assuming it costs what the average one did so far."""
+        avg_seconds = self.job_seconds / self.jobs if self.jobs else 0.0
+        avg_bytes = self.used_bytes / self.jobs if self.jobs else 0.0
+        if self.deadline is not None and time.monotonic() + avg_seconds > self.deadline:
+            self.reason = "tiempo"
+            return False
+        if self.max_bytes is not None and (
+            self.used_bytes >= self.max_bytes or self.used_bytes + (running + 1) * avg_bytes > self.max_bytes
+        ):
+            self.reason = "bytes"
+            return False
+        return True
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Local WebSub hub stand-in, to exercise websub.py renew and serve.py --websub
+without pubsubhubbub.appspot.com or a public callback URL.
+
+  POST /subscribe              hub.mode/topic/callback/secret/lease_seconds,
+                               as websub.subscribe() sends them: 202, then the
+                               verification GET to the callback; the
+                               subscription only counts if it echoes hub.challenge
+  POST /publish?hub.topic=<url>  Atom body, pushed to every verified subscriber
+                               of the topic with X-Hub-Signature: sha1=<hmac>
+
+Standalone: fakehub.py --port 8766, then
+  websub.py renew --hub http://127.0.0.1:8766/subscribe --callback http://127.0.0.1:8000/websub ...
+  curl --data-binary @entry.xml 'http://127.0.0.1:8766/publish?hub.topic=<channel url>'
+"""
+import argparse
+import hmac
+import http.client
+import http.server
+import secrets
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+def notification(vid: str, published: datetime | None = None) -> bytes:
+    """Atom body the hub pushes for one new upload."""
+    stamp = (published or datetime.now(timezone.utc)).isoformat()
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">\n'
+        "<entry>\n"
+        f"<id>yt:video:{vid}</id>\n"
+        f"<yt:videoId>{vid}</yt:videoId>\n"
+        f'<link rel="alternate" href="https://www.youtube.com/watch?v={vid}"/>\n'
+        f"<published>{stamp}</published>\n"
+        f"<updated>{stamp}</updated>\n"
+        "</entry>\n"
+        "</feed>\n"
+    ).encode("utf-8")
+
+def _request(method: str, url: str, body: bytes | None = None, headers: dict | None = None) -> tuple[int, bytes]:
+    u = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=10)
+    try:
+        conn.request(method, u.path + (f"?{u.query}" if u.query else ""), body=body, headers=headers or {})
+        r = conn.getresponse()
+        return r.status, r.read()
+    finally:
+        conn.close()
+
+class FakeHub:
+    def __init__(self, port: int = 0, verify_delay: float = 0.0):
+        self.verify_delay = verify_delay
+        self.verified = 0
+        self.rejected = 0
+        self.pushed = 0
+        self._lock = threading.Lock()
+        self._verified_cond = threading.Condition(self._lock)
+        # topic -> {callback: secret}
+        self._subs: dict[str, dict[str, str]] = {}
+        handler = type("Handler", (HubHandler,), {"app": self})
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/subscribe"
+
+    def start(self) -> "FakeHub":
+        threading.Thread(target=self.httpd.serve_forever, name="fakehub", daemon=True).start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def verify(self, mode: str, topic: str, callback: str, secret: str, lease: int):
+        """Verification of intent: GET the callback, keep the change only if the challenge comes back."""
+        if self.verify_delay:
+            time.sleep(self.verify_delay)
+        challenge = secrets.token_hex(8)
+        query = urllib.parse.urlencode({
+            "hub.mode": mode,
+            "hub.topic": topic,
+            "hub.challenge": challenge,
+            "hub.lease_seconds": str(lease),
+        })
+        sep = "&" if "?" in callback else "?"
+        try:
+            status, body = _request("GET", f"{callback}{sep}{query}")
+        except OSError:
+            status, body = 0, b""
+        with self._lock:
+            if status // 100 == 2 and body == challenge.encode("utf-8"):
+                if mode == "subscribe":
+                    self._subs.setdefault(topic, {})[callback] = secret
+                else:
+                    self._subs.get(topic, {}).pop(callback, None)
+                self.verified += 1
+            else:
+                self.rejected += 1
+            self._verified_cond.notify_all()
+
+    def wait_verified(self, n: int, timeout: float = 10.0) -> bool:
+        """Block until n verifications (accepted or not) have finished."""
+        with self._lock:
+            return self._verified_cond.wait_for(lambda: self.verified + self.rejected >= n, timeout)
+
+    def publish(self, topic: str, body: bytes) -> int:
+        """Push body to the topic's subscribers, signed with each one's secret. Returns 2xx answers."""
+        with self._lock:
+            subs = list(self._subs.get(topic, {}).items())
+        ok = 0
+        for callback, secret in subs:
+            headers = {"Content-Type": "application/atom+xml"}
+            if secret:
+                headers["X-Hub-Signature"] = "sha1=" + hmac.new(secret.encode("utf-8"), body, "sha1").hexdigest()
+            try:
+                status, _ = _request("POST", callback, body, headers)
+            except OSError:
+                continue
+            ok += status // 100 == 2
+        with self._lock:
+            self.pushed += ok
+        return ok
+
+class HubHandler(http.server.BaseHTTPRequestHandler):
+    app: FakeHub
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if url.path == "/subscribe":
+            form = {k: v[0] for k, v in urllib.parse.parse_qs(body.decode("utf-8", "replace")).items()}
+            mode, topic, callback = form.get("hub.mode"), form.get("hub.topic"), form.get("hub.callback")
+            if mode not in ("subscribe", "unsubscribe") or not topic or not callback:
+                self.send_error(400)
+                return
+            try:
+                lease = int(form.get("hub.lease_seconds", "432000"))
+            except ValueError:
+                lease = 432000
+            self.send_response(202)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            threading.Thread(
+                target=self.app.verify, args=(mode, topic, callback, form.get("hub.secret", ""), lease), daemon=True,
+            ).start()
+            return
+        if url.path == "/publish":
+            topic = urllib.parse.parse_qs(url.query).get("hub.topic", [""])[0]
+            if not topic:
+                self.send_error(400)
+                return
+            ok = self.app.publish(topic, body)
+            out = f"{ok}\n".encode("ascii")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+            return
+        self.send_error(404)
+
+    def log_message(self, *a):
+        pass
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--verify-delay", type=float, default=0.0, help="segundos antes de la verificación GET")
+    args = ap.parse_args()
+
+    hub = FakeHub(args.port, args.verify_delay)
+    print(f"==> Hub falso en {hub.url()} (publicar: POST /publish?hub.topic=<url>)")
+    try:
+        hub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n==> {hub.verified} verificadas, {hub.rejected} rechazadas, {hub.pushed} notificaciones", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
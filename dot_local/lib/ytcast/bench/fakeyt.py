@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Local YouTube stand-in for the benchmarks.
+
+  /feeds/videos.xml?channel_id=<slug>   Atom feed shaped like YouTube's
+
+Every channel has the same number of entries (one upload a day, newest
+first, fixed dates so ETags are stable across runs); each request waits
+--latency seconds first and honours If-None-Match.
+
+Standalone: fakeyt.py --channels 50 --entries 15 --latency 0.05 --write-channels channels.json
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+NEWEST = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+def channel_slugs(n: int) -> list[str]:
+    return [f"ch{i:04d}" for i in range(n)]
+
+def video_id(slug: str, i: int) -> str:
+    return f"{slug}v{i:05d}"
+
+def render_feed(slug: str, entries: int) -> bytes:
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" '
+        'xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">\n'
+        f"<title>{slug}</title>\n"
+    ]
+    for i in range(entries):
+        vid = video_id(slug, i)
+        published = (NEWEST - timedelta(days=i)).isoformat()
+        out.append(
+            "<entry>\n"
+            f"<id>yt:video:{vid}</id>\n"
+            f"<yt:videoId>{vid}</yt:videoId>\n"
+            f"<title>Episode {i}</title>\n"
+            f'<link rel="alternate" href="https://www.youtube.com/watch?v={vid}"/>\n'
+            f"<published>{published}</published>\n"
+            f"<updated>{published}</updated>\n"
+            "</entry>\n"
+        )
+    out.append("</feed>\n")
+    return "".join(out).encode("utf-8")
+
+class FeedServer:
+    def __init__(self, entries: int = 15, latency: float = 0.0, port: int = 0):
+        self.entries = entries
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._feeds: dict[str, tuple[bytes, str]] = {}
+        handler = type("Handler", (FeedHandler,), {"app": self})
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def feed(self, slug: str) -> tuple[bytes, str]:
+        with self._lock:
+            if slug not in self._feeds:
+                body = render_feed(slug, self.entries)
+                self._feeds[slug] = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+            return self._feeds[slug]
+
+    def url(self, slug: str) -> str:
+        return f"http://127.0.0.1:{self.port}/feeds/videos.xml?channel_id={slug}"
+
+    def start(self) -> "FeedServer":
+        threading.Thread(target=self.httpd.serve_forever, name="fakeyt", daemon=True).start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    app: FeedServer
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        slug = urllib.parse.parse_qs(url.query).get("channel_id", [""])[0]
+        if url.path != "/feeds/videos.xml" or not slug:
+            self.send_error(404)
+            return
+        if self.app.latency:
+            time.sleep(self.app.latency)
+        body, etag = self.app.feed(slug)
+        with self.app._lock:
+            self.app.requests += 1
+            hit = self.headers.get("If-None-Match") == etag
+            self.app.not_modified += hit
+        if hit:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+def write_channels(path: Path, slugs: list[str], server: FeedServer):
+    channels = [{"name": slug.upper(), "slug": slug, "url": server.url(slug)} for slug in slugs]
+    path.write_text(json.dumps({"channels": channels}, indent=1), encoding="utf-8")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--channels", type=int, default=50, help="canales para --write-channels")
+    ap.add_argument("--entries", type=int, default=15, help="entradas por feed (YouTube da 15)")
+    ap.add_argument("--latency", type=float, default=0.0, help="segundos de espera por petición")
+    ap.add_argument("--write-channels", default=None, help="escribir un channels.json que apunte a este servidor")
+    args = ap.parse_args()
+
+    server = FeedServer(args.entries, args.latency, args.port)
+    if args.write_channels:
+        write_channels(Path(args.write_channels), channel_slugs(args.channels), server)
+    print(f"==> Feeds falsos en http://127.0.0.1:{server.port}/feeds/videos.xml?channel_id=<slug>")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n==> {server.requests} peticiones ({server.not_modified} 304)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
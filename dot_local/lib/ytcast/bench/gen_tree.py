@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Synthetic ytcast base dir for the benchmarks: audio/<slug>/ with N
+episodes per channel plus the matching state.tsv and archive/<slug>.txt.
+
+Audio files are sparse (truncate), so 100k x 1M takes no real disk space;
+mtimes follow the upload dates, one episode a day per channel.
+
+  gen_tree.py --base-dir /tmp/ytbench --channels 100 --per-channel 1000
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from fakeyt import NEWEST, channel_slugs, video_id
+
+def generate(base_dir: Path, channels: int, per_channel: int, size: int = 1 << 20, archive_extra: int = 0) -> int:
+    """
+    archive_extra: ids per channel that are archived but no longer on disk
+    (what rotation leaves behind), for prune_state to compact.
+    Returns files created.
+    """
+    audio_dir = base_dir / "audio"
+    archive_dir = base_dir / "archive"
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    created = 0
+    with (base_dir / "state.tsv").open("w", encoding="utf-8") as state:
+        for slug in channel_slugs(channels):
+            ch_dir = audio_dir / slug
+            ch_dir.mkdir(parents=True, exist_ok=True)
+            ids = []
+            for i in range(per_channel + archive_extra):
+                vid = video_id(slug, i)
+                ids.append(vid)
+                if i >= per_channel:
+                    continue
+                day = NEWEST - timedelta(days=i)
+                upload_date = day.strftime("%Y%m%d")
+                path = ch_dir / f"{upload_date} - Episode {vid}.opus"
+                with open(path, "wb") as f:
+                    f.truncate(size)
+                ts = day.timestamp()
+                os.utime(path, (ts, ts))
+                state.write(f"{vid}\t{path.as_posix()}\t{size}\t{upload_date}\n")
+                created += 1
+            # yt-dlp appends, so the file is oldest first
+            (archive_dir / f"{slug}.txt").write_text(
+                "".join(f"youtube {vid}\n" for vid in reversed(ids)), encoding="utf-8"
+            )
+    return created
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-dir", required=True)
+    ap.add_argument("--channels", type=int, default=100)
+    ap.add_argument("--per-channel", type=int, default=1000)
+    ap.add_argument("--size", type=int, default=1 << 20, help="bytes por episodio (ficheros dispersos)")
+    ap.add_argument("--archive-extra", type=int, default=0, help="ids archivados que ya no están en disco, por canal")
+    args = ap.parse_args()
+
+    t0 = time.monotonic()
+    n = generate(Path(args.base_dir), args.channels, args.per_channel, args.size, args.archive_extra)
+    print(f"==> {n} episodios en {args.base_dir} ({time.monotonic() - t0:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Offline ytcast benchmarks: no youtube.com, yt-dlp, ffmpeg or NAS needed.
+
+Runs the real scripts (as the ytcast wrapper does) against fakeyt.py,
+the stubs.py yt-dlp/ffmpeg and a gen_tree.py base dir, and times:
+
+  download-cold / download-warm   download.py, empty dir then nothing new
+  gen-feeds-cold / gen-feeds-warm gen_feeds.py over the synthetic tree
+  rotate / prune                  rotate_global.py --keep, prune_state.py
+  serve-threads / serve-asyncio   serve.py requests/s and MB/s under load
+  websub                          websub.py renew against fakehub.py, then
+                                  signed pushes into serve.py --websub
+
+  run.py --out results.json
+  run.py --out new.json --compare results.json     (compare two revisions)
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+import fakehub
+import fakeyt
+import gen_tree
+import stubs
+
+YTCAST_DIR = Path(__file__).resolve().parent.parent
+
+# Metric compared by --compare and whether bigger is better
+KEY_METRIC = {"seconds": False, "rps": True}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def revision() -> str:
+    try:
+        p = subprocess.run(
+            ["git", "-C", str(YTCAST_DIR), "describe", "--always", "--dirty"],
+            capture_output=True, text=True,
+        )
+        return p.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+class Suite:
+    def __init__(self, work: Path, args: argparse.Namespace):
+        self.work = work
+        self.args = args
+        self.log = (work / "bench.log").open("a", encoding="utf-8")
+        self.env = dict(os.environ)
+        self.env.update({
+            "PATH": f"{stubs.install(work / 'bin')}{os.pathsep}{os.environ.get('PATH', '')}",
+            "XDG_CACHE_HOME": str(work / "cache"),
+            "XDG_STATE_HOME": str(work / "state"),
+            "YTCAST_BENCH_DL_LATENCY": str(args.dl_latency),
+            "YTCAST_BENCH_FFMPEG_LATENCY": str(args.ffmpeg_latency),
+        })
+
+    def script(self, name: str, *argv: str, run_id: str = "") -> float:
+        """Run a ytcast script, return wall seconds (startup included, like the wrapper)."""
+        env = dict(self.env, YTCAST_RUN_ID=run_id or str(time.time_ns()))
+        t0 = time.monotonic()
+        p = subprocess.run(
+            [sys.executable, str(YTCAST_DIR / name), *argv],
+            stdout=self.log, stderr=subprocess.STDOUT, env=env,
+        )
+        seconds = time.monotonic() - t0
+        if p.returncode != 0:
+            raise RuntimeError(f"{name} salió con {p.returncode} (ver {self.work / 'bench.log'})")
+        return seconds
+
+    def download(self) -> dict:
+        args = self.args
+        base = self.work / "dl"
+        server = fakeyt.FeedServer(args.entries, args.feed_latency).start()
+        try:
+            fakeyt.write_channels(self.work / "channels.json", fakeyt.channel_slugs(args.channels), server)
+            argv = (
+                "--channels", str(self.work / "channels.json"),
+                "--audio-dir", str(base / "audio"),
+                "--archive-dir", str(base / "archive"),
+                "--state", str(base / "state.tsv"),
+                "--jobs", str(args.jobs),
+            )
+            out = {}
+            for name in ("download-cold", "download-warm"):
+                before = server.requests, server.not_modified
+                seconds = self.script("download.py", *argv)
+                out[name] = {
+                    "seconds": seconds,
+                    "feed_requests": server.requests - before[0],
+                    "not_modified": server.not_modified - before[1],
+                }
+            out["download-cold"]["files"] = sum(len(files) for _, _, files in os.walk(base / "audio"))
+            return out
+        finally:
+            server.close()
+
+    def tree(self) -> dict:
+        args = self.args
+        base = self.work / "tree"
+        t0 = time.monotonic()
+        files = gen_tree.generate(base, args.tree_channels, args.per_channel, args.file_size)
+        out = {"generate": {"seconds": time.monotonic() - t0, "files": files}}
+
+        channels = self.work / "tree-channels.json"
+        channels.write_text(json.dumps({"channels": [
+            {"name": slug.upper(), "slug": slug, "url": f"http://127.0.0.1:9/{slug}"}
+            for slug in fakeyt.channel_slugs(args.tree_channels)
+        ]}), encoding="utf-8")
+        feeds_argv = (
+            "--channels", str(channels),
+            "--base-dir", str(base),
+            "--audio-dir", str(base / "audio"),
+            "--feeds-dir", str(base / "feeds"),
+            "--port", "8000",
+        )
+        out["gen-feeds-cold"] = {"seconds": self.script("gen_feeds.py", *feeds_argv)}
+        out["gen-feeds-warm"] = {"seconds": self.script("gen_feeds.py", *feeds_argv)}
+        out["rotate"] = {"seconds": self.script(
+            "rotate_global.py", "--audio-dir", str(base / "audio"), "--keep", str(args.keep),
+        )}
+        out["prune"] = {"seconds": self.script(
+            "prune_state.py", "--state", str(base / "state.tsv"), "--archive-dir", str(base / "archive"),
+        )}
+        for mode in ("threads", "asyncio"):
+            out[f"serve-{mode}"] = self.serve(base, mode)
+        return out
+
+    def serve(self, base: Path, mode: str) -> dict:
+        args = self.args
+        port = free_port()
+        p = subprocess.Popen(
+            [sys.executable, str(YTCAST_DIR / "serve.py"), "--dir", str(base), "--port", str(port), "--mode", mode,
+             "--access-log", str(self.work / f"access-{mode}.json")],
+            stdout=self.log, stderr=subprocess.STDOUT, env=self.env,
+        )
+        try:
+            wait_listening(p, port, f"serve.py --mode {mode}")
+            return load(port, self.targets(base), args.clients, args.duration, args.range_bytes)
+        finally:
+            p.terminate()
+            p.wait()
+
+    def websub(self) -> dict:
+        args = self.args
+        slugs = fakeyt.channel_slugs(args.websub_channels)
+        channels = self.work / "websub-channels.json"
+        channels.write_text(json.dumps({"channels": [
+            {"name": slug.upper(), "slug": slug, "url": f"http://127.0.0.1:9/feeds/videos.xml?channel_id={slug}"}
+            for slug in slugs
+        ]}), encoding="utf-8")
+        base = self.work / "websub"
+        (base / "feeds").mkdir(parents=True, exist_ok=True)
+        spool = self.work / "state" / "ytcast" / "websub-queue.jsonl"
+        port = free_port()
+        hub = fakehub.FakeHub().start()
+        p = subprocess.Popen(
+            [sys.executable, str(YTCAST_DIR / "serve.py"), "--dir", str(base), "--port", str(port), "--websub",
+             "--access-log", str(self.work / "access-websub.json")],
+            stdout=self.log, stderr=subprocess.STDOUT, env=self.env,
+        )
+        try:
+            wait_listening(p, port, "serve.py --websub")
+            t0 = time.monotonic()
+            self.script(
+                "websub.py", "renew", "--channels", str(channels), "--hub", hub.url(),
+                "--callback", f"http://127.0.0.1:{port}/websub",
+            )
+            if not hub.wait_verified(len(slugs), timeout=30):
+                raise RuntimeError("fakehub: verificaciones sin terminar")
+            subscribe = time.monotonic() - t0
+
+            topics = json.loads(channels.read_text(encoding="utf-8"))["channels"]
+            t0 = time.monotonic()
+            for i in range(args.websub_pushes):
+                ch = topics[i % len(topics)]
+                hub.publish(ch["url"], fakehub.notification(fakeyt.video_id(ch["slug"], 90000 + i)))
+            push = time.monotonic() - t0
+            queued = len(spool.read_text(encoding="utf-8").splitlines()) if spool.exists() else 0
+            return {"websub": {
+                "seconds": subscribe + push,
+                "subscribe_seconds": subscribe,
+                "push_seconds": push,
+                "verified": hub.verified,
+                "rejected": hub.rejected,
+                "pushed": hub.pushed,
+                "queued": queued,
+            }}
+        finally:
+            p.terminate()
+            p.wait()
+            hub.close()
+
+    def targets(self, base: Path) -> list[str]:
+        """Every feed plus the newest episode of each channel (what clients poll/play)."""
+        paths = [f"/feeds/{f.name}" for f in sorted((base / "feeds").glob("*.xml")) if ".page-" not in f.name]
+        for ch in sorted((base / "audio").iterdir()):
+            files = sorted(os.listdir(ch))
+            if files:
+                paths.append(f"/audio/{ch.name}/{files[-1]}")
+        return paths
+
+def wait_listening(p: subprocess.Popen, port: int, what: str, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline or p.poll() is not None:
+                raise RuntimeError(f"{what} no arrancó")
+            time.sleep(0.05)
+
+def load(port: int, paths: list[str], clients: int, duration: float, range_bytes: int) -> dict:
+    """clients keep-alive connections fetching paths round-robin for duration seconds."""
+    counts = {"requests": 0, "bytes": 0, "errors": 0}
+    latencies: list[float] = []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(offset: int):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        n = nbytes = errors = 0
+        lat = []
+        i = offset
+        while time.monotonic() < stop:
+            path = urllib.parse.quote(paths[i % len(paths)])
+            i += 1
+            headers = {"Range": f"bytes=0-{range_bytes - 1}"} if path.startswith("/audio/") else {}
+            t0 = time.monotonic()
+            try:
+                conn.request("GET", path, headers=headers)
+                r = conn.getresponse()
+                body = r.read()
+                if r.status not in (200, 206):
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                continue
+            lat.append(time.monotonic() - t0)
+            n += 1
+            nbytes += len(body)
+        conn.close()
+        with lock:
+            counts["requests"] += n
+            counts["bytes"] += nbytes
+            counts["errors"] += errors
+            latencies.extend(lat)
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=client, args=(k * 7,)) for k in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - t0
+    latencies.sort()
+    return {
+        "rps": counts["requests"] / elapsed,
+        "mb_per_s": counts["bytes"] / elapsed / 1e6,
+        "errors": counts["errors"],
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+
+def summarize(runs: list[dict]) -> dict:
+    """Median of every numeric metric over repeats; the raw runs are kept too."""
+    out = {}
+    for stage in runs[0]:
+        metrics = {}
+        for key, value in runs[0][stage].items():
+            values = [r[stage][key] for r in runs if r[stage].get(key) is not None]
+            metrics[key] = statistics.median(values) if values and isinstance(value, (int, float)) else value
+        metrics["runs"] = [r[stage] for r in runs]
+        out[stage] = metrics
+    return out
+
+def compare(old: dict, new: dict):
+    ignore = {"out", "compare", "work_dir", "repeat"}
+    changed = sorted(k for k, v in new["params"].items() if k not in ignore and old.get("params", {}).get(k) != v)
+    if changed:
+        print(f"WARNING: parámetros distintos ({', '.join(changed)}): la comparación no es justa", file=sys.stderr)
+    print(f"\n{'etapa':<16} {'métrica':<8} {'antes':>10} {'ahora':>10} {'cambio':>9}   ({old.get('revision')} -> {new.get('revision')})")
+    for stage, metrics in new["stages"].items():
+        before = old.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        for key, higher_better in KEY_METRIC.items():
+            if key in metrics and before.get(key):
+                delta = (metrics[key] - before[key]) / before[key] * 100
+                worse = delta < 0 if higher_better else delta > 0
+                flag = "  <-- peor" if worse and abs(delta) >= 10 else ""
+                print(f"{stage:<16} {key:<8} {before[key]:>10.3f} {metrics[key]:>10.3f} {delta:>+8.1f}%{flag}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=None, help="guardar resultados en este JSON")
+    ap.add_argument("--compare", default=None, help="JSON de una ejecución anterior con el que comparar")
+    ap.add_argument("--work-dir", default=None, help="default: dir temporal (se borra al acabar)")
+    ap.add_argument("--repeat", type=int, default=1, help="repeticiones; se guarda la mediana")
+    ap.add_argument("--only", choices=["download", "tree", "websub"], default=None, help="solo esa parte")
+    # download.py against fakeyt
+    ap.add_argument("--channels", type=int, default=50)
+    ap.add_argument("--entries", type=int, default=15, help="entradas por feed")
+    ap.add_argument("--feed-latency", type=float, default=0.05, help="segundos por petición RSS")
+    ap.add_argument("--dl-latency", type=float, default=0.0, help="segundos por vídeo en el yt-dlp falso")
+    ap.add_argument("--ffmpeg-latency", type=float, default=0.0, help="segundos por fichero en el ffmpeg falso")
+    ap.add_argument("--jobs", type=int, default=3)
+    # synthetic tree: gen_feeds / rotate / prune / serve
+    ap.add_argument("--tree-channels", type=int, default=100)
+    ap.add_argument("--per-channel", type=int, default=1000)
+    ap.add_argument("--file-size", type=int, default=1 << 20)
+    ap.add_argument("--keep", type=int, default=60, help="rotate_global --keep")
+    ap.add_argument("--clients", type=int, default=16, help="(serve) conexiones simultáneas")
+    ap.add_argument("--duration", type=float, default=5.0, help="(serve) segundos de carga por modo")
+    ap.add_argument("--range-bytes", type=int, default=256 * 1024, help="(serve) bytes por petición de audio")
+    # websub.py + serve.py --websub against fakehub
+    ap.add_argument("--websub-channels", type=int, default=50)
+    ap.add_argument("--websub-pushes", type=int, default=200, help="notificaciones firmadas que envía el hub")
+    args = ap.parse_args()
+
+    runs = []
+    for i in range(max(1, args.repeat)):
+        work = Path(args.work_dir) / f"run{i}" if args.work_dir else Path(tempfile.mkdtemp(prefix="ytcast-bench-"))
+        work.mkdir(parents=True, exist_ok=True)
+        print(f"==> Benchmark {i + 1}/{args.repeat} en {work}")
+        suite = Suite(work, args)
+        result = {}
+        try:
+            if args.only in (None, "download"):
+                result.update(suite.download())
+            if args.only in (None, "tree"):
+                result.update(suite.tree())
+            if args.only in (None, "websub"):
+                result.update(suite.websub())
+        finally:
+            suite.log.close()
+            if not args.work_dir:
+                shutil.rmtree(work, ignore_errors=True)
+        for stage, metrics in result.items():
+            shown = ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in metrics.items())
+            print(f"    {stage}: {shown}")
+        runs.append(result)
+
+    results = {
+        "revision": revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "stages": summarize(runs),
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=1), encoding="utf-8")
+        print(f"==> Resultados en {args.out}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Stand-ins for yt-dlp and ffmpeg, installed into a bin dir that goes first
+in PATH for the benchmarked scripts.
+
+yt-dlp: writes a fake audio file per URL following -o, prints --print
+after_move lines like the real one, and honours --download-archive
+(skips listed ids, appends new ones).
+ffmpeg: copies -i to the last argument.
+
+Both wait YTCAST_BENCH_DL_LATENCY / YTCAST_BENCH_FFMPEG_LATENCY seconds
+per file; YTCAST_BENCH_FILE_SIZE sets the fake download size (bytes).
+"""
+import os
+import sys
+from pathlib import Path
+
+YT_DLP = r'''
+import os, sys, time, urllib.parse
+
+args = sys.argv[1:]
+def opt(name):
+    return args[args.index(name) + 1] if name in args else None
+
+outtmpl = opt("-o") or "%(title)s.%(ext)s"
+template = opt("--print")
+archive = opt("--download-archive")
+latency = float(os.environ.get("YTCAST_BENCH_DL_LATENCY", "0"))
+size = int(os.environ.get("YTCAST_BENCH_FILE_SIZE", "65536"))
+
+done = set()
+if archive and os.path.exists(archive):
+    with open(archive, encoding="utf-8") as f:
+        done = {line.split()[-1] for line in f if line.strip()}
+
+for url in [a for a in args if a.startswith(("http://", "https://"))]:
+    vid = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get("v", [""])[0]
+    if not vid or vid in done:
+        continue
+    if latency:
+        time.sleep(latency)
+    info = {"id": vid, "title": f"Episode {vid}", "upload_date": "20260101", "ext": "webm"}
+    path = outtmpl
+    for key, value in info.items():
+        path = path.replace(f"%({key})s", value)
+    with open(path, "wb") as f:
+        f.write(os.urandom(min(size, 4096)) * max(1, size // 4096))
+    if archive:
+        with open(archive, "a", encoding="utf-8") as f:
+            f.write(f"youtube {vid}\n")
+    if template:
+        line = template.split(":", 1)[1] if template.startswith("after_move:") else template
+        for key, value in {**info, "filepath": path}.items():
+            line = line.replace(f"%({key})s", value)
+        print(line.replace("\\t", "\t"), flush=True)
+'''
+
+FFMPEG = r'''
+import os, shutil, sys, time
+
+args = sys.argv[1:]
+src = args[args.index("-i") + 1]
+latency = float(os.environ.get("YTCAST_BENCH_FFMPEG_LATENCY", "0"))
+if latency:
+    time.sleep(latency)
+shutil.copyfile(src, args[-1])
+'''
+
+def install(bin_dir: Path) -> Path:
+    """Write yt-dlp and ffmpeg into bin_dir (created). Returns bin_dir."""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, source in (("yt-dlp", YT_DLP), ("ffmpeg", FFMPEG)):
+        path = bin_dir / name
+        path.write_text(f"#!{sys.executable}\n{source.lstrip()}", encoding="utf-8")
+        os.chmod(path, 0o755)
+    return bin_dir
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("uso: stubs.py <bin-dir>")
+    print(install(Path(sys.argv[1])))
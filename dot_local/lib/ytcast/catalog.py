@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+In-memory channel + audio file catalog shared by the stages when they run
+inside one process (daemon.py). Channels come from the compiled registry
+(registry.py, recompiled only when channels.json changes), and each
+audio/<slug> listing is re-read only when the directory's mtime changes
+(or a stage that wrote to it calls invalidate()).
+"""
+import os
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from paths import AUDIO_EXTS
+from registry import Registry
+
+
+class AudioFile(NamedTuple):
+    name: str
+    path: str
+    size: int
+    mtime: float
+
+class Catalog:
+    def __init__(self, channels_path: Path, audio_dir: Path):
+        self.registry = Registry(channels_path)
+        self.audio_dir = Path(audio_dir)
+        self._lock = threading.Lock()
+        # slug -> (dir mtime_ns, files)
+        self._listings: dict[str, tuple[int, list[AudioFile]]] = {}
+
+    def channels(self) -> list[dict]:
+        return self.registry.channels()
+
+    def listing(self, slug: str) -> list[AudioFile] | None:
+        ch_dir = self.audio_dir / slug
+        try:
+            mtime = ch_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            hit = self._listings.get(slug)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+
+        files = []
+        with os.scandir(ch_dir) as it:
+            for e in it:
+                if not e.name.lower().endswith(AUDIO_EXTS):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                files.append(AudioFile(e.name, e.path, st.st_size, st.st_mtime))
+
+        with self._lock:
+            self._listings[slug] = (mtime, files)
+        return files
+
+    def invalidate(self, slug: str | None = None):
+        with self._lock:
+            if slug is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(slug, None)
@@ -1,13 +1,9 @@
 #!/usr/bin/env python3
 import argparse
 import json
-import re
+from pathlib import Path
 
-def slugify(name: str) -> str:
-    s = name.strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
-    s = re.sub(r"-+", "-", s).strip("-")
-    return s or "channel"
+import registry
 
 def main():
     ap = argparse.ArgumentParser()
@@ -15,20 +11,12 @@ def main():
     ap.add_argument("--out", dest="out", required=True)
     args = ap.parse_args()
 
-    with open(args.inp, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     out = {"by_url": {}}
-    for c in data.get("channels", []):
-        url = (c.get("url") or "").strip()
-        if not url:
-            continue
-        name = (c.get("name") or url).strip()
-        enabled = (c.get("enabled", True) is not False)
-        out["by_url"][url] = {
-            "name": name,
-            "enabled": enabled,
-            "slug": slugify(name),
+    for c in registry.load(registry.Registry(Path(args.inp)), disabled=True):
+        out["by_url"][c["url"]] = {
+            "name": c["name"],
+            "enabled": c["enabled"],
+            "slug": c["slug"],
         }
 
     with open(args.out, "w", encoding="utf-8") as f:
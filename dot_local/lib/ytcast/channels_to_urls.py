@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import argparse
-import json
+from pathlib import Path
+
+import registry
 
 def main():
     ap = argparse.ArgumentParser()
@@ -8,16 +10,7 @@ def main():
     ap.add_argument("--out", dest="out", required=True)
     args = ap.parse_args()
 
-    with open(args.inp, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    urls = []
-    for c in data.get("channels", []):
-        if c.get("enabled", True) is False:
-            continue
-        url = (c.get("url") or "").strip()
-        if url:
-            urls.append(url)
+    urls = [c["url"] for c in registry.load(registry.Registry(Path(args.inp)))]
 
     with open(args.out, "w", encoding="utf-8") as f:
         for u in urls:
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+ytcast daemon: one long-lived process that serves HTTP and runs the
+pipeline (download -> rotate -> prune -> artwork -> feeds) every
+--interval seconds, sharing one Catalog between stages. Feeds rewritten
+by a cycle are hot-swapped into the running server.
+
+SIGUSR1 starts a cycle right away (e.g. `pkill -USR1 -f ytcast/daemon.py`)
+that polls every channel, ignoring the --schedule cadence.
+
+With --websub-callback the channels are subscribed on the hub and pushed
+uploads are downloaded and published within seconds, between cycles.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import backlog
+import download
+import gen_feeds
+import generate_artwork
+import metrics
+import prune_state
+import registry
+import rotate_global
+import serve
+import websub
+from catalog import Catalog
+from engines import ENGINES, make_engine
+from episodes import EpisodeDB
+from schedule import MAX_INTERVAL, MIN_INTERVAL, PollSchedule
+
+class Pipeline:
+    def __init__(self, args: argparse.Namespace, catalog: Catalog):
+        self.args = args
+        self.catalog = catalog
+        self.base_dir = Path(args.base_dir).resolve()
+        self.audio_dir = self.base_dir / "audio"
+        self.feeds_dir = self.base_dir / "feeds"
+        self.archive_dir = self.base_dir / "archive"
+        self.artwork_dir = self.base_dir / "artwork"
+        self.state_path = self.base_dir / "state.tsv"
+        self.access_log = Path(args.access_log) if args.access_log else self.base_dir / "access.json"
+        # Reused across cycles: with --engine api yt_dlp stays imported/warm
+        self.engine = make_engine(args.engine)
+        self.db = EpisodeDB(args.db) if args.db else None
+        self.schedule = (
+            PollSchedule(Path(args.schedule), args.min_poll_interval, args.max_poll_interval, args.interval)
+            if args.schedule else None
+        )
+        self.spool = websub.Spool() if args.websub_callback else None
+        # Set by the /websub callback; the ingest thread waits on it
+        self.pushed = threading.Event()
+        # Cycles and push ingestion never run at the same time
+        self.lock = threading.Lock()
+        # Refuse to start on an unusable channels.json; later on, an edit
+        # that breaks it keeps the daemon on the last good list
+        self.last_channels = registry.load(catalog.registry)
+
+    def channels(self) -> list[dict]:
+        try:
+            self.last_channels = self.catalog.channels()
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e} (se sigue con la última lista de canales válida)", file=sys.stderr)
+        return self.last_channels
+
+    def changes(self, consumer: str) -> registry.Changes | None:
+        """None while channels.json is unusable: nothing to refresh or acknowledge."""
+        try:
+            return self.catalog.registry.changes(consumer)
+        except (OSError, ValueError):
+            return None
+
+    def mark_seen(self, consumer: str, changes: registry.Changes | None):
+        if changes is None:
+            return
+        try:
+            self.catalog.registry.mark_seen(consumer, changes)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+
+    def stage(self, name: str, fn, *a, **kw):
+        t0 = time.monotonic()
+        print(f"==> [{time.strftime('%H:%M:%S')}] {name}")
+        try:
+            # Same run report the batch scripts write, for /metrics
+            with metrics.stage(name):
+                return fn(*a, **kw)
+        except Exception:
+            # One broken stage must not take the server down
+            print(f"WARNING: stage {name} failed:\n{traceback.format_exc()}", file=sys.stderr)
+            return None
+        finally:
+            print(f"    {name}: {time.monotonic() - t0:.1f}s")
+
+    def download(self, channels: list[dict], name: str = "download", **kw) -> int | None:
+        args = self.args
+        return self.stage(
+            name, download.run,
+            channels=channels,
+            audio_dir=self.audio_dir,
+            archive_dir=self.archive_dir,
+            state_path=self.state_path,
+            audio_format=args.audio_format,
+            audio_quality=args.audio_quality,
+            cache_dir=args.cache_dir,
+            jobs=args.jobs,
+            transcode_jobs=args.transcode_jobs,
+            engine=self.engine,
+            catalog=self.catalog,
+            db=self.db,
+            staging_dir=Path(args.staging_dir) if args.staging_dir else None,
+            transfer_jobs=args.transfer_jobs,
+            schedule=self.schedule,
+            spool=self.spool,
+            **kw,
+        )
+
+    def feeds(self, channels: list[dict]):
+        args = self.args
+        updated = self.stage(
+            "feeds", gen_feeds.run,
+            channels=channels,
+            base_dir=self.base_dir,
+            audio_dir=self.audio_dir,
+            feeds_dir=self.feeds_dir,
+            port=args.port,
+            max_items=args.max_items,
+            page_size=args.page_size,
+            catalog=self.catalog,
+            db=self.db,
+        )
+        if updated and serve.RSSHandler.feeds is not None:
+            serve.RSSHandler.feeds.invalidate(updated)
+
+    def run_once(self, poll_all: bool = False):
+        with self.lock:
+            self._run_once(poll_all)
+
+    def _run_once(self, poll_all: bool):
+        args = self.args
+        # One run id per cycle (the wrapper exports one for the whole process):
+        # download and artwork share each feed fetch, the next cycle fetches again
+        os.environ["YTCAST_RUN_ID"] = f"{time.time_ns()}-{os.getpid()}"
+        channels = self.channels()
+
+        # Each stage acknowledges the channel changes it handled only if it ran through
+        if args.websub_callback:
+            changes = self.changes("websub")
+            sent = self.stage(
+                "websub", websub.renew, channels, args.websub_callback, hub=args.websub_hub,
+                drop=changes.dropped() if changes else [],
+            )
+            if sent is not None:
+                self.mark_seen("websub", changes)
+        changes = self.changes("download")
+        order = args.order or ("newest" if args.time_budget or args.byte_budget else None)
+        downloaded = self.download(
+            channels,
+            poll_all=poll_all or args.poll_all,
+            refresh={*changes.added, *changes.touched("url"), *changes.touched("enabled")} if changes else set(),
+            order=order,
+            # Fresh budget every cycle
+            budget=backlog.Budget(args.time_budget, args.byte_budget) if order else None,
+        )
+        if downloaded is not None:
+            self.mark_seen("download", changes)
+        # Rotation reads what the server has seen so far, not the last flush
+        if serve.RSSHandler.access is not None:
+            serve.RSSHandler.access.flush()
+        rank = rotate_global.load_ranker(self.access_log, self.audio_dir, args.unplayed_days, args.protect_days)
+        if args.budget is not None:
+            self.stage(
+                "rotate", rotate_global.run_budget,
+                self.audio_dir,
+                args.budget,
+                min_keep=args.min_per_channel,
+                max_keep=args.keep,
+                catalog=self.catalog,
+                db=self.db,
+                rank=rank,
+            )
+        else:
+            self.stage(
+                "rotate", rotate_global.run,
+                self.audio_dir,
+                args.keep,
+                catalog=self.catalog,
+                db=self.db,
+                rank=rank,
+            )
+        self.stage(
+            "prune", prune_state.run,
+            self.state_path,
+            self.archive_dir,
+            db=self.db,
+            archive_keep=args.archive_keep,
+        )
+        changes = self.changes("artwork")
+        made = self.stage(
+            "artwork", generate_artwork.run,
+            channels=channels,
+            artwork_dir=self.artwork_dir,
+            cache_dir=args.cache_dir,
+            refresh={*changes.added, *changes.touched("url")} if changes else set(),
+        )
+        if made is not None:
+            self.mark_seen("artwork", changes)
+        self.feeds(channels)
+
+    def ingest_forever(self, debounce: float = 5.0):
+        """Download pushed videos as they arrive; rotation waits for the next cycle."""
+        while True:
+            self.pushed.wait()
+            # A hub often notifies several videos/channels in a burst: one run for all
+            time.sleep(debounce)
+            self.pushed.clear()
+            with self.lock:
+                channels = self.channels()
+                if self.download(channels, "download-websub", poll=False):
+                    self.feeds(channels)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--channels", required=True)
+    ap.add_argument("--base-dir", required=True)
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--interval", type=int, default=3600, help="segundos entre ciclos del pipeline")
+    ap.add_argument("--keep", type=int, default=60, help="por canal; con --budget es el máximo por canal")
+    ap.add_argument("--budget", type=rotate_global.parse_size, default=None, help="presupuesto global (p.ej. 200G)")
+    ap.add_argument("--min-per-channel", type=int, default=1)
+    ap.add_argument("--audio-format", default="opus")
+    ap.add_argument("--audio-quality", default="64K")
+    ap.add_argument("--max-items", type=int, default=200)
+    ap.add_argument("--page-size", type=int, default=25, help="episodios por página de feed (RFC 5005); 0 = un solo XML")
+    ap.add_argument("--cache-dir", default=None)
+    ap.add_argument("--jobs", type=int, default=3)
+    ap.add_argument("--transcode-jobs", type=int, default=2)
+    ap.add_argument("--engine", choices=sorted(ENGINES), default="subprocess")
+    ap.add_argument("--mode", choices=["threads", "asyncio"], default="threads")
+    ap.add_argument("--max-conns", type=int, default=64, help="(asyncio) conexiones abiertas máximas")
+    ap.add_argument("--idle-timeout", type=float, default=15.0, help="(asyncio) segundos sin petición antes de cerrar")
+    ap.add_argument("--db", default=None, help="catálogo SQLite de episodios (episodes.py)")
+    ap.add_argument("--staging-dir", default=None, help="dir LOCAL para descargas antes de copiar al NAS")
+    ap.add_argument("--transfer-jobs", type=int, default=1)
+    ap.add_argument("--schedule", default=None, help="consultar cada canal según su ritmo de subidas (estado en este JSON)")
+    ap.add_argument("--poll-all", action="store_true", help="(schedule) ignorar el ritmo y consultar todo en cada ciclo")
+    ap.add_argument("--min-poll-interval", type=int, default=MIN_INTERVAL)
+    ap.add_argument("--max-poll-interval", type=int, default=MAX_INTERVAL)
+    ap.add_argument("--archive-keep", type=int, default=500, help="ids por canal en archive/<slug>.txt (0 = no compactar)")
+    ap.add_argument("--order", choices=backlog.ORDERS, default=None,
+                    help="descargas en una cola global (fecha o 'priority' del canal); lo pendiente sigue en el próximo ciclo")
+    ap.add_argument("--time-budget", type=backlog.parse_duration, default=None, help="(cola global) tiempo por ciclo, p.ej. 20m")
+    ap.add_argument("--byte-budget", type=rotate_global.parse_size, default=None, help="(cola global) bytes por ciclo, p.ej. 2G")
+    ap.add_argument("--access-log", default=None, help="contadores de escucha (default: <base-dir>/access.json)")
+    ap.add_argument("--variant-cache", default=None, help="caché de transcodificaciones ?br= (default: ~/.cache/ytcast/variants)")
+    ap.add_argument("--variant-cache-size", type=rotate_global.parse_size, default=serve.MAX_VARIANT_BYTES,
+                    help="0 = sin variantes de bitrate")
+    ap.add_argument("--unplayed-days", type=float, default=14)
+    ap.add_argument("--protect-days", type=float, default=30)
+    ap.add_argument("--websub-callback", default=None,
+                    help="URL pública de /websub de este servidor (p.ej. https://mi.host/websub): suscribe los canales en el hub")
+    ap.add_argument("--websub-hub", default=websub.HUB)
+    args = ap.parse_args()
+
+    base_dir = Path(args.base_dir).resolve()
+    if not base_dir.exists():
+        print(f"ERROR: dir no existe: {base_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    catalog = Catalog(Path(args.channels), base_dir / "audio")
+    try:
+        pipeline = Pipeline(args, catalog)
+    except RuntimeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    host = serve.setup(
+        base_dir,
+        args.port,
+        pipeline.access_log,
+        Path(args.variant_cache) if args.variant_cache else None,
+        args.variant_cache_size,
+        websub.WebSubCallback(spool=pipeline.spool, on_notify=lambda _slug: pipeline.pushed.set())
+        if pipeline.spool is not None else None,
+    )
+    server = threading.Thread(
+        target=serve.serve_forever,
+        args=(base_dir, args.port, args.mode, args.max_conns, args.idle_timeout),
+        name="http",
+        daemon=True,
+    )
+    server.start()
+    if pipeline.spool is not None:
+        threading.Thread(target=pipeline.ingest_forever, name="websub-ingest", daemon=True).start()
+
+    wake = threading.Event()
+    signal.signal(signal.SIGUSR1, lambda *_: wake.set())
+
+    try:
+        forced = False
+        while True:
+            pipeline.run_once(poll_all=forced)
+            serve.print_feeds(base_dir, host, args.port)
+            print(f"==> Próximo ciclo en {args.interval}s (SIGUSR1 para adelantarlo). CTRL+C para parar.\n")
+            forced = wake.wait(args.interval)
+            wake.clear()
+    except KeyboardInterrupt:
+        print("\nParando daemon...\n")
+    finally:
+        serve.RSSHandler.access.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,177 +1,574 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import os
 import subprocess
 import sys
-import urllib.request
-import xml.etree.ElementTree as ET
-from datetime import datetime
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-
-NS = {
-    "atom": "http://www.w3.org/2005/Atom",
-    "yt": "http://www.youtube.com/xml/schemas/2015",
+from typing import NamedTuple
+
+import archive
+import atom
+import metrics
+import registry
+import websub
+from atom import iso_key
+from backlog import MAX_TRIES, ORDERS, Backlog, Budget, Candidate, parse_duration, rank
+from engines import ENGINES, make_engine
+from episodes import EpisodeDB
+from feedcache import FeedCache
+from rotate_global import parse_size
+from schedule import MAX_INTERVAL, MIN_INTERVAL, PollSchedule
+from staging import Stager
+
+def fetch_feeds(channels: list[dict], cache: FeedCache, workers: int = 8, per_host: int = 4):
+    """
+    Fetch + parse every channel RSS concurrently.
+    Yields (channel, items, error) as each feed finishes, so downloads can
+    start while the remaining feeds are still in flight.
+    items is None when the feed is unchanged since the last processed run.
+    """
+    host_slots: dict[str, threading.BoundedSemaphore] = {}
+    lock = threading.Lock()
+
+    def slot_for(url: str) -> threading.BoundedSemaphore:
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        with lock:
+            if host not in host_slots:
+                host_slots[host] = threading.BoundedSemaphore(max(1, per_host))
+            return host_slots[host]
+
+    def work(ch: dict) -> list[atom.Entry] | None:
+        with slot_for(ch["url"]), metrics.span("fetch"):
+            rss = cache.get(ch["url"])
+        if not cache.is_new(ch["url"], "download"):
+            return None
+        with metrics.span("parse_rss"):
+            return atom.parse(rss)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(work, ch): ch for ch in channels}
+        for fut in as_completed(futures):
+            ch = futures[fut]
+            try:
+                yield ch, fut.result(), None
+            except Exception as e:
+                yield ch, [], e
+
+# --audio-format -> (ffmpeg codec, file extension), same names yt-dlp -x accepts
+AUDIO_CODECS = {
+    "opus": ("libopus", "opus"),
+    "mp3": ("libmp3lame", "mp3"),
+    "m4a": ("aac", "m4a"),
+    "aac": ("aac", "m4a"),
+    "vorbis": ("libvorbis", "ogg"),
+    "ogg": ("libvorbis", "ogg"),
+    "flac": ("flac", "flac"),
+    "wav": ("pcm_s16le", "wav"),
 }
 
-def fetch(url: str, timeout: int = 20) -> bytes:
-    req = urllib.request.Request(
-        url,
-        headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) ytcast/1.0"},
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as r:
-        return r.read()
-
-def iso_key(published: str) -> float:
-    if not published:
-        return 0.0
-    try:
-        if published.endswith("Z"):
-            published = published[:-1] + "+00:00"
-        return datetime.fromisoformat(published).timestamp()
-    except Exception:
-        return 0.0
+def transcode(src: Path, audio_format: str, audio_quality: str) -> Path:
+    codec, ext = AUDIO_CODECS.get(audio_format, (audio_format, audio_format))
+    dst = src.with_suffix(f".{ext}")
+    out = dst.with_name(f"{dst.stem}.part.{ext}") if dst == src else dst
 
-def parse_rss(xml_bytes: bytes) -> list[tuple[str, str, str]]:
-    """
-    Returns list of (published_iso, video_id, watch_url)
-    """
-    root = ET.fromstring(xml_bytes)
-    items: list[tuple[str, str, str]] = []
-
-    for entry in root.findall("atom:entry", NS):
-        published = entry.findtext("atom:published", default="", namespaces=NS) or ""
-        vid = entry.findtext("yt:videoId", default="", namespaces=NS) or ""
-
-        watch = ""
-        for link in entry.findall("atom:link", NS):
-            if link.attrib.get("rel") == "alternate":
-                href = link.attrib.get("href", "")
-                if "watch?v=" in href:
-                    watch = href
-                    break
-        if not watch and vid:
-            watch = f"https://www.youtube.com/watch?v={vid}"
-
-        if watch and vid:
-            items.append((published, vid, watch))
-
-    # newest first
-    items.sort(key=lambda t: iso_key(t[0]), reverse=True)
-    return items
-
-def yt_dlp(urls: list[str], archive_file: Path, outtmpl: str, audio_format: str, audio_quality: str) -> int:
+    q = audio_quality.strip()
+    quality = ["-b:a", q] if q[-1:].lower() == "k" else ["-q:a", q]
     cmd = [
-        "yt-dlp",
-        "--quiet",
-        "--no-warnings",
-        "--ignore-errors",
-        "--download-archive", str(archive_file),
-
-        # Avoid web/safari JS-heavy path without installing deno
-        "--extractor-args", "youtube:player_client=android,android_music",
-
-        "-f", "bestaudio/best",
-        "--extract-audio",
-        "--audio-format", audio_format,
-        "--audio-quality", audio_quality,
-        "--embed-metadata",
-        "--add-metadata",
-
-        "-o", outtmpl,
-        *urls,
+        "ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+        "-i", str(src),
+        "-vn", "-map_metadata", "0",
+        "-c:a", codec, *quality,
+        str(out),
     ]
-    return subprocess.run(cmd).returncode
-
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--channels", required=True)
-    ap.add_argument("--audio-dir", required=True)
-    ap.add_argument("--archive-dir", required=True)
-    ap.add_argument("--state", required=True)
-    ap.add_argument("--audio-format", default="opus")
-    ap.add_argument("--audio-quality", default="64K")
-    ap.add_argument("--rss-limit", type=int, default=0, help="0=todo el RSS; si no, solo N más nuevos")
-    args = ap.parse_args()
+    p = subprocess.run(cmd, capture_output=True, text=True)
+    if p.returncode != 0:
+        out.unlink(missing_ok=True)
+        raise RuntimeError(p.stderr.strip() or "ffmpeg failed")
+
+    if out != dst:
+        out.replace(dst)
+    else:
+        src.unlink(missing_ok=True)
+    return dst
+
+class Downloaded(NamedTuple):
+    video_id: str
+    path: Path  # final file in the channel dir
+    size: int
+    upload_date: str  # YYYYMMDD, "" if unknown
+    mtime: float
+
+def download_channel(
+    engine,
+    slug: str,
+    urls: list[str],
+    ch_dir: Path,
+    archive_file: Path,
+    audio_format: str,
+    audio_quality: str,
+    transcode_slots: threading.Semaphore,
+    stager: Stager | None = None,
+) -> tuple[int, list[Downloaded]]:
+    """
+    One job per channel: only this job writes ch_dir and archive_file.
+    With a stager, yt-dlp and ffmpeg work in its local dir and finished
+    files are queued for transfer into ch_dir.
+    Returns (yt-dlp returncode, files that made it to ch_dir).
+    """
+    ch_dir.mkdir(parents=True, exist_ok=True)
+    archive_file.touch(exist_ok=True)
 
-    channels_path = Path(args.channels)
-    audio_dir = Path(args.audio_dir)
-    archive_dir = Path(args.archive_dir)
-    state_path = Path(args.state)
+    work_dir = stager.workdir(slug) if stager is not None else ch_dir
+    outtmpl = str(work_dir / "%(upload_date)s - %(title)s.%(ext)s")
+    with metrics.span("yt_dlp"):
+        rc, fetched = engine.fetch(urls, outtmpl)
 
+    ready = []
+    for f in fetched:
+        try:
+            with transcode_slots, metrics.span("transcode"):
+                final = transcode(f.path, audio_format, audio_quality)
+        except Exception as e:
+            print(f"WARNING: transcode failed for {slug}/{f.path.name}: {e}", file=sys.stderr)
+            rc = rc or 1
+            continue
+        if stager is not None:
+            # Transfers overlap with the next transcode
+            ready.append((f, stager.publish(final, ch_dir / final.name)))
+        else:
+            ready.append((f._replace(path=final), None))
+
+    done = []
+    for f, transfer in ready:
+        try:
+            final = transfer.result() if transfer is not None else f.path
+            st = final.stat()
+        except Exception as e:
+            print(f"WARNING: transfer failed for {slug}/{f.path.name}: {e}", file=sys.stderr)
+            rc = rc or 1
+            continue
+        # Archive only after the final file exists, like yt-dlp does post -x
+        archive.append_ids(archive_file, [f.video_id])
+        done.append(Downloaded(f.video_id, final, st.st_size, f.upload_date, st.st_mtime))
+    return rc, done
+
+def run(
+    channels: list[dict],
+    audio_dir: Path,
+    archive_dir: Path,
+    state_path: Path,
+    audio_format: str = "opus",
+    audio_quality: str = "64K",
+    rss_limit: int = 0,
+    fetch_workers: int = 8,
+    fetch_per_host: int = 4,
+    cache_dir: str | None = None,
+    jobs: int = 3,
+    transcode_jobs: int = 2,
+    engine="subprocess",
+    catalog=None,
+    db=None,
+    staging_dir: Path | None = None,
+    transfer_jobs: int = 1,
+    schedule: PollSchedule | None = None,
+    poll_all: bool = False,
+    spool: websub.Spool | None = None,
+    poll: bool = True,
+    refresh: set[str] | None = None,
+    order: str | None = None,
+    budget: Budget | None = None,
+    backlog: Backlog | None = None,
+) -> int:
+    """
+    Download stage as a library call (CLI: main(), daemon: daemon.py).
+    engine is a name from engines.ENGINES or an engine instance to reuse.
+    staging_dir (optional, local disk) keeps yt-dlp/ffmpeg I/O off the NAS.
+    With a schedule only channels that are due are polled (poll_all: every one).
+    spool (websub.Spool): videos pushed by the hub are downloaded too, even
+    for channels whose RSS is not polled (the ones that fail go back to it,
+    up to websub.MAX_TRIES attempts); poll=False downloads only those.
+    channels are registry records; refresh: slugs polled now whatever the
+    schedule says (new feed URL, just re-enabled).
+    order ("newest" / "priority", see backlog.py): one global queue across
+    channels instead of channel by channel; budget stops it early and the
+    rest is kept in backlog for the next run, whatever its mode.
+    Returns the number of new files.
+    """
     audio_dir.mkdir(parents=True, exist_ok=True)
     archive_dir.mkdir(parents=True, exist_ok=True)
     state_path.parent.mkdir(parents=True, exist_ok=True)
     state_path.touch(exist_ok=True)
 
-    data = json.loads(channels_path.read_text(encoding="utf-8"))
-    channels = data.get("channels", [])
-
     total_new = 0
 
-    for ch in channels:
-        if ch.get("enabled", True) is False:
-            continue
+    enabled = [ch for ch in channels if ch["enabled"]]
 
-        name = (ch.get("name") or "").strip()
-        slug = (ch.get("slug") or "").strip()
-        url = (ch.get("url") or "").strip()
-        if not slug or not url:
+    # Pushed (WebSub) jobs: slug -> [(published, video_id, watch_url)], and
+    # video_id -> failed attempts so far
+    pushed: dict[str, list[atom.Entry]] = {}
+    tries: dict[str, int] = {}
+    by_slug = {ch["slug"]: ch for ch in enabled}
+    for c in spool.drain() if spool is not None else []:
+        if c.slug not in by_slug:
+            print(f"WARNING: websub: canal desconocido o desactivado: {c.slug}", file=sys.stderr)
             continue
+        pushed.setdefault(c.slug, []).append(c.entry)
+        tries[c.entry.video_id] = c.tries
+    if pushed:
+        print(f"==> WebSub: {sum(map(len, pushed.values()))} vídeos notificados en {len(pushed)} canales")
+
+    # What budgeted runs left in the backlog is owed whatever the mode: the
+    # global queue (order) merges it below, channel by channel it rides along
+    # with the pushed jobs (video_id -> failed attempts so far). Not in
+    # push-only runs (poll=False, the daemon between cycles): they have no
+    # budget, and the next polling run drains it within its own.
+    backlog = backlog or Backlog()
+    owed: dict[str, int] = {}
+    left: list[Candidate] = []
+    if order is None and poll:
+        for c in backlog.load():
+            if c.slug in by_slug and c.entry.video_id not in tries and c.entry.video_id not in owed:
+                pushed.setdefault(c.slug, []).append(c.entry)
+                owed[c.entry.video_id] = c.tries
+        if owed:
+            print(f"==> Backlog: {len(owed)} vídeos pendientes de ejecuciones anteriores")
+
+    if not poll:
+        enabled = []
+    elif schedule is not None and not poll_all:
+        due = [ch for ch in enabled if ch["slug"] in (refresh or ()) or schedule.due(ch["slug"])]
+        print(f"==> Canales a consultar: {len(due)}/{len(enabled)} (el resto aún no toca)")
+        enabled = due
+
+    if isinstance(engine, str):
+        engine = make_engine(engine)
+    bytes_before = getattr(engine, "bytes_downloaded", 0)
+
+    cache = FeedCache(cache_dir)
+    pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+    stager = None
+    try:
+        transcode_slots = threading.BoundedSemaphore(max(1, transcode_jobs))
+        stager = Stager(staging_dir, transfer_jobs) if staging_dir else None
+        pending = {}
+        # Global queue (order): candidates of every channel, and the feeds to
+        # mark as processed once the leftovers are safe in the backlog
+        queued: list[Candidate] = []
+        queued_feeds: list[str] = []
+
+        def submit(ch: dict, items: list[atom.Entry], polled: bool):
+            slug = ch["slug"]
+            # Drop ids yt-dlp already has in its archive: no yt-dlp process when
+            # nothing is new (its startup is the main cost of a caught-up run)
+            archive_file = archive_dir / f"{slug}.txt"
+            archived = archive.load_ids(archive_file)
+            items = [it for it in items if it.video_id not in archived]
+
+            if not items:
+                if polled:
+                    cache.mark_seen(ch["url"], "download")
+                return
+
+            if order is not None:
+                queued.extend(Candidate(slug, it, tries.get(it.video_id, 0)) for it in items)
+                if polled:
+                    queued_feeds.append(ch["url"])
+                return
+
+            # Build URL list (newest first)
+            urls = [watch for _, _, watch in items]
+
+            fut = pool.submit(
+                download_channel,
+                engine=engine,
+                slug=slug,
+                urls=urls,
+                ch_dir=audio_dir / slug,
+                archive_file=archive_file,
+                audio_format=audio_format,
+                audio_quality=audio_quality,
+                transcode_slots=transcode_slots,
+                stager=stager,
+            )
+            pending[fut] = (ch, polled, items)
+
+        feeds = fetch_feeds(enabled, cache, workers=fetch_workers, per_host=fetch_per_host)
+        for ch, items, err in feeds:
+            name, slug = ch["name"], ch["slug"]
+
+            print(f"==> Canal: {name or slug}")
+
+            if err is not None:
+                print(f"WARNING: RSS fetch/parse failed for {slug}: {err}", file=sys.stderr)
+                metrics.count("feed_errors", channel=slug)
+                if schedule is not None:
+                    schedule.polled(slug, None, ok=False)
+                continue
+
+            if schedule is not None:
+                schedule.polled(slug, None if items is None else [iso_key(it.published) for it in items])
+
+            if items is None:
+                if slug not in pushed:
+                    print("    RSS sin cambios, skip")
+                    metrics.count("feeds_unchanged")
+                continue
+
+            if rss_limit and rss_limit > 0:
+                items = items[: rss_limit]
+
+            # The feed usually lists the pushed videos already: one job for both
+            extra = pushed.pop(slug, [])
+            seen = {it.video_id for it in items}
+            submit(ch, items + [it for it in extra if it.video_id not in seen], polled=True)
+
+        # Pushed / owed videos of channels not polled (or unchanged) this run
+        for slug, items in pushed.items():
+            via = "WebSub" if any(it.video_id in tries for it in items) else "backlog"
+            print(f"==> Canal: {by_slug[slug]['name'] or slug} ({via})")
+            submit(by_slug[slug], items, polled=False)
+
+        def record(slug: str, done: list[Downloaded]) -> int:
+            """Register finished files. Append to state.tsv without shell quoting issues (only this thread writes it)."""
+            if not done:
+                return 0
+            # Format: video_id<TAB>absolute_path<TAB>size<TAB>upload_date
+            with state_path.open("a", encoding="utf-8") as f:
+                for d in done:
+                    f.write(f"{d.video_id}\t{d.path.as_posix()}\t{d.size}\t{d.upload_date}\n")
+            if db is not None:
+                for d in done:
+                    db.add(d.video_id, slug, d.path.as_posix(), d.size, d.upload_date, d.mtime)
+            metrics.count("downloaded", len(done), channel=slug)
+            metrics.count("downloaded_bytes", sum(d.size for d in done), channel=slug)
+            if catalog is not None:
+                catalog.invalidate(slug)
+            return len(done)
+
+        def requeue(slug: str, items: list[atom.Entry], done: list[Downloaded]):
+            """
+            Pushed videos that did not download (premieres, live streams) go back
+            to the spool, backlog ones back to the backlog.
+            """
+            ok = {d.video_id for d in done}
+            for it in items:
+                vid = it.video_id
+                if vid in ok or (vid not in tries and vid not in owed):
+                    continue
+                n = (tries[vid] if vid in tries else owed[vid]) + 1
+                if n >= (websub.MAX_TRIES if vid in tries else MAX_TRIES):
+                    print(f"WARNING: {slug}/{vid}: {n} intentos fallidos, se descarta", file=sys.stderr)
+                elif vid in tries:
+                    spool.append(slug, [it], tries=n)
+                else:
+                    left.append(Candidate(slug, it, n))
+
+        def run_queue(ranked: list[Candidate]) -> tuple[int, list[Candidate]]:
+            """Download in rank order until done or out of budget. Returns (new files, leftovers)."""
+            new = 0
+            failed: list[Candidate] = []
+            running = {}
+            busy: set[str] = set()
+            while True:
+                while len(running) < max(1, jobs) and ranked and (budget is None or budget.allows(len(running))):
+                    # Best candidate of a channel with no job running: download_channel
+                    # must stay the only writer of its channel dir and archive
+                    i = next((i for i, c in enumerate(ranked) if c.slug not in busy), None)
+                    if i is None:
+                        break
+                    c = ranked.pop(i)
+                    fut = pool.submit(
+                        download_channel,
+                        engine=engine,
+                        slug=c.slug,
+                        urls=[c.entry.url],
+                        ch_dir=audio_dir / c.slug,
+                        archive_file=archive_dir / f"{c.slug}.txt",
+                        audio_format=audio_format,
+                        audio_quality=audio_quality,
+                        transcode_slots=transcode_slots,
+                        stager=stager,
+                    )
+                    running[fut] = (c, time.monotonic())
+                    busy.add(c.slug)
+                if not running:
+                    return new, failed + ranked
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    c, t0 = running.pop(fut)
+                    busy.discard(c.slug)
+                    try:
+                        rc, done = fut.result()
+                    except Exception as e:
+                        print(f"WARNING: download failed for {c.slug}/{c.entry.video_id}: {e}", file=sys.stderr)
+                        rc, done = 1, []
+                    if budget is not None:
+                        budget.record(time.monotonic() - t0, sum(d.size for d in done))
+                    if rc != 0:
+                        print(f"WARNING: yt-dlp exit code {rc} para {c.slug}/{c.entry.video_id}", file=sys.stderr)
+                        metrics.count("download_errors", channel=c.slug)
+                    if done:
+                        new += record(c.slug, done)
+                    elif c.tries + 1 < MAX_TRIES:
+                        failed.append(c._replace(tries=c.tries + 1))
+                    else:
+                        print(f"WARNING: {c.slug}/{c.entry.video_id}: {MAX_TRIES} intentos fallidos, se descarta", file=sys.stderr)
+
+        if order is not None:
+            # Leftovers of earlier runs (keeping their failure count) + what the feeds brought
+            merged: dict[str, Candidate] = {}
+            archived_by_slug: dict[str, set[str]] = {}
+            for c in backlog.load() + queued:
+                if c.slug not in by_slug or c.entry.video_id in merged:
+                    continue
+                if c.slug not in archived_by_slug:
+                    archived_by_slug[c.slug] = archive.load_ids(archive_dir / f"{c.slug}.txt")
+                if c.entry.video_id not in archived_by_slug[c.slug]:
+                    merged[c.entry.video_id] = c
+            ranked = rank(list(merged.values()), order, {ch["slug"]: ch["priority"] for ch in by_slug.values()})
+            print(f"==> Cola global ({order}): {len(ranked)} vídeos")
+            new, left = run_queue(ranked)
+            total_new += new
+            backlog.save(left)
+            metrics.count("backlog", len(left))
+            if left:
+                why = f"presupuesto agotado ({budget.reason}), " if budget is not None and budget.reason else ""
+                print(f"==> {why}{len(left)} vídeos pendientes para la próxima ejecución")
+            # Not downloaded is not lost: the backlog has it
+            for url in queued_feeds:
+                cache.mark_seen(url, "download")
+
+        for fut in as_completed(pending):
+            ch, polled, items = pending[fut]
+            slug = ch["slug"]
+            try:
+                rc, done = fut.result()
+            except Exception as e:
+                print(f"WARNING: download failed for {slug}: {e}", file=sys.stderr)
+                metrics.count("download_errors", channel=slug)
+                requeue(slug, items, [])
+                continue
+
+            if rc != 0:
+                # yt-dlp sometimes returns 1 even if partial success; keep going
+                print(f"WARNING: yt-dlp exit code {rc} (posible parcial) para {slug}", file=sys.stderr)
+                metrics.count("download_errors", channel=slug)
+                if schedule is not None:
+                    # Don't wait a whole cadence to retry what failed
+                    schedule.polled(slug, None, ok=False)
+            elif polled:
+                # Only a clean run marks the feed as processed; partial ones retry next time
+                cache.mark_seen(ch["url"], "download")
+
+            requeue(slug, items, done)
+            total_new += record(slug, done)
+
+        if owed:
+            backlog.save(left)
+            metrics.count("backlog", len(left))
+    finally:
+        # Errors too (a DB write, a full disk): the daemon outlives this run
+        pool.shutdown(cancel_futures=True)
+        if stager is not None:
+            stager.close()
+
+    if schedule is not None:
+        schedule.save()
+    print(f"==> Descargas nuevas: {total_new}")
+    # The engine outlives the run in the daemon: report this run's share
+    downloaded = getattr(engine, "bytes_downloaded", 0) - bytes_before
+    if downloaded:
+        print(f"==> Descargado: {downloaded / 1e6:.1f} MB")
+    return total_new
 
-        print(f"==> Canal: {name or slug}")
-
-        try:
-            rss = fetch(url)
-            items = parse_rss(rss)
-        except Exception as e:
-            print(f"WARNING: RSS fetch/parse failed for {slug}: {e}", file=sys.stderr)
-            continue
-
-        if args.rss_limit and args.rss_limit > 0:
-            items = items[: args.rss_limit]
-
-        if not items:
-            continue
-
-        # Build URL list (newest first)
-        urls = [watch for _, _, watch in items]
-
-        ch_dir = audio_dir / slug
-        ch_dir.mkdir(parents=True, exist_ok=True)
-
-        archive_file = archive_dir / f"{slug}.txt"
-        archive_file.touch(exist_ok=True)
-
-        outtmpl = str(ch_dir / "%(upload_date)s - %(title)s.%(ext)s")
-
-        # Before/after to count *new* downloads without using --exec
-        before = {p.name for p in ch_dir.iterdir() if p.is_file()}
-
-        rc = yt_dlp(
-            urls=urls,
-            archive_file=archive_file,
-            outtmpl=outtmpl,
-            audio_format=args.audio_format,
-            audio_quality=args.audio_quality,
-        )
-        if rc != 0:
-            # yt-dlp sometimes returns 1 even if partial success; keep going
-            print(f"WARNING: yt-dlp exit code {rc} (posible parcial) para {slug}", file=sys.stderr)
-
-        after = {p.name for p in ch_dir.iterdir() if p.is_file()}
-        new_files = sorted(after - before)
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--channels", required=True)
+    ap.add_argument("--audio-dir", required=True)
+    ap.add_argument("--archive-dir", required=True)
+    ap.add_argument("--state", required=True)
+    ap.add_argument("--audio-format", default="opus")
+    ap.add_argument("--audio-quality", default="64K")
+    ap.add_argument("--rss-limit", type=int, default=0, help="0=todo el RSS; si no, solo N más nuevos")
+    ap.add_argument("--fetch-workers", type=int, default=8, help="RSS fetches simultáneos (global)")
+    ap.add_argument("--fetch-per-host", type=int, default=4, help="RSS fetches simultáneos por host")
+    ap.add_argument("--cache-dir", default=None, help="caché HTTP de feeds (default: ~/.cache/ytcast/feeds)")
+    ap.add_argument("--jobs", type=int, default=3, help="canales descargando a la vez")
+    ap.add_argument("--transcode-jobs", type=int, default=2, help="ffmpeg simultáneos")
+    ap.add_argument("--engine", choices=sorted(ENGINES), default="subprocess",
+                    help="subprocess: un yt-dlp por canal; api: YoutubeDL en este proceso")
+    ap.add_argument("--db", default=None, help="catálogo SQLite de episodios (episodes.py)")
+    ap.add_argument("--staging-dir", default=None, help="dir LOCAL para descargar/transcodificar antes de copiar al NAS")
+    ap.add_argument("--transfer-jobs", type=int, default=1, help="(staging) copias al NAS simultáneas")
+    ap.add_argument("--schedule", default=None,
+                    help="consultar cada canal según su ritmo de subidas (estado en este JSON)")
+    ap.add_argument("--poll-all", action="store_true", help="(schedule) consultar todos los canales esta vez")
+    ap.add_argument("--min-poll-interval", type=int, default=MIN_INTERVAL, help="(schedule) segundos")
+    ap.add_argument("--max-poll-interval", type=int, default=MAX_INTERVAL,
+                    help="(schedule) ningún canal pasa más de N segundos sin consultarse")
+    ap.add_argument("--run-interval", type=int, default=0,
+                    help="(schedule) segundos entre ejecuciones (cron/timer): lo que toque antes de la próxima se consulta ya")
+    ap.add_argument("--websub", action="store_true", help="descargar también los vídeos notificados por WebSub")
+    ap.add_argument("--websub-only", action="store_true", help="solo la cola de WebSub, sin consultar RSS")
+    ap.add_argument("--order", choices=ORDERS, default=None,
+                    help="cola global de todos los canales: por fecha de subida o por 'priority' del canal; "
+                         "lo que no se descargue queda en backlog.json para la próxima ejecución")
+    ap.add_argument("--time-budget", type=parse_duration, default=None,
+                    help="(cola global) no empezar descargas que no vayan a acabar en este tiempo, p.ej. 45m")
+    ap.add_argument("--byte-budget", type=parse_size, default=None, help="(cola global) descargar como mucho esto, p.ej. 2G")
+    ap.add_argument("--backlog", default=None, help="(cola global) default: ~/.local/state/ytcast/backlog.json")
+    args = ap.parse_args()
+    # A budget only makes sense over the global queue
+    order = args.order or ("newest" if args.time_budget or args.byte_budget else None)
 
-        # Append to state.tsv without shell quoting issues.
-        # Format: video_id<TAB>absolute_path
-        # We can't 100% map ids to files reliably without extra logic, so we store empty id.
-        if new_files:
-            with state_path.open("a", encoding="utf-8") as f:
-                for fn in new_files:
-                    f.write(f"\t{(ch_dir / fn).as_posix()}\n")
-            total_new += len(new_files)
+    reg = registry.Registry(Path(args.channels))
+    channels = registry.load(reg)
+    changes = reg.changes("download")
+    spool = None
+    if args.websub or args.websub_only:
+        spool = websub.Spool()
 
-    print(f"==> Descargas nuevas: {total_new}")
+    try:
+        with metrics.stage("download"):
+            run(
+                channels=channels,
+                audio_dir=Path(args.audio_dir),
+                archive_dir=Path(args.archive_dir),
+                state_path=Path(args.state),
+                audio_format=args.audio_format,
+                audio_quality=args.audio_quality,
+                rss_limit=args.rss_limit,
+                fetch_workers=args.fetch_workers,
+                fetch_per_host=args.fetch_per_host,
+                cache_dir=args.cache_dir,
+                jobs=args.jobs,
+                transcode_jobs=args.transcode_jobs,
+                engine=args.engine,
+                db=EpisodeDB(args.db) if args.db else None,
+                staging_dir=Path(args.staging_dir) if args.staging_dir else None,
+                transfer_jobs=args.transfer_jobs,
+                schedule=PollSchedule(
+                    Path(args.schedule),
+                    args.min_poll_interval,
+                    args.max_poll_interval,
+                    args.run_interval,
+                ) if args.schedule else None,
+                poll_all=args.poll_all,
+                spool=spool,
+                poll=not args.websub_only,
+                refresh={*changes.added, *changes.touched("url"), *changes.touched("enabled")},
+                order=order,
+                budget=Budget(args.time_budget, args.byte_budget) if order else None,
+                backlog=Backlog(Path(args.backlog) if args.backlog else None) if order else None,
+            )
+        reg.mark_seen("download", changes)
+    except RuntimeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+yt-dlp download engines used by download.py.
+
+Both engines only fetch the source audio (transcoding is done by the
+caller) and report exactly what landed on disk as Fetched records:
+
+- SubprocessEngine: one `yt-dlp` process per call (default).
+- ApiEngine: yt-dlp's Python API (YoutubeDL) inside this process, so no
+  interpreter/extractor startup per channel. Needs `import yt_dlp`.
+"""
+import os
+import subprocess
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+# Avoid web/safari JS-heavy path without installing deno
+PLAYER_CLIENTS = ["android", "android_music"]
+
+class Fetched(NamedTuple):
+    video_id: str
+    path: Path
+    upload_date: str  # YYYYMMDD, "" if unknown
+
+class SubprocessEngine:
+    name = "subprocess"
+
+    def fetch(self, urls: list[str], outtmpl: str) -> tuple[int, list[Fetched]]:
+        cmd = [
+            "yt-dlp",
+            "--quiet",
+            "--no-warnings",
+            "--ignore-errors",
+            "--no-simulate",
+
+            "--extractor-args", f"youtube:player_client={','.join(PLAYER_CLIENTS)}",
+
+            "-f", "bestaudio/best",
+            "--embed-metadata",
+            "--add-metadata",
+
+            # Exact id -> file mapping, no directory listings needed
+            "--print", "after_move:%(id)s\t%(upload_date)s\t%(filepath)s",
+
+            "-o", outtmpl,
+            *urls,
+        ]
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+        done = []
+        for line in p.stdout.splitlines():
+            parts = line.split("\t", 2)
+            if len(parts) == 3 and parts[0] and parts[2]:
+                upload_date = parts[1] if parts[1] != "NA" else ""
+                done.append(Fetched(parts[0], Path(parts[2]), upload_date))
+        return p.returncode, done
+
+class ApiEngine:
+    name = "api"
+
+    def __init__(self):
+        try:
+            import yt_dlp
+        except ImportError as e:
+            raise RuntimeError("engine 'api' necesita el módulo yt_dlp (pip install yt-dlp)") from e
+        self._yt_dlp = yt_dlp
+        self._lock = threading.Lock()
+        self.bytes_downloaded = 0
+
+    def fetch(self, urls: list[str], outtmpl: str) -> tuple[int, list[Fetched]]:
+        done: list[Fetched] = []
+
+        def progress_hook(d: dict):
+            if d.get("status") == "finished":
+                n = d.get("total_bytes") or d.get("downloaded_bytes") or 0
+                with self._lock:
+                    self.bytes_downloaded += n
+
+        def pp_hook(d: dict):
+            # MoveFiles runs last for every video; its hook gets the info as it
+            # was before the move, so rebuild the final location ourselves
+            if d.get("status") != "finished" or d.get("postprocessor") != "MoveFiles":
+                return
+            info = d.get("info_dict") or {}
+            vid = info.get("id")
+            path = info.get("filepath")
+            if vid and path:
+                final = Path(info.get("__finaldir") or os.path.dirname(path)) / os.path.basename(path)
+                done.append(Fetched(vid, final, info.get("upload_date") or ""))
+
+        opts = {
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+            "ignoreerrors": True,
+            "format": "bestaudio/best",
+            "outtmpl": {"default": outtmpl},
+            "extractor_args": {"youtube": {"player_client": PLAYER_CLIENTS}},
+            "postprocessors": [{"key": "FFmpegMetadata", "add_metadata": True}],
+            "progress_hooks": [progress_hook],
+            "postprocessor_hooks": [pp_hook],
+        }
+        with self._yt_dlp.YoutubeDL(opts) as ydl:
+            rc = ydl.download(urls)
+        return rc, done
+
+ENGINES = {
+    SubprocessEngine.name: SubprocessEngine,
+    ApiEngine.name: ApiEngine,
+}
+
+def make_engine(name: str):
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise RuntimeError(f"engine desconocido: {name}") from None
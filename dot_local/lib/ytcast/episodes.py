@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+SQLite episode catalog: one row per episode, the system of record that
+replaces crawling the SMB share (state.tsv is still written for
+compatibility, generated from here).
+
+status:
+  present   file on disk, listed in feeds
+  deleted   removed by rotation
+  missing   file vanished outside ytcast
+  archived  only known from a yt-dlp archive file (downloaded long ago)
+
+Keep the DB on local disk (default ~/.local/state/ytcast/episodes.db):
+SQLite locking over CIFS is not reliable.
+
+CLI: episodes.py migrate --db ... --state ... --archive-dir ... --audio-dir ...
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import archive
+from paths import AUDIO_EXTS, state_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    id          INTEGER PRIMARY KEY,
+    video_id    TEXT NOT NULL DEFAULT '',
+    slug        TEXT NOT NULL,
+    path        TEXT UNIQUE,
+    size        INTEGER NOT NULL DEFAULT 0,
+    published   TEXT NOT NULL DEFAULT '',
+    downloaded  REAL NOT NULL DEFAULT 0,
+    status      TEXT NOT NULL DEFAULT 'present'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS episodes_vid ON episodes(slug, video_id) WHERE video_id != '';
+CREATE INDEX IF NOT EXISTS episodes_slug ON episodes(slug, status, downloaded);
+"""
+
+
+class Episode(NamedTuple):
+    video_id: str
+    slug: str
+    path: str
+    size: int
+    published: str
+    downloaded: float
+    status: str
+
+COLUMNS = "video_id, slug, path, size, published, downloaded, status"
+
+def default_db_path() -> Path:
+    return state_dir() / "episodes.db"
+
+class EpisodeDB:
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path else default_db_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, video_id: str, slug: str, path: str, size: int, published: str = "", downloaded: float | None = None):
+        downloaded = time.time() if downloaded is None else downloaded
+        with self._lock, self._conn:
+            if video_id:
+                # An id seen before (e.g. imported from the archive) gets its new file
+                self._conn.execute(
+                    "DELETE FROM episodes WHERE slug = ? AND video_id = ? AND (path IS NULL OR path != ?)",
+                    (slug, video_id, path),
+                )
+            self._conn.execute(
+                f"INSERT INTO episodes ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, 'present') "
+                "ON CONFLICT(path) DO UPDATE SET video_id=excluded.video_id, size=excluded.size, "
+                "published=excluded.published, downloaded=excluded.downloaded, status='present'",
+                (video_id, slug, path, size, published, downloaded),
+            )
+
+    def add_archived(self, slug: str, video_ids: set[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO episodes (video_id, slug, path, status) VALUES (?, ?, NULL, 'archived')",
+                [(vid, slug) for vid in video_ids],
+            )
+
+    def present(self, slug: str | None = None) -> list[Episode]:
+        """Present episodes, newest download first."""
+        q = f"SELECT {COLUMNS} FROM episodes WHERE status = 'present'"
+        params: tuple = ()
+        if slug is not None:
+            q += " AND slug = ?"
+            params = (slug,)
+        q += " ORDER BY downloaded DESC"
+        with self._lock:
+            return [Episode(*r) for r in self._conn.execute(q, params)]
+
+    def slugs(self) -> list[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT DISTINCT slug FROM episodes WHERE status = 'present'")]
+
+    def set_status(self, paths: list[str], status: str):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE episodes SET status = ? WHERE path = ?", [(status, p) for p in paths])
+
+def migrate(db: EpisodeDB, state_path: Path, archive_dir: Path, audio_dir: Path) -> int:
+    """
+    Import state.tsv rows, the audio/<slug> files themselves (one crawl,
+    only here) and the archive ids. Safe to re-run. Returns present rows.
+    """
+    known: dict[str, tuple[str, str]] = {}
+    if state_path.exists():
+        for raw in state_path.read_text(encoding="utf-8", errors="replace").splitlines():
+            fields = raw.split("\t")
+            if len(fields) >= 2 and fields[1].strip():
+                upload_date = fields[3] if len(fields) > 3 else ""
+                known[fields[1].strip()] = (fields[0].strip(), upload_date.strip())
+
+    audio_dir = Path(audio_dir)
+    if audio_dir.is_dir():
+        for slug_entry in os.scandir(audio_dir):
+            if not slug_entry.is_dir():
+                continue
+            for e in os.scandir(slug_entry.path):
+                if not e.name.lower().endswith(AUDIO_EXTS):
+                    continue
+                st = e.stat()
+                path = Path(e.path).as_posix()
+                vid, published = known.get(path, ("", ""))
+                db.add(vid, slug_entry.name, path, st.st_size, published, st.st_mtime)
+
+    if archive_dir.is_dir():
+        for f in archive_dir.glob("*.txt"):
+            db.add_archived(f.stem, archive.load_ids(f))
+
+    return len(db.present())
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate", help="importar state.tsv, audio/ y archive/*.txt")
+    m.add_argument("--db", default=None)
+    m.add_argument("--state", required=True)
+    m.add_argument("--archive-dir", required=True)
+    m.add_argument("--audio-dir", required=True)
+    args = ap.parse_args()
+
+    db = EpisodeDB(args.db)
+    n = migrate(db, Path(args.state), Path(args.archive_dir), Path(args.audio_dir))
+    print(f"==> Catálogo: {n} episodios presentes en {db.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Persistent conditional-GET cache for channel RSS feeds.
+
+One entry per feed URL under cache_dir:
+  <key>.xml   last body received
+  <key>.json  {"url", "etag", "last_modified", "hash", "run", "seen": {consumer: hash}}
+
+- Sends If-None-Match / If-Modified-Since and reuses the cached body on 304.
+- Inside one run (YTCAST_RUN_ID, exported by the ytcast script) each feed
+  hits the network at most once, even across stages/processes.
+- is_new(url, consumer) tells "unchanged since this consumer last processed
+  it" apart from "new entries"; consumers call mark_seen() once done.
+  "Unchanged" compares the feed's (video_id, published) list, not its bytes:
+  YouTube's media:statistics (views, ratings) change on every fetch.
+"""
+import hashlib
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import atom
+from paths import cache_dir
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) ytcast/1.0"
+
+def default_cache_dir() -> Path:
+    return cache_dir() / "feeds"
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+def content_hash(body: bytes) -> str:
+    try:
+        entries = [(e.video_id, e.published) for e in atom.iter_entries(body)]
+    except ET.ParseError:
+        return hashlib.sha1(body).hexdigest()
+    return hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+
+class FeedCache:
+    def __init__(self, cache_dir: Path | None = None, run_id: str | None = None):
+        self.dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id if run_id is not None else os.environ.get("YTCAST_RUN_ID", "")
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._bodies: dict[str, bytes] = {}
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load_meta(self, key: str) -> dict:
+        try:
+            return json.loads((self.dir / f"{key}.json").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_meta(self, key: str, meta: dict):
+        _write_atomic(self.dir / f"{key}.json", json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def get(self, url: str, timeout: int = 20) -> bytes:
+        key = self._key(url)
+        with self._key_lock(key):
+            if key in self._bodies:
+                return self._bodies[key]
+
+            meta = self._load_meta(key)
+            body_path = self.dir / f"{key}.xml"
+            cached = body_path.read_bytes() if meta and body_path.exists() else None
+
+            # Already fetched earlier in this same run (e.g. by download.py)
+            if cached is not None and self.run_id and meta.get("run") == self.run_id:
+                self._bodies[key] = cached
+                return cached
+
+            headers = {"User-Agent": USER_AGENT}
+            if cached is not None:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+
+            req = urllib.request.Request(url, headers=headers)
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as r:
+                    body = r.read()
+                    etag = r.headers.get("ETag")
+                    last_modified = r.headers.get("Last-Modified")
+            except urllib.error.HTTPError as e:
+                if e.code != 304 or cached is None:
+                    raise
+                body = cached
+                etag = e.headers.get("ETag") or meta.get("etag")
+                last_modified = e.headers.get("Last-Modified") or meta.get("last_modified")
+
+            if body is not cached:
+                _write_atomic(body_path, body)
+            meta.update({
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                # 304: same body, same entries
+                "hash": content_hash(body) if body is not cached or not meta.get("hash") else meta["hash"],
+                "run": self.run_id,
+            })
+            self._save_meta(key, meta)
+            self._bodies[key] = body
+            return body
+
+    def is_new(self, url: str, consumer: str) -> bool:
+        key = self._key(url)
+        with self._key_lock(key):
+            meta = self._load_meta(key)
+        h = meta.get("hash")
+        return not h or meta.get("seen", {}).get(consumer) != h
+
+    def mark_seen(self, url: str, consumer: str):
+        key = self._key(url)
+        with self._key_lock(key):
+            meta = self._load_meta(key)
+            if not meta.get("hash"):
+                return
+            meta.setdefault("seen", {})[consumer] = meta["hash"]
+            self._save_meta(key, meta)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import html
 import json
 import mimetypes
@@ -7,113 +8,373 @@ import os
 from datetime import datetime, timezone
 from pathlib import Path
 
-AUDIO_EXTS = (".opus", ".mp3", ".m4a", ".aac", ".ogg", ".wav")
+import metrics
+import registry
+from episodes import EpisodeDB
+from paths import AUDIO_EXTS
+
+ALL_FEED = "all.xml"
+OPML = "index.opml"
 
 def rfc2822(dt: datetime) -> str:
     return dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
 
-def write_feed(feed_path: Path, title: str, description: str, items: list, base_url: str, slug: str):
-    now = datetime.now(timezone.utc)
-    with feed_path.open("w", encoding="utf-8") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write(
-            '<rss version="2.0" '
-            'xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">\n'
-        )
-        f.write("<channel>\n")
-        f.write(f"<title>{html.escape(title)}</title>\n")
-        f.write(f"<link>{html.escape(base_url)}</link>\n")
-        f.write(f"<description>{html.escape(description)}</description>\n")
-        f.write(f"<lastBuildDate>{rfc2822(now)}</lastBuildDate>\n")
-
-        # Podcast artwork (local)
-        f.write(f'<itunes:image href="{html.escape(base_url)}/artwork/{html.escape(slug)}.jpg"/>\n')
-
-        for mtime, size, rel_url, display_title, mime in items:
-            dt = datetime.fromtimestamp(mtime, tz=timezone.utc)
-            url = f"{base_url}/{rel_url}"
-            f.write("<item>\n")
-            f.write(f"  <title>{html.escape(display_title)}</title>\n")
-            f.write(f"  <link>{html.escape(url)}</link>\n")
-            f.write(f"  <guid isPermaLink='false'>{html.escape(url)}</guid>\n")
-            f.write(f"  <pubDate>{rfc2822(dt)}</pubDate>\n")
-            f.write(f"  <enclosure url='{html.escape(url)}' length='{size}' type='{html.escape(mime)}'/>\n")
-            f.write("</item>\n")
-
-        f.write("</channel>\n</rss>\n")
+def render_feed(
+    title: str,
+    description: str,
+    items: list,
+    base_url: str,
+    slug: str | None,
+    links: list[tuple[str, str]] | None = None,
+    archive: bool = False,
+) -> str:
+    """
+    RSS 2.0 document. links are (rel, feed file) pairs for RFC 5005 paging
+    (self / current / prev-archive); archive marks an immutable archive page.
+    """
+    # lastBuildDate = newest item: same items -> same bytes, so unchanged feeds
+    # can be detected by hash and left untouched
+    newest = items[0][0] if items else 0
+    paged = bool(links) or archive
+    out = []
+    out.append('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.append(
+        '<rss version="2.0" '
+        'xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"'
+        + (' xmlns:atom="http://www.w3.org/2005/Atom"'
+           ' xmlns:fh="http://purl.org/syndication/history/1.0"' if paged else "")
+        + ">\n"
+    )
+    out.append("<channel>\n")
+    out.append(f"<title>{html.escape(title)}</title>\n")
+    out.append(f"<link>{html.escape(base_url)}</link>\n")
+    out.append(f"<description>{html.escape(description)}</description>\n")
+    out.append(f"<lastBuildDate>{rfc2822(datetime.fromtimestamp(newest, tz=timezone.utc))}</lastBuildDate>\n")
+    for rel, name in links or []:
+        out.append(f'<atom:link rel="{rel}" href="{html.escape(base_url)}/feeds/{html.escape(name)}"/>\n')
+    if archive:
+        out.append("<fh:archive/>\n")
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--channels", required=True)
-    ap.add_argument("--base-dir", required=True)
-    ap.add_argument("--audio-dir", required=True)
-    ap.add_argument("--feeds-dir", required=True)
-    ap.add_argument("--port", type=int, required=True)
-    ap.add_argument("--max-items", type=int, default=200)
-    args = ap.parse_args()
+    # Podcast artwork (local)
+    if slug:
+        out.append(f'<itunes:image href="{html.escape(base_url)}/artwork/{html.escape(slug)}.jpg"/>\n')
 
-    channels_path = Path(args.channels)
-    base_dir = Path(args.base_dir).resolve()
-    audio_dir = Path(args.audio_dir).resolve()
-    feeds_dir = Path(args.feeds_dir).resolve()
-    feeds_dir.mkdir(parents=True, exist_ok=True)
+    for mtime, size, rel_url, display_title, mime in items:
+        dt = datetime.fromtimestamp(mtime, tz=timezone.utc)
+        url = f"{base_url}/{rel_url}"
+        out.append("<item>\n")
+        out.append(f"  <title>{html.escape(display_title)}</title>\n")
+        out.append(f"  <link>{html.escape(url)}</link>\n")
+        out.append(f"  <guid isPermaLink='false'>{html.escape(url)}</guid>\n")
+        out.append(f"  <pubDate>{rfc2822(dt)}</pubDate>\n")
+        out.append(f"  <enclosure url='{html.escape(url)}' length='{size}' type='{html.escape(mime)}'/>\n")
+        out.append("</item>\n")
 
-    base_url_placeholder = f"http://__HOST__:{args.port}"
+    out.append("</channel>\n</rss>\n")
+    return "".join(out)
 
-    data = json.loads(channels_path.read_text(encoding="utf-8"))
-    channels = data.get("channels", [])
+def render_opml(entries: list[tuple[str, str]], base_url: str) -> str:
+    """OPML 2.0 subscription list: (title, feed file) per outline."""
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n', '<opml version="2.0">\n']
+    out.append("<head><title>ytcast</title></head>\n<body>\n")
+    for title, name in entries:
+        t = html.escape(title)
+        out.append(f'  <outline type="rss" text="{t}" title="{t}" xmlUrl="{html.escape(base_url)}/feeds/{html.escape(name)}"/>\n')
+    out.append("</body>\n</opml>\n")
+    return "".join(out)
 
-    index = []
+def page_name(slug: str, n: int) -> str:
+    return f"{slug}.page-{n}.xml"
 
-    for ch in channels:
-        if ch.get("enabled", True) is False:
-            continue
+def paginate(pages: list[dict], items: list, page_size: int) -> tuple[list[dict], list]:
+    """
+    RFC 5005 archived feeds. pages (from the manifest, oldest first) are
+    {"n", "items": [[rel, size, mtime], ...]}: a sealed page never takes
+    new items, it only loses the ones whose files were rotated away (a page
+    left empty is dropped). New items go to the current (subscription)
+    document; once more than 2 * page_size are waiting the oldest page_size
+    are sealed into the next page, so the current document never falls
+    below page_size items for clients that ignore archive links.
+    Returns (pages, current items).
+    """
+    present = {it[2] for it in items}
+    kept = []
+    for p in pages:
+        alive = [it for it in p["items"] if it[0] in present]
+        if alive:
+            kept.append({**p, "items": alive})
+    pages = kept
+    sealed = {rel for p in pages for rel, _, _ in p["items"]}
+    current = [it for it in items if it[2] not in sealed]
+    n = pages[-1]["n"] if pages else 0
+    while len(current) > 2 * page_size:
+        n += 1
+        chunk = current[-page_size:]
+        pages.append({"n": n, "items": [[rel, size, mtime] for mtime, size, rel, _, _ in chunk]})
+        current = current[:-page_size]
+    return pages, current
 
-        name = (ch.get("name") or "").strip()
-        slug = (ch.get("slug") or "").strip()
-        if not slug:
-            continue
+def item_from(rel: str, size: int, mtime: float) -> tuple:
+    fn = rel.rsplit("/", 1)[-1]
+    return (mtime, size, rel, os.path.splitext(fn)[0], mime_for(fn))
 
-        ch_path = audio_dir / slug
-        if not ch_path.is_dir():
-            continue
+def write_if_changed(path: Path, data: bytes, known_hash: str | None = None) -> tuple[bool, str]:
+    """
+    Atomic write, skipped when the content hash matches (keeps mtime/ETag
+    stable for clients and avoids NAS writes). Returns (written, hash).
+    """
+    h = hashlib.sha1(data).hexdigest()
+    if path.exists():
+        if known_hash is None:
+            known_hash = hashlib.sha1(path.read_bytes()).hexdigest()
+        if known_hash == h:
+            return False, h
+    with metrics.span("write_feed"):
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return True, h
 
-        items = []
-        for fn in os.listdir(ch_path):
+def load_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def mime_for(fn: str) -> str:
+    mime, _ = mimetypes.guess_type(fn)
+    return mime or "audio/mpeg"
+
+def scan_channel(ch_path: Path, rel_dir: str) -> list:
+    items = []
+    with os.scandir(ch_path) as it:
+        for entry in it:
+            fn = entry.name
             if not fn.lower().endswith(AUDIO_EXTS):
                 continue
-            full = ch_path / fn
             try:
-                st = full.stat()
+                st = entry.stat()
             except FileNotFoundError:
                 continue
 
-            rel = full.resolve().relative_to(base_dir).as_posix()
-            mime, _ = mimetypes.guess_type(str(full))
-            if not mime:
-                mime = "audio/mpeg"
-            display_title = os.path.splitext(fn)[0]
-            items.append((st.st_mtime, st.st_size, rel, display_title, mime))
+            items.append(item_from(f"{rel_dir}/{fn}", st.st_size, st.st_mtime))
+    return items
 
-        items.sort(key=lambda x: x[0], reverse=True)
-        items = items[: args.max_items]
+def run(
+    channels: list[dict],
+    base_dir: Path,
+    audio_dir: Path,
+    feeds_dir: Path,
+    port: int,
+    max_items: int = 200,
+    full: bool = False,
+    catalog=None,
+    db=None,
+    page_size: int = 25,
+    all_items: int = 50,
+) -> list[str]:
+    """
+    Writes changed feeds, the all-channels feed, index.json and index.opml.
+    page_size > 0: <slug>.xml holds at most page_size newest items and links
+    to immutable <slug>.page-<n>.xml archives (max_items is then unused);
+    0 = one document with the newest max_items.
+    Returns the feed files rewritten.
+    """
+    base_dir = Path(base_dir).resolve()
+    audio_dir = Path(audio_dir).resolve()
+    feeds_dir = Path(feeds_dir).resolve()
+    feeds_dir.mkdir(parents=True, exist_ok=True)
+    manifest_dir = feeds_dir / ".manifest"
+    manifest_dir.mkdir(exist_ok=True)
 
+    base_url_placeholder = f"http://__HOST__:{port}"
+
+    index = []
+    updated = []
+    # Newest items of every channel, for all.xml: (mtime, size, rel, title, mime)
+    everything = []
+
+    for ch in channels:
+        if not ch["enabled"]:
+            continue
+        # A rename changes config below, which rebuilds just that feed
+        name, slug = ch["name"], ch["slug"]
+
+        ch_path = audio_dir / slug
+        try:
+            dir_mtime = ch_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if not ch_path.is_dir():
+            continue
+
+        rel_dir = ch_path.relative_to(base_dir).as_posix()
         feed_path = feeds_dir / f"{slug}.xml"
-        write_feed(
-            feed_path=feed_path,
-            title=f"{name} (YouTube Audio)",
-            description=f"Audio-only feed for {name}",
-            items=items,
+        manifest_path = manifest_dir / f"{slug}.json"
+        manifest = load_manifest(manifest_path)
+        config = {"name": name, "max_items": max_items, "page_size": page_size, "base_url": base_url_placeholder}
+        index.append({"slug": slug, "name": name, "file": feed_path.name, "url_path": f"/feeds/{feed_path.name}"})
+
+        try:
+            feed_mtime = feed_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            feed_mtime = None
+        # Feed touched by someone else since we wrote it: don't trust the manifest hash
+        if full or manifest.get("feed_mtime_ns") != feed_mtime:
+            manifest.pop("feed_hash", None)
+
+        # Directory mtime changes on add/remove/rename: same mtime + same
+        # config means same feed, without listing or stat-ing a single file
+        if (
+            manifest.get("dir_mtime_ns") == dir_mtime
+            and manifest.get("config") == config
+            and manifest.get("feed_hash")
+        ):
+            everything += [
+                item_from(f"{rel_dir}/{fn}", size, mtime) for fn, size, mtime in manifest.get("files", [])[:all_items]
+            ]
+            metrics.count("feeds_unchanged")
+            metrics.count("episodes", len(manifest.get("files", [])), channel=slug)
+            continue
+
+        if db is not None:
+            # ep.path is absolute on the share: keep only the file name
+            items = [
+                item_from(f"{rel_dir}/{os.path.basename(ep.path)}", ep.size, ep.downloaded)
+                for ep in db.present(slug)
+            ]
+        elif catalog is not None:
+            items = [item_from(f"{rel_dir}/{f.name}", f.size, f.mtime) for f in catalog.listing(slug) or []]
+        else:
+            with metrics.span("scan_dir"):
+                items = scan_channel(ch_path, rel_dir)
+        items.sort(key=lambda x: x[0], reverse=True)
+        metrics.count("episodes", len(items), channel=slug)
+
+        title = f"{name} (YouTube Audio)"
+        description = f"Audio-only feed for {name}"
+        # Page records are history, not cache: kept even with --full
+        old_pages = {p["n"]: p for p in manifest.get("pages", [])}
+        pages = []
+        links = []
+        if page_size > 0:
+            pages, current = paginate(list(old_pages.values()), items, page_size)
+            links = [("self", feed_path.name)]
+            if pages:
+                links.append(("prev-archive", page_name(slug, pages[-1]["n"])))
+        else:
+            items = items[: max_items]
+            current = items
+
+        for i, page in enumerate(pages):
+            page_file = feeds_dir / page_name(slug, page["n"])
+            page_links = [("self", page_file.name), ("current", feed_path.name)]
+            # Pages rotated away entirely are gone: chain to the previous one that is left
+            if i > 0:
+                page_links.append(("prev-archive", page_name(slug, pages[i - 1]["n"])))
+            xml = render_feed(
+                title=title,
+                description=description,
+                items=[item_from(*it) for it in page["items"]],
+                base_url=base_url_placeholder,
+                slug=slug,
+                links=page_links,
+                archive=True,
+            )
+            known = old_pages.get(page["n"], {}).get("hash") if not full else None
+            written, page["hash"] = write_if_changed(page_file, xml.encode("utf-8"), known)
+            if written:
+                updated.append(page_file.name)
+        kept = {p["n"] for p in pages}
+        for n in old_pages.keys() - kept:
+            (feeds_dir / page_name(slug, n)).unlink(missing_ok=True)
+            updated.append(page_name(slug, n))
+
+        xml = render_feed(
+            title=title,
+            description=description,
+            items=current,
             base_url=base_url_placeholder,
             slug=slug,
+            links=links,
         )
+        written, feed_hash = write_if_changed(feed_path, xml.encode("utf-8"), manifest.get("feed_hash"))
+        if written:
+            print(f"==> Feed actualizado: {feed_path.name}")
+            updated.append(feed_path.name)
+            metrics.count("feeds_written", channel=slug)
 
-        index.append({"slug": slug, "name": name, "file": feed_path.name, "url_path": f"/feeds/{feed_path.name}"})
+        manifest = {
+            "dir_mtime_ns": dir_mtime,
+            "config": config,
+            "files": [[rel.rsplit("/", 1)[-1], size, mtime] for mtime, size, rel, _, _ in items],
+            "feed_hash": feed_hash,
+            "feed_mtime_ns": feed_path.stat().st_mtime_ns,
+            "pages": pages,
+        }
+        write_if_changed(manifest_path, json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+        everything += items[:all_items]
+
+    if all_items > 0:
+        everything.sort(key=lambda x: x[0], reverse=True)
+        names = {e["slug"]: e["name"] or e["slug"] for e in index}
+        combined = [
+            (mtime, size, rel, f"{names.get(rel.split('/')[-2], '')}: {title}", mime)
+            for mtime, size, rel, title, mime in everything[:all_items]
+        ]
+        xml = render_feed(
+            title="ytcast (YouTube Audio)",
+            description="Newest episodes of every channel",
+            items=combined,
+            base_url=base_url_placeholder,
+            slug=None,
+        )
+        written, _ = write_if_changed(feeds_dir / ALL_FEED, xml.encode("utf-8"))
+        if written:
+            updated.append(ALL_FEED)
 
-    (feeds_dir / "index.json").write_text(
-        json.dumps({"feeds": index}, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
+    opml = [(f"{e['name'] or e['slug']} (YouTube Audio)", e["file"]) for e in index]
+    if all_items > 0:
+        opml.append(("ytcast: todos los canales", ALL_FEED))
+    written, _ = write_if_changed(feeds_dir / OPML, render_opml(opml, base_url_placeholder).encode("utf-8"))
+    if written:
+        updated.append(OPML)
+
+    write_if_changed(
+        feeds_dir / "index.json",
+        (json.dumps({"feeds": index}, ensure_ascii=False, indent=2) + "\n").encode("utf-8"),
     )
+    return updated
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--channels", required=True)
+    ap.add_argument("--base-dir", required=True)
+    ap.add_argument("--audio-dir", required=True)
+    ap.add_argument("--feeds-dir", required=True)
+    ap.add_argument("--port", type=int, required=True)
+    ap.add_argument("--max-items", type=int, default=200)
+    ap.add_argument("--full", action="store_true", help="ignorar manifests y reescanear todo")
+    ap.add_argument("--db", default=None, help="catálogo SQLite de episodios (episodes.py)")
+    ap.add_argument("--page-size", type=int, default=25,
+                    help="episodios en <slug>.xml; los anteriores van a páginas de archivo (RFC 5005). 0 = un solo XML")
+    ap.add_argument("--all-items", type=int, default=50, help="episodios en all.xml (todos los canales); 0 = no generarlo")
+    args = ap.parse_args()
+
+    channels = registry.load(registry.Registry(Path(args.channels)))
+    with metrics.stage("feeds"):
+        run(
+            channels=channels,
+            base_dir=Path(args.base_dir),
+            audio_dir=Path(args.audio_dir),
+            feeds_dir=Path(args.feeds_dir),
+            port=args.port,
+            max_items=args.max_items,
+            full=args.full,
+            page_size=args.page_size,
+            all_items=args.all_items,
+            db=EpisodeDB(args.db) if args.db else None,
+        )
 
 if __name__ == "__main__":
     main()
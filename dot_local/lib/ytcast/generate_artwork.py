@@ -1,63 +1,25 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import json
 import subprocess
 import sys
+import threading
+import time
+import urllib.error
 import urllib.request
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
 
-NS = {
-    "atom": "http://www.w3.org/2005/Atom",
-    "yt": "http://www.youtube.com/xml/schemas/2015",
-}
+import atom
+import metrics
+import registry
+from feedcache import USER_AGENT, FeedCache
+from paths import cache_dir
 
-def fetch(url: str, timeout: int = 20) -> bytes:
-    req = urllib.request.Request(
-        url,
-        headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) ytcast/1.0"},
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as r:
-        return r.read()
-
-def iso_key(published: str) -> float:
-    if not published:
-        return 0.0
-    try:
-        if published.endswith("Z"):
-            published = published[:-1] + "+00:00"
-        dt = datetime.fromisoformat(published)
-        return dt.timestamp()
-    except Exception:
-        return 0.0
-
-def parse_latest_video_url(xml_bytes: bytes) -> str | None:
-    root = ET.fromstring(xml_bytes)
-    items = []
-    for entry in root.findall("atom:entry", NS):
-        published = entry.findtext("atom:published", default="", namespaces=NS) or ""
-        link_url = ""
-
-        for link in entry.findall("atom:link", NS):
-            rel = link.attrib.get("rel", "")
-            href = link.attrib.get("href", "")
-            if rel == "alternate" and "watch?v=" in href:
-                link_url = href
-                break
-
-        if not link_url:
-            vid = entry.findtext("yt:videoId", default="", namespaces=NS) or ""
-            if vid:
-                link_url = f"https://www.youtube.com/watch?v={vid}"
-
-        if link_url:
-            items.append((published, link_url))
-
-    if not items:
-        return None
-    items.sort(key=lambda t: iso_key(t[0]), reverse=True)
-    return items[0][1]
+# Avatar URLs change when the channel changes its picture: look it up again
+# (RSS + yt-dlp -J) only this often, not on every run
+RESOLVE_EVERY = 30 * 86400
 
 def yt_dlp_json(url: str) -> dict:
     p = subprocess.run(
@@ -95,11 +57,48 @@ def pick_avatar_url(info: dict) -> str | None:
 
     return None
 
-def download(url: str, dest: Path):
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-    with urllib.request.urlopen(req, timeout=30) as r:
-        dest.write_bytes(r.read())
+def default_avatar_cache_dir() -> Path:
+    return cache_dir() / "artwork"
+
+class AvatarCache:
+    """
+    <slug>.json per channel: {"avatar_url", "etag", "last_modified",
+    "src_hash", "size", "resolved"}, so a re-run only revalidates the
+    image with a conditional GET and ffmpeg runs only if it changed.
+    """
+
+    def __init__(self, cache_dir: Path | None = None):
+        self.dir = Path(cache_dir) if cache_dir else default_avatar_cache_dir()
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def load(self, slug: str) -> dict:
+        try:
+            return json.loads((self.dir / f"{slug}.json").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self, slug: str, meta: dict):
+        path = self.dir / f"{slug}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+def download(url: str, meta: dict | None = None) -> tuple[bytes | None, str | None, str | None]:
+    """GET url, conditional on meta's etag/last_modified. (None, ...) on 304."""
+    headers = {"User-Agent": USER_AGENT}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with metrics.span("avatar_download"), urllib.request.urlopen(req, timeout=30) as r:
+            return r.read(), r.headers.get("ETag"), r.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta:
+            return None, meta.get("etag"), meta.get("last_modified")
+        raise
 
 def make_square_jpg_ffmpeg(src: Path, dst: Path, size: int):
     cmd = [
@@ -117,58 +116,155 @@ def make_square_jpg_ffmpeg(src: Path, dst: Path, size: int):
     if p.returncode != 0:
         raise RuntimeError(p.stderr.strip() or "ffmpeg failed")
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--channels", required=True)
-    ap.add_argument("--artwork-dir", required=True)
-    ap.add_argument("--size", type=int, default=3000)
-    ap.add_argument("--force", action="store_true")
-    args = ap.parse_args()
-
-    channels_path = Path(args.channels)
-    artwork_dir = Path(args.artwork_dir)
-    artwork_dir.mkdir(parents=True, exist_ok=True)
+def resolve_avatar_url(cache: FeedCache, url: str) -> str | None:
+    with metrics.span("fetch"):
+        rss = cache.get(url)
+    latest = atom.parse(rss, limit=1)
+    if not latest:
+        raise RuntimeError("no latest video in RSS")
+    with metrics.span("yt_dlp"):
+        return pick_avatar_url(yt_dlp_json(latest[0].url))
 
-    data = json.loads(channels_path.read_text(encoding="utf-8"))
-    channels = data.get("channels", [])
+def update_channel(
+    ch: dict,
+    artwork_dir: Path,
+    size: int,
+    force: bool,
+    feeds: FeedCache,
+    avatars: AvatarCache,
+    ffmpeg_slots: threading.Semaphore,
+    refresh: bool = False,
+) -> bool:
+    """True if the artwork was (re)generated. refresh: the channel's URL changed, look the avatar up again."""
+    slug, url, name = ch["slug"], ch["url"], ch["name"]
 
-    for ch in channels:
-        if ch.get("enabled", True) is False:
-            continue
-        slug = (ch.get("slug") or "").strip()
-        url = (ch.get("url") or "").strip()
-        name = (ch.get("name") or slug).strip()
+    out_jpg = artwork_dir / f"{slug}.jpg"
+    if out_jpg.exists() and not (force or refresh):
+        return False
 
-        if not slug or not url:
-            continue
+    meta = avatars.load(slug)
+    if refresh:
+        # Same bytes as before still skip ffmpeg
+        meta = {"src_hash": meta.get("src_hash"), "size": meta.get("size")}
+    have_output = out_jpg.exists() and meta.get("size") == size
 
-        out_jpg = artwork_dir / f"{slug}.jpg"
-        if out_jpg.exists() and not args.force:
-            print(f"==> Artwork existe, skip: {out_jpg.name}")
-            continue
+    try:
+        avatar_url = meta.get("avatar_url")
+        fresh = False
+        if not avatar_url or time.time() - meta.get("resolved", 0) > RESOLVE_EVERY:
+            avatar_url = resolve_avatar_url(feeds, url)
+            fresh = True
+            if not avatar_url:
+                print(f"WARNING: no avatar found for {slug}", file=sys.stderr)
+                return False
 
-        print(f"==> Generando artwork (avatar): {name}")
+        if avatar_url != meta.get("avatar_url"):
+            # New URL: validators no longer apply, the source hash still does
+            meta = {"avatar_url": avatar_url, "src_hash": meta.get("src_hash"), "size": meta.get("size")}
+        if fresh:
+            meta["resolved"] = time.time()
 
         try:
-            rss = fetch(url)
-            latest_video = parse_latest_video_url(rss)
-            if not latest_video:
-                print(f"WARNING: no latest video in RSS for {slug}", file=sys.stderr)
-                continue
-
-            info = yt_dlp_json(latest_video)
-            avatar_url = pick_avatar_url(info)
+            body, etag, last_modified = download(avatar_url, meta if have_output else None)
+        except urllib.error.HTTPError as e:
+            if e.code not in (403, 404, 410) or fresh:
+                raise
+            # Stale avatar URL: look it up again once
+            avatar_url = resolve_avatar_url(feeds, url)
             if not avatar_url:
                 print(f"WARNING: no avatar found for {slug}", file=sys.stderr)
-                continue
+                return False
+            meta = {"avatar_url": avatar_url, "resolved": time.time(), "src_hash": meta.get("src_hash"), "size": meta.get("size")}
+            body, etag, last_modified = download(avatar_url)
 
-            tmp = artwork_dir / f".{slug}.tmp"
-            download(avatar_url, tmp)
-            make_square_jpg_ffmpeg(tmp, out_jpg, args.size)
+        meta["etag"], meta["last_modified"] = etag, last_modified
+        src_hash = hashlib.sha1(body).hexdigest() if body is not None else meta.get("src_hash")
+        if have_output and src_hash == meta.get("src_hash"):
+            avatars.save(slug, meta)
+            return False
+
+        print(f"==> Generando artwork (avatar): {name}")
+        tmp = artwork_dir / f".{slug}.tmp"
+        tmp.write_bytes(body)
+        try:
+            with ffmpeg_slots, metrics.span("ffmpeg"):
+                make_square_jpg_ffmpeg(tmp, out_jpg, size)
+        finally:
             tmp.unlink(missing_ok=True)
+        meta["src_hash"] = src_hash
+        meta["size"] = size
+        avatars.save(slug, meta)
+        metrics.count("generated", channel=slug)
+        return True
+
+    except Exception as e:
+        print(f"WARNING: artwork failed for {slug}: {e}", file=sys.stderr)
+        metrics.count("errors", channel=slug)
+        return False
+
+def run(
+    channels: list[dict],
+    artwork_dir: Path,
+    size: int = 3000,
+    force: bool = False,
+    cache_dir: str | None = None,
+    avatar_cache_dir: str | None = None,
+    workers: int = 8,
+    ffmpeg_jobs: int = 2,
+    refresh: set[str] | None = None,
+):
+    """
+    Channel artwork from the YouTube avatar. With force, every channel is
+    revalidated (conditional GET on the cached avatar URL) but ffmpeg only
+    runs for avatars whose bytes changed. refresh: slugs whose avatar is
+    resolved again from scratch (new or changed channel URL).
+    """
+    artwork_dir.mkdir(parents=True, exist_ok=True)
+    feeds = FeedCache(cache_dir)
+    avatars = AvatarCache(avatar_cache_dir)
+    ffmpeg_slots = threading.Semaphore(max(1, ffmpeg_jobs))
+
+    refresh = refresh or set()
+    todo = [ch for ch in channels if ch["enabled"]]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(
+                update_channel, ch, artwork_dir, size, force, feeds, avatars, ffmpeg_slots, ch["slug"] in refresh
+            )
+            for ch in todo
+        ]
+    made = sum(f.result() for f in futures)
+    print(f"==> Artwork: {made} generadas, {len(todo) - made} sin cambios")
+    return made
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--channels", required=True)
+    ap.add_argument("--artwork-dir", required=True)
+    ap.add_argument("--size", type=int, default=3000)
+    ap.add_argument("--force", action="store_true")
+    ap.add_argument("--cache-dir", default=None, help="caché HTTP de feeds (default: ~/.cache/ytcast/feeds)")
+    ap.add_argument("--avatar-cache-dir", default=None, help="caché de avatares (default: ~/.cache/ytcast/artwork)")
+    ap.add_argument("--workers", type=int, default=8, help="canales en paralelo (red)")
+    ap.add_argument("--ffmpeg-jobs", type=int, default=2, help="ffmpeg simultáneos")
+    args = ap.parse_args()
 
-        except Exception as e:
-            print(f"WARNING: artwork failed for {slug}: {e}", file=sys.stderr)
+    reg = registry.Registry(Path(args.channels))
+    channels = registry.load(reg)
+    changes = reg.changes("artwork")
+    with metrics.stage("artwork"):
+        run(
+            channels=channels,
+            artwork_dir=Path(args.artwork_dir),
+            size=args.size,
+            force=args.force,
+            cache_dir=args.cache_dir,
+            avatar_cache_dir=args.avatar_cache_dir,
+            workers=args.workers,
+            ffmpeg_jobs=args.ffmpeg_jobs,
+            refresh={*changes.added, *changes.touched("url")},
+        )
+        reg.mark_seen("artwork", changes)
 
 if __name__ == "__main__":
     main()
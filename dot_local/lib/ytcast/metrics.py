@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Timing spans and counters for the pipeline stages, and the Prometheus
+text exposition serve.py publishes on /metrics.
+
+Stages wrap slow steps in `with span("fetch"):` and count() what they did
+(per channel when it applies); write_report("download") at the end of a
+stage leaves a JSON run report in ~/.local/state/ytcast/runs/<stage>.json
+(last run of each stage). Span seconds are summed over calls, so steps
+running in parallel threads can add up to more than the stage wall time.
+
+/metrics = those reports + live HTTP counters of the serving process.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from paths import state_dir
+
+# Request latency buckets (seconds to response headers)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUTES = {"feeds": "feed", "audio": "audio", "v": "variant", "artwork": "artwork", "websub": "websub", "metrics": "metrics"}
+
+def default_reports_dir() -> Path:
+    return state_dir() / "runs"
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            # name -> [calls, total seconds, max seconds]
+            self.spans: dict[str, list] = {}
+            # (name, channel or "") -> value
+            self.counts: dict[tuple[str, str], float] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                s = self.spans.setdefault(name, [0, 0.0, 0.0])
+                s[0] += 1
+                s[1] += dt
+                s[2] = max(s[2], dt)
+
+    def count(self, name: str, value: float = 1, channel: str | None = None):
+        key = (name, channel or "")
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def report(self, stage: str, ok: bool = True) -> dict:
+        now = time.time()
+        with self._lock:
+            counts: dict[str, dict[str, float]] = {}
+            for (name, channel), value in sorted(self.counts.items()):
+                counts.setdefault(name, {})[channel] = value
+            return {
+                "stage": stage,
+                "ok": ok,
+                "run_id": os.environ.get("YTCAST_RUN_ID", ""),
+                "started": self.started,
+                "finished": now,
+                "seconds": now - self.started,
+                "spans": {
+                    name: {"calls": calls, "seconds": total, "max": longest}
+                    for name, (calls, total, longest) in sorted(self.spans.items())
+                },
+                # "" = not per channel
+                "counts": counts,
+            }
+
+RECORDER = Recorder()
+span = RECORDER.span
+count = RECORDER.count
+
+def write_report(stage: str, ok: bool = True, reports_dir: Path | None = None) -> Path:
+    """Save the stage's run report and start a fresh recording."""
+    d = Path(reports_dir) if reports_dir else default_reports_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / f"{stage}.json"
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(RECORDER.report(stage, ok), indent=1), encoding="utf-8")
+    tmp.replace(path)
+    RECORDER.reset()
+    return path
+
+@contextmanager
+def stage(name: str, reports_dir: Path | None = None):
+    """Record one stage run: fresh recording in, run report out (ok=False if it raised)."""
+    RECORDER.reset()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        try:
+            write_report(name, ok, reports_dir)
+        except OSError as e:
+            print(f"WARNING: no se pudo guardar el informe de {name}: {e}", file=sys.stderr)
+
+def load_reports(reports_dir: Path | None = None) -> list[dict]:
+    d = Path(reports_dir) if reports_dir else default_reports_dir()
+    out = []
+    for f in sorted(d.glob("*.json")) if d.is_dir() else []:
+        try:
+            out.append(json.loads(f.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return out
+
+def route_for(path: str) -> str:
+    """URL path -> low-cardinality route label."""
+    return ROUTES.get(path.lstrip("/").split("/", 1)[0], "other")
+
+def label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def number(value) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+class ServeMetrics:
+    """Live counters of serve.py (both modes)."""
+
+    def __init__(self, reports_dir: Path | None = None):
+        self.reports_dir = reports_dir
+        self._lock = threading.Lock()
+        self.requests: dict[tuple[str, int], int] = {}
+        self.sent: dict[str, int] = {}
+        self.active = 0
+        # route -> [bucket counts..., +Inf], sum
+        self.hist: dict[str, list] = {}
+        self.hist_sum: dict[str, float] = {}
+
+    def observe(self, route: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[(route, status)] = self.requests.get((route, status), 0) + 1
+            h = self.hist.setdefault(route, [0] * (len(BUCKETS) + 1))
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    h[i] += 1
+                    break
+            else:
+                h[-1] += 1
+            self.hist_sum[route] = self.hist_sum.get(route, 0.0) + seconds
+
+    def add_sent(self, route: str, n: int):
+        with self._lock:
+            self.sent[route] = self.sent.get(route, 0) + n
+
+    @contextmanager
+    def stream(self):
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def render(self) -> bytes:
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, help_: str, samples: list[tuple[str, float]]):
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {number(value)}" for labels, value in samples)
+
+        reports = load_reports(self.reports_dir)
+        metric("ytcast_stage_duration_seconds", "gauge", "Wall time of the last run of each stage.",
+               [(f'{{stage="{label(r["stage"])}"}}', float(r["seconds"])) for r in reports])
+        metric("ytcast_stage_last_run_timestamp_seconds", "gauge", "When the last run of each stage finished.",
+               [(f'{{stage="{label(r["stage"])}"}}', float(r["finished"])) for r in reports])
+        metric("ytcast_stage_success", "gauge", "1 if the last run of the stage completed.",
+               [(f'{{stage="{label(r["stage"])}"}}', int(r.get("ok", True))) for r in reports])
+        metric("ytcast_span_seconds", "gauge", "Time spent in a step during the last stage run (summed over calls).",
+               [(f'{{stage="{label(r["stage"])}",span="{label(n)}"}}', float(s["seconds"]))
+                for r in reports for n, s in r.get("spans", {}).items()])
+        metric("ytcast_span_calls", "gauge", "Calls of a step during the last stage run.",
+               [(f'{{stage="{label(r["stage"])}",span="{label(n)}"}}', int(s["calls"]))
+                for r in reports for n, s in r.get("spans", {}).items()])
+        metric("ytcast_span_max_seconds", "gauge", "Slowest single call of a step during the last stage run.",
+               [(f'{{stage="{label(r["stage"])}",span="{label(n)}"}}', float(s["max"]))
+                for r in reports for n, s in r.get("spans", {}).items()])
+        metric("ytcast_stage_count", "gauge", "What the last stage run did, per channel where it applies.",
+               [(f'{{stage="{label(r["stage"])}",name="{label(n)}",channel="{label(ch)}"}}', v)
+                for r in reports for n, per in r.get("counts", {}).items() for ch, v in per.items()])
+
+        with self._lock:
+            requests = sorted(self.requests.items())
+            sent = sorted(self.sent.items())
+            active = self.active
+            hist = {route: (list(h), self.hist_sum[route]) for route, h in sorted(self.hist.items())}
+        metric("ytcast_http_requests_total", "counter", "HTTP requests served.",
+               [(f'{{route="{route}",code="{status}"}}', n) for (route, status), n in requests])
+        metric("ytcast_http_sent_bytes_total", "counter", "Response body bytes sent.",
+               [(f'{{route="{route}"}}', n) for route, n in sent])
+        metric("ytcast_http_active_streams", "gauge", "File bodies being sent right now.", [("", active)])
+
+        samples = []
+        for route, (h, total) in hist.items():
+            acc = 0
+            for le, n in zip(BUCKETS, h):
+                acc += n
+                samples.append((f'_bucket{{route="{route}",le="{le:g}"}}', acc))
+            acc += h[-1]
+            samples.append((f'_bucket{{route="{route}",le="+Inf"}}', acc))
+            samples.append((f'_sum{{route="{route}"}}', total))
+            samples.append((f'_count{{route="{route}"}}', acc))
+        lines.append("# HELP ytcast_http_request_duration_seconds Time until the response headers were sent.")
+        lines.append("# TYPE ytcast_http_request_duration_seconds histogram")
+        lines.extend(f"ytcast_http_request_duration_seconds{suffix} {number(value)}" for suffix, value in samples)
+        return ("\n".join(lines) + "\n").encode("utf-8")
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Locations and file types shared by every stage.
+
+State (catalog, backlog, schedule, WebSub, run reports) lives under
+$XDG_STATE_HOME/ytcast, rebuildable caches (feeds, artwork, variants)
+under $XDG_CACHE_HOME/ytcast.
+"""
+import os
+from pathlib import Path
+
+AUDIO_EXTS = (".opus", ".mp3", ".m4a", ".aac", ".ogg", ".wav")
+
+def state_dir() -> Path:
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return Path(base) / "ytcast"
+
+def cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "ytcast"
@@ -3,33 +3,112 @@ import argparse
 import os
 from pathlib import Path
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--state", required=True)
-    ap.add_argument("--archive-dir", required=True)
-    args = ap.parse_args()
+import archive
+import metrics
+from episodes import EpisodeDB
+
+def write_state(state_path: Path, rows: list[str]):
+    tmp = state_path.with_suffix(".tmp")
+    tmp.write_text("\n".join(rows) + ("\n" if rows else ""), encoding="utf-8")
+    tmp.replace(state_path)
+
+def existing(paths: list[str]) -> set[str]:
+    """Which of `paths` exist, with one scandir per directory instead of a stat per file."""
+    by_dir: dict[str, set[str]] = {}
+    for p in paths:
+        by_dir.setdefault(os.path.dirname(p), set()).add(os.path.basename(p))
+
+    found = set()
+    for d, names in by_dir.items():
+        try:
+            with os.scandir(d or ".") as it:
+                present = {e.name for e in it}
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        found.update(os.path.join(d, n) for n in names & present)
+    return found
+
+def compact_archives(archive_dir: Path, present: dict[str, set[str]], window: int) -> int:
+    """Bound every archive/<slug>.txt, never dropping ids still on disk. Returns lines dropped."""
+    if window <= 0 or not archive_dir.is_dir():
+        return 0
+    dropped = 0
+    for f in archive_dir.glob("*.txt"):
+        dropped += archive.compact(f, window, present.get(f.stem, set()))
+    return dropped
+
+def run(state_path: Path, archive_dir: Path, db=None, archive_keep: int = 500) -> int:
+    """
+    Drop state.tsv rows whose file no longer exists (with a db: mark those
+    episodes missing) and compact the archive files to their last
+    `archive_keep` ids (0 = don't touch them).
+    Returns rows kept.
+    """
+    present: dict[str, set[str]] = {}
+
+    if db is not None:
+        # The catalog is the source of truth: state.tsv is just an export of it.
+        # Files deleted by hand are marked missing so no stage serves them.
+        eps = list(reversed(db.present()))
+        with metrics.span("scan_dir"):
+            found = existing([ep.path for ep in eps if ep.path])
+        gone = [ep.path for ep in eps if ep.path and ep.path not in found]
+        if gone:
+            db.set_status(gone, "missing")
+            eps = [ep for ep in eps if ep.path in found]
+        metrics.count("state_rows_dropped", len(gone))
+        kept = [f"{ep.video_id}\t{ep.path}\t{ep.size}\t{ep.published}" for ep in eps]
+        write_state(state_path, kept)
+        for ep in eps:
+            if ep.video_id:
+                present.setdefault(ep.slug, set()).add(ep.video_id)
+        with metrics.span("compact_archives"):
+            metrics.count("archive_ids_dropped", compact_archives(archive_dir, present, archive_keep))
+        return len(kept)
 
-    state_path = Path(args.state)
     if not state_path.exists():
-        return
+        return 0
 
-    kept = []
+    rows = []
     for raw in state_path.read_text(encoding="utf-8", errors="replace").splitlines():
         if not raw.strip():
             continue
 
+        # video_id<TAB>path[<TAB>size<TAB>upload_date]; legacy rows are just a path
         if "\t" in raw:
-            _, path = raw.split("\t", 1)
-            path = path.strip()
+            fields = raw.split("\t")
+            rows.append((raw, fields[0].strip(), fields[1].strip()))
         else:
-            path = raw.strip()
+            rows.append((f"\t{raw.strip()}", "", raw.strip()))
+
+    with metrics.span("scan_dir"):
+        found = existing([path for _, _, path in rows if path])
+    kept = []
+    for raw, vid, path in rows:
+        if path in found:
+            kept.append(raw)
+            if vid:
+                # audio/<slug>/<file>
+                present.setdefault(os.path.basename(os.path.dirname(path)), set()).add(vid)
 
-        if path and os.path.exists(path):
-            kept.append(f"\t{path}")
+    metrics.count("state_rows_dropped", len(rows) - len(kept))
+    write_state(state_path, kept)
+    with metrics.span("compact_archives"):
+        metrics.count("archive_ids_dropped", compact_archives(archive_dir, present, archive_keep))
+    return len(kept)
 
-    tmp = state_path.with_suffix(".tmp")
-    tmp.write_text("\n".join(kept) + ("\n" if kept else ""), encoding="utf-8")
-    tmp.replace(state_path)
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--state", required=True)
+    ap.add_argument("--archive-dir", required=True)
+    ap.add_argument("--db", default=None, help="catálogo SQLite de episodios (episodes.py)")
+    ap.add_argument("--archive-keep", type=int, default=500,
+                    help="ids por canal que se conservan en archive/<slug>.txt (0 = no compactar)")
+    args = ap.parse_args()
+
+    db = EpisodeDB(args.db) if args.db else None
+    with metrics.stage("prune"):
+        run(Path(args.state), Path(args.archive_dir), db=db, archive_keep=args.archive_keep)
 
 if __name__ == "__main__":
     main()
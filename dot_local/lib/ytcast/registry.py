@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Compiled channel registry: channels.json validated once into records
+{"slug", "name", "url", "enabled"} that every stage trusts as-is.
+
+Rules (one place for all of them): url is required; name defaults to the
+slug; slug defaults to slugify(name or url) and must be a safe directory
+name; a repeated url or slug keeps the first entry and warns; anything
+but enabled: false is enabled; priority (download --order priority) is a
+number >= 0, default 1.
+
+The compiled list is cached next to the config (.channels.registry.json)
+with the source mtime/size/sha256, so an unchanged file is not parsed
+again and a touched-but-identical one is not recompiled. The same file
+keeps, per consumer stage, the channels it last handled: changes("artwork")
+says what was added, removed or edited since then, and
+mark_seen("artwork", changes) acknowledges it once the stage is done. A
+consumer with no snapshot yet gets no changes (its first run handles
+every channel anyway).
+
+CLI: registry.py --channels channels.json [--consumer NAME [--mark-seen]]
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+# Bumped when records change shape: older caches are recompiled
+VERSION = 2
+FIELDS = ("name", "url", "enabled")
+SLUG_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+# all.xml is the combined feed (gen_feeds.ALL_FEED)
+RESERVED = {"all"}
+
+class Changes(NamedTuple):
+    added: list[str]
+    removed: list[str]
+    # slug -> fields that differ ("name", "url", "enabled")
+    changed: dict[str, list[str]]
+    # what mark_seen() records: the channels these changes lead to
+    snapshot: dict[str, dict]
+
+    def any(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def touched(self, field: str) -> set[str]:
+        return {slug for slug, fields in self.changed.items() if field in fields}
+
+    def dropped(self) -> list[str]:
+        """Removed or disabled since the last run."""
+        return self.removed + sorted(s for s in self.touched("enabled") if not self.snapshot[s]["enabled"])
+
+def slugify(name: str) -> str:
+    s = name.strip().lower()
+    s = re.sub(r"[^a-z0-9]+", "-", s)
+    s = re.sub(r"-+", "-", s).strip("-")
+    return s or "channel"
+
+def compile_channels(data) -> list[dict]:
+    """channels.json contents -> validated, deduplicated records. ValueError if the shape is wrong."""
+    raw = data.get("channels", []) if isinstance(data, dict) else None
+    if not isinstance(raw, list):
+        raise ValueError('se esperaba {"channels": [...]}')
+    out = []
+    slugs: set[str] = set()
+    urls: set[str] = set()
+    for i, c in enumerate(raw, 1):
+        if not isinstance(c, dict):
+            print(f"WARNING: canal #{i}: no es un objeto, ignorado", file=sys.stderr)
+            continue
+        url = str(c.get("url") or "").strip()
+        name = str(c.get("name") or "").strip()
+        slug = str(c.get("slug") or "").strip() or slugify(name or url)
+        if not url:
+            print(f"WARNING: canal #{i} ({name or slug}): sin url, ignorado", file=sys.stderr)
+            continue
+        if not SLUG_RE.match(slug) or slug in RESERVED:
+            print(f"WARNING: canal #{i}: slug no válido o reservado: {slug!r}, ignorado", file=sys.stderr)
+            continue
+        if slug in slugs:
+            print(f"WARNING: canal #{i}: slug repetido: {slug}, ignorado", file=sys.stderr)
+            continue
+        if url in urls:
+            print(f"WARNING: canal #{i} ({slug}): url repetida, ignorado", file=sys.stderr)
+            continue
+        priority = c.get("priority", 1)
+        if isinstance(priority, bool) or not isinstance(priority, (int, float)) or priority < 0:
+            print(f"WARNING: canal #{i} ({slug}): priority no válida: {priority!r}, se usa 1", file=sys.stderr)
+            priority = 1
+        slugs.add(slug)
+        urls.add(url)
+        out.append({
+            "slug": slug,
+            "name": name or slug,
+            "url": url,
+            "enabled": c.get("enabled", True) is not False,
+            "priority": priority,
+        })
+    return out
+
+def snapshot_of(channels: list[dict]) -> dict[str, dict]:
+    return {ch["slug"]: {k: ch[k] for k in FIELDS} for ch in channels}
+
+def diff(old: dict[str, dict], new: dict[str, dict]) -> Changes:
+    changed = {}
+    for slug in old.keys() & new.keys():
+        fields = [k for k in FIELDS if old[slug].get(k) != new[slug][k]]
+        if fields:
+            changed[slug] = fields
+    return Changes(sorted(new.keys() - old.keys()), sorted(old.keys() - new.keys()), changed, new)
+
+class Registry:
+    def __init__(self, channels_path: Path, cache_path: Path | None = None):
+        self.channels_path = Path(channels_path)
+        self.cache_path = (
+            Path(cache_path) if cache_path
+            else self.channels_path.with_name(f".{self.channels_path.stem}.registry.json")
+        )
+        self._lock = threading.Lock()
+        # (mtime_ns, size) of the source the in-memory state belongs to
+        self._stat: tuple[int, int] | None = None
+        self._state: dict = {}
+
+    def _load_cache(self) -> dict:
+        try:
+            return json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_cache(self, seen: dict | None = None):
+        # "seen" always comes from disk: other stages may run in other processes
+        if seen is None:
+            seen = self._load_cache().get("seen", {})
+        try:
+            tmp = self.cache_path.with_name(f".{self.cache_path.name}.tmp")
+            tmp.write_text(json.dumps({**self._state, "seen": seen}, ensure_ascii=False, indent=1), encoding="utf-8")
+            tmp.replace(self.cache_path)
+        except OSError as e:
+            print(f"WARNING: no se pudo guardar {self.cache_path}: {e}", file=sys.stderr)
+
+    def _refresh(self):
+        """Bring self._state up to date with channels.json (lock held)."""
+        st = self.channels_path.stat()
+        stat = (st.st_mtime_ns, st.st_size)
+        if self._stat == stat:
+            return
+        if not self._state:
+            self._state = self._load_cache()
+            self._state.pop("seen", None)
+            if self._state.get("version") != VERSION:
+                self._state = {"version": VERSION}
+        source = self._state.get("source", {})
+        if (source.get("mtime_ns"), source.get("size")) != stat or "channels" not in self._state:
+            raw = self.channels_path.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            if source.get("sha256") != digest or "channels" not in self._state:
+                try:
+                    channels = compile_channels(json.loads(raw))
+                except ValueError as e:
+                    raise ValueError(f"{self.channels_path}: {e}") from None
+                self._state["channels"] = channels
+            self._state["source"] = {"mtime_ns": stat[0], "size": stat[1], "sha256": digest}
+            self._save_cache()
+        self._stat = stat
+
+    def all(self) -> list[dict]:
+        """Every compiled channel, disabled ones included."""
+        with self._lock:
+            self._refresh()
+            return self._state["channels"]
+
+    def channels(self) -> list[dict]:
+        """Enabled channels, what the stages work on."""
+        return [ch for ch in self.all() if ch["enabled"]]
+
+    def changes(self, consumer: str) -> Changes:
+        with self._lock:
+            self._refresh()
+            seen = self._load_cache().get("seen", {})
+            now = snapshot_of(self._state["channels"])
+            if consumer not in seen:
+                return Changes([], [], {}, now)
+            return diff(seen[consumer], now)
+
+    def mark_seen(self, consumer: str, changes: Changes):
+        with self._lock:
+            self._refresh()
+            seen = self._load_cache().get("seen", {})
+            seen[consumer] = changes.snapshot
+            self._save_cache(seen)
+
+def load(reg: Registry, disabled: bool = False) -> list[dict]:
+    """reg.channels() (reg.all() with disabled), exiting with an error if channels.json is unusable (CLIs)."""
+    try:
+        return reg.all() if disabled else reg.channels()
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--channels", required=True)
+    ap.add_argument("--consumer", default=None, help="mostrar los cambios desde la última ejecución de esta etapa")
+    ap.add_argument("--mark-seen", action="store_true", help="(con --consumer) darlos por vistos")
+    args = ap.parse_args()
+
+    reg = Registry(Path(args.channels))
+    channels = load(reg, disabled=True)
+    enabled = sum(ch["enabled"] for ch in channels)
+    print(f"==> {len(channels)} canales ({enabled} activos), caché: {reg.cache_path}")
+    if args.consumer:
+        changes = reg.changes(args.consumer)
+        for slug in changes.added:
+            print(f"    + {slug}")
+        for slug in changes.removed:
+            print(f"    - {slug}")
+        for slug, fields in sorted(changes.changed.items()):
+            print(f"    ~ {slug} ({', '.join(fields)})")
+        if args.mark_seen:
+            reg.mark_seen(args.consumer, changes)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,303 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
 import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple
 
-AUDIO_EXTS = (".opus", ".mp3", ".m4a", ".aac", ".ogg", ".wav")
+import access
+import metrics
+from episodes import EpisodeDB
+from paths import AUDIO_EXTS
 
-def list_audio_files(ch_dir: str):
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+def parse_size(value: str) -> int:
+    """ "200G", "1.5T", "500M", "123456" -> bytes """
+    m = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", value, re.IGNORECASE)
+    if not m:
+        raise argparse.ArgumentTypeError(f"tamaño inválido: {value}")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+def human(n: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if abs(n) < 1024:
+            return f"{n:.1f}{unit}" if unit != "B" else f"{n}B"
+        n /= 1024
+    return f"{n:.1f}T"
+
+# (path, mtime) -> access.STALE / NORMAL / PROTECTED
+Ranker = Callable[[str, float], int]
+
+def load_ranker(
+    access_log: Path | None,
+    audio_dir: Path,
+    unplayed_days: float = 14,
+    protect_days: float = 30,
+) -> Ranker | None:
+    """Tier files by what serve.py saw clients actually play (None = no access log)."""
+    if access_log is None:
+        return None
+    stats = access.load(access_log)
+    base = os.path.dirname(os.path.abspath(audio_dir))
+    now = time.time()
+
+    def rank(path: str, mtime: float) -> int:
+        rel = os.path.relpath(os.path.abspath(path), base).replace(os.sep, "/")
+        return access.tier(stats.get(rel), mtime, now, unplayed_days, protect_days)
+
+    return rank
+
+class Victim(NamedTuple):
+    slug: str
+    mtime: float
+    size: int
+    path: str
+    reason: str
+
+def scan_dir(ch_path: str) -> list[tuple[float, int, str]]:
     files = []
-    for fn in os.listdir(ch_dir):
-        if not fn.lower().endswith(AUDIO_EXTS):
-            continue
-        full = os.path.join(ch_dir, fn)
-        try:
-            st = os.stat(full)
-        except FileNotFoundError:
+    with metrics.span("scan_dir"), os.scandir(ch_path) as it:
+        for e in it:
+            if not e.name.lower().endswith(AUDIO_EXTS):
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, e.path))
+    return files
+
+def collect(audio_dir: str, catalog=None, db=None) -> dict[str, list[tuple[float, int, str]]]:
+    """slug -> [(mtime, size, path)], unordered."""
+    if db is not None:
+        out: dict[str, list[tuple[float, int, str]]] = {}
+        for ep in db.present():
+            out.setdefault(ep.slug, []).append((ep.downloaded, ep.size, ep.path))
+        return out
+
+    out = {}
+    for slug in os.listdir(audio_dir):
+        ch_path = os.path.join(audio_dir, slug)
+        if not os.path.isdir(ch_path):
             continue
-        files.append((st.st_mtime, full))
-    files.sort(key=lambda x: x[0], reverse=True)
-    return [p for _, p in files]
+        if catalog is not None:
+            out[slug] = [(f.mtime, f.size, f.path) for f in catalog.listing(slug) or []]
+        else:
+            out[slug] = scan_dir(ch_path)
+    return out
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--audio-dir", required=True)
-    ap.add_argument("--keep", type=int, default=60)
-    args = ap.parse_args()
+def plan_budget(
+    channels: dict[str, list[tuple[float, int, str]]],
+    budget: int,
+    min_keep: int = 1,
+    max_keep: int = 0,
+    rank: Ranker | None = None,
+) -> tuple[list[Victim], int]:
+    """
+    Pick victims so the total stays under `budget` bytes, oldest first across
+    all channels, never leaving a channel below min_keep files and first
+    trimming any channel above max_keep (0 = no cap).
+
+    Each channel is a min-heap by (tier, mtime) (heapify, O(n)) and a global
+    heap holds each channel's next evictable file, so only the files actually
+    evicted pay a log(n) pop: no full sort per channel or globally. With a
+    `rank`, stale files go first and protected ones are never evicted (they
+    still count towards the budget and min_keep).
+    Returns (victims, total bytes before eviction).
+    """
+    heaps = {}
+    counts = {}
+    total = 0
+    for slug, files in channels.items():
+        h = []
+        for mtime, size, path in files:
+            t = rank(path, mtime) if rank is not None else access.NORMAL
+            if t != access.PROTECTED:
+                h.append((t, mtime, size, path))
+        heapq.heapify(h)
+        heaps[slug] = h
+        counts[slug] = len(files)
+        total += sum(f[1] for f in files)
+
+    victims: list[Victim] = []
+    remaining = total
+
+    if max_keep > 0:
+        for slug, h in heaps.items():
+            while h and counts[slug] > max_keep:
+                _, mtime, size, path = heapq.heappop(h)
+                counts[slug] -= 1
+                remaining -= size
+                victims.append(Victim(slug, mtime, size, path, "max"))
 
-    audio_dir = os.path.abspath(args.audio_dir)
-    keep = int(args.keep)
+    frontier = [(h[0][:2], slug) for slug, h in heaps.items() if h and counts[slug] > min_keep]
+    heapq.heapify(frontier)
+    while remaining > budget and frontier:
+        _, slug = heapq.heappop(frontier)
+        h = heaps[slug]
+        t, mtime, size, path = heapq.heappop(h)
+        counts[slug] -= 1
+        remaining -= size
+        victims.append(Victim(slug, mtime, size, path, "stale" if rank is not None and t == access.STALE else "budget"))
+        if h and counts[slug] > min_keep:
+            heapq.heappush(frontier, (h[0][:2], slug))
+
+    return victims, total
+
+def run_budget(
+    audio_dir: Path,
+    budget: int,
+    min_keep: int = 1,
+    max_keep: int = 0,
+    dry_run: bool = False,
+    catalog=None,
+    db=None,
+    rank: Ranker | None = None,
+) -> int:
+    """Enforce a global byte budget over audio/. Returns files removed (or planned)."""
+    channels = collect(os.path.abspath(audio_dir), catalog=catalog, db=db)
+    victims, total = plan_budget(channels, budget, min_keep, max_keep, rank)
+    freed = sum(v.size for v in victims)
+
+    tag = "DRY-RUN " if dry_run else ""
+    print(f"==> {tag}Presupuesto {human(budget)}: ocupado {human(total)}, "
+          f"liberar {human(freed)} en {len(victims)} ficheros -> {human(total - freed)}")
+    if total - freed > budget:
+        extra = " y los episodios a medio escuchar" if rank is not None else ""
+        print(f"WARNING: no se llega al presupuesto respetando el mínimo por canal ({min_keep}){extra}")
+
+    per_slug: dict[str, list[Victim]] = {}
+    for v in victims:
+        per_slug.setdefault(v.slug, []).append(v)
+    for slug in sorted(per_slug):
+        vs = per_slug[slug]
+        print(f"    {slug}: -{len(vs)} ({human(sum(v.size for v in vs))})")
+        if dry_run:
+            for v in vs:
+                print(f"      [{v.reason}] {os.path.basename(v.path)}")
+
+    if dry_run:
+        return len(victims)
+
+    for slug, vs in per_slug.items():
+        for v in vs:
+            try:
+                with metrics.span("delete"):
+                    os.remove(v.path)
+            except FileNotFoundError:
+                pass
+        metrics.count("deleted", len(vs), channel=slug)
+        metrics.count("freed_bytes", sum(v.size for v in vs), channel=slug)
+        if db is not None:
+            db.set_status([v.path for v in vs], "deleted")
+        if catalog is not None:
+            catalog.invalidate(slug)
+    return len(victims)
+
+def over_keep(files: list[tuple[float, str]], keep: int, rank: Ranker | None = None) -> list[str]:
+    """
+    Paths beyond the newest `keep` of (mtime, path) pairs. With a `rank`,
+    protected files are kept first and never returned, then normal before
+    stale, newest first within each tier.
+    """
+    if rank is None:
+        return [p for _, p in sorted(files, reverse=True)[keep:]]
+    ranked = sorted(((rank(p, m), m, p) for m, p in files), reverse=True)
+    return [p for t, _, p in ranked[keep:] if t != access.PROTECTED]
+
+def run_db(db, keep: int, rank: Ranker | None = None) -> int:
+    # Catalog already knows sizes/dates: no listdir/stat over SMB at all
+    removed = 0
+    for slug in db.slugs():
+        episodes = db.present(slug)
+        gone = []
+        for path in over_keep([(ep.downloaded, ep.path) for ep in episodes], keep, rank):
+            try:
+                with metrics.span("delete"):
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            gone.append(path)
+        db.set_status(gone, "deleted")
+        if gone:
+            metrics.count("deleted", len(gone), channel=slug)
+        removed += len(gone)
+    return removed
+
+def run(audio_dir: Path, keep: int = 60, catalog=None, db=None, rank: Ranker | None = None) -> int:
+    """Keep the newest `keep` files (by mtime) per channel. Returns files removed."""
+    if db is not None:
+        return run_db(db, keep, rank)
+
+    audio_dir = os.path.abspath(audio_dir)
+    removed = 0
 
     for slug in os.listdir(audio_dir):
         ch_path = os.path.join(audio_dir, slug)
         if not os.path.isdir(ch_path):
             continue
 
-        files = list_audio_files(ch_path)
+        if catalog is not None:
+            files = [(f.mtime, f.path) for f in catalog.listing(slug) or []]
+        else:
+            files = [(m, p) for m, _, p in scan_dir(ch_path)]
         if len(files) <= keep:
             continue
 
-        for fpath in files[keep:]:
+        gone = 0
+        for fpath in over_keep(files, keep, rank):
             try:
-                os.remove(fpath)
+                with metrics.span("delete"):
+                    os.remove(fpath)
+                gone += 1
             except FileNotFoundError:
                 pass
+        removed += gone
+        metrics.count("deleted", gone, channel=slug)
+        if catalog is not None:
+            catalog.invalidate(slug)
+
+    return removed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--audio-dir", required=True)
+    ap.add_argument("--keep", type=int, default=60)
+    ap.add_argument("--db", default=None, help="catálogo SQLite de episodios (episodes.py)")
+    ap.add_argument("--budget", type=parse_size, default=None,
+                    help="presupuesto global en bytes (p.ej. 200G); sustituye a --keep")
+    ap.add_argument("--min-per-channel", type=int, default=1, help="(budget) nunca dejar menos de N por canal")
+    ap.add_argument("--max-per-channel", type=int, default=0, help="(budget) nunca más de N por canal; 0=sin límite")
+    ap.add_argument("--dry-run", action="store_true", help="(budget) solo informar, no borrar")
+    ap.add_argument("--access-log", default=None, help="access.json de serve.py: no borrar lo que se está escuchando")
+    ap.add_argument("--unplayed-days", type=float, default=14, help="(access-log) sin descargar en N días = prescindible")
+    ap.add_argument("--protect-days", type=float, default=30, help="(access-log) a medias y tocado hace < N días = intocable")
+    args = ap.parse_args()
+
+    db = EpisodeDB(args.db) if args.db else None
+    rank = load_ranker(
+        Path(args.access_log) if args.access_log else None,
+        Path(args.audio_dir),
+        args.unplayed_days,
+        args.protect_days,
+    )
+    with metrics.stage("rotate"):
+        if args.budget is not None:
+            run_budget(
+                Path(args.audio_dir),
+                args.budget,
+                min_keep=args.min_per_channel,
+                max_keep=args.max_per_channel,
+                dry_run=args.dry_run,
+                db=db,
+                rank=rank,
+            )
+        else:
+            run(Path(args.audio_dir), int(args.keep), db=db, rank=rank)
 
 if __name__ == "__main__":
     main()
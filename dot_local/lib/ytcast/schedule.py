@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Adaptive per-channel RSS polling for download.py.
+
+Each channel's cadence is learnt from the <published> dates of its feed:
+poll every median-gap / POLLS_PER_GAP, clamped to [min_interval,
+max_interval], backing off while a channel is quieter than usual.
+max_interval is also the cap on how stale a channel can get. period is
+how often the caller runs (daemon --interval, cron): a channel due before
+the next run is polled now, or it would wait for the run after that.
+State (default ~/.local/state/ytcast/schedule.json):
+  {slug: {"gap": s, "newest": ts, "next": ts, "last_poll": ts}}
+"""
+import json
+import statistics
+import threading
+import time
+from pathlib import Path
+
+from paths import state_dir
+
+POLLS_PER_GAP = 4
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 3600
+GAPS = 15
+
+def default_schedule_path() -> Path:
+    return state_dir() / "schedule.json"
+
+def cadence(published: list[float]) -> tuple[float | None, float | None]:
+    """(median gap between uploads, newest upload) from feed timestamps (0 = unknown)."""
+    ts = sorted((t for t in published if t > 0), reverse=True)[: GAPS + 1]
+    if not ts:
+        return None, None
+    if len(ts) < 2:
+        return None, ts[0]
+    return statistics.median(a - b for a, b in zip(ts, ts[1:])), ts[0]
+
+def interval_for(gap: float | None, newest: float | None, now: float, min_interval: float, max_interval: float) -> float:
+    if not gap or newest is None:
+        return max_interval
+    # Silent for longer than usual: back off towards the cap
+    quiet = now - newest
+    if quiet > 2 * gap:
+        gap = quiet / 2
+    return min(max_interval, max(min_interval, gap / POLLS_PER_GAP))
+
+class PollSchedule:
+    def __init__(
+        self,
+        path: Path | None = None,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        period: float = 0,
+    ):
+        self.path = Path(path) if path else default_schedule_path()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.period = period
+        self._lock = threading.Lock()
+        try:
+            self._data: dict[str, dict] = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            self._data = {}
+
+    def due(self, slug: str, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            st = self._data.get(slug)
+        if not st:
+            return True
+        # A lowered --max-poll-interval applies right away
+        return now + self.period >= min(st.get("next", 0), st.get("last_poll", 0) + self.max_interval)
+
+    def polled(self, slug: str, published: list[float] | None, ok: bool = True, now: float | None = None):
+        """
+        Record a poll. published = upload timestamps from the feed, or None
+        when it was unchanged (the learnt interval is kept). Failed polls
+        retry after min_interval.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            st = self._data.setdefault(slug, {})
+            if not ok:
+                st["next"] = now + self.min_interval
+                return
+            if published is not None:
+                st["gap"], st["newest"] = cadence(published)
+            interval = interval_for(st.get("gap"), st.get("newest"), now, self.min_interval, self.max_interval)
+            st["last_poll"] = now
+            st["next"] = now + interval
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self._data, indent=1, sort_keys=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(data, encoding="utf-8")
+        tmp.replace(self.path)
@@ -1,25 +1,437 @@
 #!/usr/bin/env python3
 import argparse
+import email.utils
+import functools
+import hashlib
+import html
 import http.server
 import os
+import re
 import socket
 import sys
+import threading
+import time
+import urllib.parse
 from pathlib import Path
 
+from access import AccessLog
+from metrics import ServeMetrics, route_for
+from rotate_global import parse_size
+from variants import (
+    BITRATES,
+    MAX_BYTES as MAX_VARIANT_BYTES,
+    RETRY_AFTER as VARIANT_RETRY_AFTER,
+    VariantCache,
+    parse_bitrate,
+    split_variant,
+)
+from websub import MAX_BODY as MAX_WEBSUB_BODY, WebSubCallback
+
+SEND_CHUNK = 1 << 20
+
+# Host header as sent by clients: name/IPv4/[IPv6] plus optional port
+HOST_RE = re.compile(r"^[A-Za-z0-9.\-]+(:\d{1,5})?$|^\[[0-9A-Fa-f:.]+\](:\d{1,5})?$")
+
+def podcast_type(path: str) -> str | None:
+    # Forzar content-types más "podcast friendly"
+    if path.endswith(".xml"):
+        return "application/rss+xml; charset=utf-8"
+    if path.endswith(".opml"):
+        return "text/x-opml; charset=utf-8"
+    if path.endswith(".opus"):
+        # Muchos clientes aceptan audio/ogg
+        return "audio/ogg"
+    return None
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_byte_range(value: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Single "bytes=" range -> inclusive (start, end), or None to send the whole
+    file. Multi-range requests are rejected by ignoring them (full 200, as
+    RFC 9110 allows) instead of building multipart/byteranges bodies.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.strip().partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            # suffix: last N bytes (an empty file has none: 416, as RFC 9110 says)
+            n = int(last)
+            if n <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or (last and end < start):
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def if_range_matches(value: str | None, etag: str, mtime: float) -> bool:
+    # No If-Range: the Range applies. Strong ETag or exact date: still the same file.
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return False
+    return dt is not None and int(dt.timestamp()) == int(mtime)
+
+class FeedStore:
+    """
+    Feed XML templates (with the __HOST__ placeholder written by gen_feeds.py)
+    kept in memory and rendered per Host header. A file whose mtime/size
+    changes is reloaded on the next request, so new feeds go live without
+    restarting the server.
+
+    ?br= renders point the enclosures at the variant and give its length
+    once it is cached (length='0' until then), and start the transcodes of
+    the newest PREFETCH episodes; they are re-rendered when the variant
+    cache changes.
+    """
+
+    # gen_feeds.py writes http://__HOST__:<port>; the real Host header wins
+    PLACEHOLDER_RE = re.compile(rb"http://__HOST__(?::\d+)?")
+    ENCLOSURE_RE = re.compile(rb"<enclosure url='([^']*)' length='\d+'")
+    MAX_HOSTS = 8
+    PREFETCH = 5
+
+    def __init__(self, feeds_dir: Path, variants: VariantCache | None = None):
+        self.feeds_dir = feeds_dir
+        # Feeds live in <served dir>/feeds; enclosure URLs are relative to the served dir
+        self.base_dir = feeds_dir.parent
+        self.variants = variants
+        self._lock = threading.Lock()
+        # name -> (mtime_ns, size, template, {(host, br): (body, etag, variant generation)})
+        self._entries: dict[str, tuple[int, int, bytes, dict]] = {}
+
+    def get(self, name: str, host: str, br: str | None = None) -> tuple[bytes, str, float] | None:
+        path = self.feeds_dir / name
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(name, None)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+            entry = (st.st_mtime_ns, st.st_size, path.read_bytes(), {})
+            with self._lock:
+                self._entries[name] = entry
+
+        rendered = entry[3]
+        hit = rendered.get((host, br))
+        generation = self.variants.generation if br and self.variants is not None else 0
+        if hit is None or hit[2] != generation:
+            # Few real hosts (LAN IP, hostname, tunnel); don't let odd Host headers pile up
+            if len(rendered) >= self.MAX_HOSTS:
+                rendered.clear()
+            base = f"http://{host}".encode("utf-8")
+            body = self.PLACEHOLDER_RE.sub(lambda _: base, entry[2])
+            if br:
+                body = self.variant_body(body, base, br.encode("ascii"))
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            hit = rendered[(host, br)] = (body, etag, generation)
+        return hit[0], hit[1], st.st_mtime
+
+    def variant_body(self, body: bytes, base: bytes, br: bytes) -> bytes:
+        # gen_feeds.py lists the newest episodes first
+        seen = 0
+
+        def length(m: re.Match) -> bytes:
+            nonlocal seen
+            url = m.group(1)
+            if self.variants is None or not url.startswith(base + b"/audio/"):
+                return m.group(0)
+            src = self.base_dir / html.unescape(url[len(base) + 1:].decode("utf-8"))
+            if not self.variants.supported(src):
+                # Served as is
+                return m.group(0)
+            size = self.variants.size(src, br.decode("ascii"), make=seen < self.PREFETCH)
+            seen += 1
+            # RSS requires a length; 0 = unknown until the variant exists
+            return b"<enclosure url='" + url + b"' length='%d'" % (size or 0)
+
+        body = self.ENCLOSURE_RE.sub(length, body)
+        # Enclosures -> /v/<br>/audio/..., feed links (paging) keep ?br=<br>
+        body = body.replace(base + b"/audio/", base + b"/v/" + br + b"/audio/")
+        return re.sub(
+            re.escape(base) + rb"(/feeds/[^\"'<>?]+\.xml)",
+            lambda m: m.group(0) + b"?br=" + br,
+            body,
+        )
+
+    def invalidate(self, names: list[str] | None = None):
+        # Hot swap: drop templates so the next request re-reads them
+        with self._lock:
+            if names is None:
+                self._entries.clear()
+            else:
+                for name in names:
+                    self._entries.pop(name, None)
+
 class RSSHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep-alive: podcast apps open many range requests on the same episode
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes: with Nagle on, each reuse
+    # of the connection waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    feeds: FeedStore | None = None
+    access: AccessLog | None = None
+    variants: VariantCache | None = None
+    websub: WebSubCallback | None = None
+    metrics = ServeMetrics()
+    default_host = "127.0.0.1"
+    _started = 0.0
+    _status: int | None = None
+
+    def parse_request(self) -> bool:
+        # Request line read: latency counts from here, not from keep-alive idle time
+        self._started = time.perf_counter()
+        self._status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def request_host(self) -> str:
+        host = (self.headers.get("Host") or "").strip()
+        if host and len(host) <= 255 and HOST_RE.match(host):
+            return host
+        return self.default_host
+
+    def request_variant(self) -> tuple[str | None, str]:
+        """(bitrate from /v/<br>/... or ?br=, URL path without the prefix)."""
+        parts = urllib.parse.urlsplit(self.path)
+        br, path = split_variant(parts.path)
+        if br is None:
+            br = parse_bitrate(urllib.parse.parse_qs(parts.query).get("br", [""])[0])
+        return br, path
+
+    def feed_name(self) -> str | None:
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        m = re.fullmatch(r"/feeds/([^/]+\.(?:xml|opml))", path)
+        return m.group(1) if m else None
+
+    def websub_slug(self) -> str | None:
+        if self.websub is None:
+            return None
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        m = re.fullmatch(r"/websub/([^/]+)", path)
+        return m.group(1) if m else None
+
+    def do_GET(self):
+        self.route(head=False)
+
+    def do_HEAD(self):
+        self.route(head=True)
+
+    def route(self, head: bool):
+        """GET and HEAD go through the same routes; HEAD just sends no body."""
+        if urllib.parse.urlsplit(self.path).path == "/metrics":
+            body = self.metrics.render()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return
+        slug = self.websub_slug()
+        if slug:
+            # Hub verification of a (un)subscribe request
+            status, body = self.websub.verify(slug, urllib.parse.urlsplit(self.path).query)
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return
+        name = self.feed_name()
+        if name and self.feeds is not None:
+            return self.send_feed(name, head=head)
+        return self.send_static(head=head)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400)
+            return
+        if length > MAX_WEBSUB_BODY:
+            self.send_error(413)
+            return
+        body = self.rfile.read(length) if length else b""
+        slug = self.websub_slug()
+        if not slug:
+            self.send_error(405)
+            return
+        # Content distribution: always 2xx, a bad signature is just ignored
+        self.websub.notify(slug, body, self.headers.get("X-Hub-Signature"))
+        self.send_response(204)
+        self.end_headers()
+
+    def send_static(self, head: bool):
+        br, url_path = self.request_variant()
+        path = src_path = self.translate_path(url_path)
+        if os.path.isdir(path):
+            # Directory listings / index.html: stock handler
+            return super().do_HEAD() if head else super().do_GET()
+        if br and self.variants is not None and self.variants.supported(Path(path)) and os.path.isfile(path):
+            try:
+                variant = self.variants.get(Path(path), br)
+            except OSError:
+                # Gone since isfile(): the open below answers 404
+                variant = path
+            except RuntimeError as e:
+                self.log_error("variant %s failed: %s", br, e)
+                self.send_error(500, "Transcode failed")
+                return
+            if variant is None:
+                # Being made in the background; the full-size original would defeat ?br=
+                self.send_response(503)
+                self.send_header("Retry-After", str(VARIANT_RETRY_AFTER))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            path = str(variant)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = file_etag(st)
+
+            inm = self.headers.get("If-None-Match")
+            if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            rng = None
+            if if_range_matches(self.headers.get("If-Range"), etag, st.st_mtime):
+                try:
+                    rng = parse_byte_range(self.headers.get("Range"), size)
+                except RangeNotSatisfiable:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+            if rng is None:
+                start, count = 0, size
+                self.send_response(200)
+            else:
+                start, count = rng[0], rng[1] - rng[0] + 1
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {rng[0]}-{rng[1]}/{size}")
+
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(count))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.end_headers()
+            if head or count == 0:
+                return
+
+            # Zero-copy: headers are buffered in wfile, flush them first
+            self.wfile.flush()
+            sent = 0
+            try:
+                # In chunks so a player closing mid-stream still leaves an
+                # accurate "bytes actually played" count for the access log
+                with self.metrics.stream():
+                    while sent < count:
+                        n = self.connection.sendfile(f, offset=start + sent, count=min(SEND_CHUNK, count - sent))
+                        if not n:
+                            break
+                        sent += n
+            except (BrokenPipeError, ConnectionResetError):
+                # Client seeked elsewhere / closed the player
+                self.close_connection = True
+            finally:
+                self.metrics.add_sent(route_for(url_path), sent)
+                if self.access is not None:
+                    self.record_access(src_path, path, start, sent, size, rng is not None)
+
+    def record_access(self, src_path: str, path: str, start: int, sent: int, size: int, ranged: bool):
+        rel = os.path.relpath(src_path, self.directory).replace(os.sep, "/")
+        if path != src_path:
+            # Variant: scale to the original's byte offsets so "played" stays comparable
+            try:
+                orig = os.path.getsize(src_path)
+            except OSError:
+                return
+            ratio = orig / size if size else 0
+            start, sent, size = int(start * ratio), int(sent * ratio), orig
+        self.access.record(rel, start, sent, size, ranged)
+
+    def send_feed(self, name: str, head: bool):
+        br = self.request_variant()[0] if self.variants is not None else None
+        hit = self.feeds.get(name, self.request_host(), br)
+        if hit is None:
+            self.send_error(404, "File not found")
+            return
+        body, etag, mtime = hit
+
+        inm = self.headers.get("If-None-Match")
+        if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(name))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", email.utils.formatdate(mtime, usegmt=True))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+            self.metrics.add_sent("feed", len(body))
+
     def end_headers(self):
         # CORS por si algún cliente lo necesita (no molesta)
         self.send_header("Access-Control-Allow-Origin", "*")
         super().end_headers()
+        if self._status is not None and self._started:
+            self.metrics.observe(route_for(urllib.parse.urlsplit(self.path).path), self._status,
+                                 time.perf_counter() - self._started)
+            self._status = None
 
     def guess_type(self, path):
-        # Forzar content-types más "podcast friendly"
-        if path.endswith(".xml"):
-            return "application/rss+xml; charset=utf-8"
-        if path.endswith(".opus"):
-            # Muchos clientes aceptan audio/ogg
-            return "audio/ogg"
-        return super().guess_type(path)
+        return podcast_type(path) or super().guess_type(path)
 
 def guess_local_ip() -> str:
     ip = "127.0.0.1"
@@ -32,21 +444,77 @@ def guess_local_ip() -> str:
         pass
     return ip
 
-def patch_xml_host(base_dir: Path, host: str, port: int):
+def setup(
+    base_dir: Path,
+    port: int,
+    access_log: Path | None = None,
+    variant_cache: Path | None = None,
+    variant_cache_size: int = MAX_VARIANT_BYTES,
+    websub: WebSubCallback | None = None,
+) -> str:
+    """Wire RSSHandler to base_dir's feeds. Returns the LAN host guessed."""
+    host = guess_local_ip()
+    # Size 0 disables ?br= / /v/<br>/ (requests get the original file)
+    RSSHandler.variants = VariantCache(variant_cache, variant_cache_size) if variant_cache_size > 0 else None
+    # Feeds keep the __HOST__ placeholder on disk; it is filled per request
+    RSSHandler.feeds = FeedStore(base_dir / "feeds", RSSHandler.variants)
+    RSSHandler.default_host = f"{host}:{port}"
+    RSSHandler.access = AccessLog(access_log or base_dir / "access.json")
+    # /websub/<slug>: push notifications from the hub (websub.py renew subscribes)
+    RSSHandler.websub = websub
+    return host
+
+def serve_forever(base_dir: Path, port: int, mode: str = "threads", max_conns: int = 64, idle_timeout: float = 15.0):
+    if mode == "asyncio":
+        import asyncio
+        import aserve
+        asyncio.run(aserve.serve(
+            base_dir,
+            port,
+            RSSHandler.feeds,
+            RSSHandler.default_host,
+            access=RSSHandler.access,
+            variants=RSSHandler.variants,
+            websub=RSSHandler.websub,
+            metrics=RSSHandler.metrics,
+            max_conns=max_conns,
+            idle_timeout=idle_timeout,
+        ))
+    else:
+        handler = functools.partial(RSSHandler, directory=str(base_dir))
+        http.server.ThreadingHTTPServer(("0.0.0.0", port), handler).serve_forever()
+
+def print_feeds(base_dir: Path, host: str, port: int):
+    print("\nAñade estos feeds en tu app de podcasts (misma Wi-Fi):\n")
     feeds_dir = base_dir / "feeds"
-    if not feeds_dir.exists():
-        return
-    placeholder = f"http://__HOST__:{port}"
-    real = f"http://{host}:{port}"
-    for feed in feeds_dir.glob("*.xml"):
-        data = feed.read_text(encoding="utf-8")
-        if placeholder in data:
-            feed.write_text(data.replace(placeholder, real), encoding="utf-8")
+    if feeds_dir.exists():
+        for feed in sorted(feeds_dir.glob("*.xml")):
+            # Archive pages are reached through the feed's own links
+            if ".page-" not in feed.name:
+                print(f"  {feed.stem}: http://{host}:{port}/feeds/{feed.name}")
+        print(f"\n  índice: http://{host}:{port}/feeds/index.json")
+        print(f"  OPML: http://{host}:{port}/feeds/index.opml")
+        print(f"  métricas (Prometheus): http://{host}:{port}/metrics")
+        if RSSHandler.variants is not None:
+            print(f"  versión ligera (datos móviles): añade ?br={'|'.join(BITRATES)} a la URL del feed")
+        print()
+    else:
+        print(f"  (no existe {feeds_dir}, ¿generaste feeds?)")
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--dir", required=True)
     ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--mode", choices=["threads", "asyncio"], default="threads",
+                    help="threads: un hilo por conexión; asyncio: un solo hilo, muchos clientes")
+    ap.add_argument("--max-conns", type=int, default=64, help="(asyncio) conexiones abiertas máximas")
+    ap.add_argument("--idle-timeout", type=float, default=15.0, help="(asyncio) segundos sin petición antes de cerrar")
+    ap.add_argument("--access-log", default=None, help="contadores de escucha por episodio (default: <dir>/access.json)")
+    ap.add_argument("--variant-cache", default=None, help="caché de transcodificaciones ?br= (default: ~/.cache/ytcast/variants)")
+    ap.add_argument("--variant-cache-size", type=parse_size, default=MAX_VARIANT_BYTES,
+                    help="tamaño máximo de esa caché (p.ej. 2G); 0 = sin variantes")
+    ap.add_argument("--websub", action="store_true",
+                    help="aceptar notificaciones WebSub en /websub/<slug> (las encola para download.py --websub)")
     args = ap.parse_args()
 
     base_dir = Path(args.dir).resolve()
@@ -54,26 +522,25 @@ def main():
         print(f"ERROR: dir no existe: {base_dir}", file=sys.stderr)
         sys.exit(1)
 
-    host = guess_local_ip()
-    patch_xml_host(base_dir, host, args.port)
-
+    host = setup(
+        base_dir,
+        args.port,
+        Path(args.access_log) if args.access_log else None,
+        Path(args.variant_cache) if args.variant_cache else None,
+        args.variant_cache_size,
+        WebSubCallback() if args.websub else None,
+    )
     os.chdir(base_dir)
-
-    print("\nAñade estos feeds en tu app de podcasts (misma Wi-Fi):\n")
-    feeds_dir = base_dir / "feeds"
-    if feeds_dir.exists():
-        for feed in sorted(feeds_dir.glob("*.xml")):
-            print(f"  {feed.stem}: http://{host}:{args.port}/feeds/{feed.name}")
-        print(f"\n  índice: http://{host}:{args.port}/feeds/index.json\n")
-    else:
-        print(f"  (no existe {feeds_dir}, ¿generaste feeds?)")
+    print_feeds(base_dir, host, args.port)
 
     print("Server running. CTRL+C para parar.\n")
 
     try:
-        http.server.ThreadingHTTPServer(("0.0.0.0", args.port), RSSHandler).serve_forever()
+        serve_forever(base_dir, args.port, args.mode, args.max_conns, args.idle_timeout)
     except KeyboardInterrupt:
         print("\nParando servidor...\n")
+    finally:
+        RSSHandler.access.close()
 
 if __name__ == "__main__":
     main()
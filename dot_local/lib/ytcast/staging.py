@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Local staging area for download.py (--staging-dir).
+
+yt-dlp fragments, .part files and ffmpeg output live on local disk under
+<staging>/<slug>/; only finished files cross to the NAS, as one large
+sequential copy to a hidden temp name + rename in the destination dir.
+
+Leftovers from an interrupted run: yt-dlp .part files stay in place (the
+outtmpl is stable per channel, so the next run resumes them); anything
+older than max_age and ffmpeg partial outputs are removed by cleanup().
+"""
+import os
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+
+MAX_AGE = 7 * 86400
+
+def cleanup(staging_dir: Path, max_age: float = MAX_AGE) -> int:
+    """Remove stale files from a previous run. Returns files removed."""
+    if not staging_dir.is_dir():
+        return 0
+    now = time.time()
+    removed = 0
+    for slug_entry in os.scandir(staging_dir):
+        if not slug_entry.is_dir():
+            continue
+        for e in os.scandir(slug_entry.path):
+            if not e.is_file():
+                continue
+            stem, _, ext = e.name.rpartition(".")
+            # transcode() writes "<name>.part.<ext>": never resumable
+            ffmpeg_partial = stem.endswith(".part") and ext != "part"
+            try:
+                if ffmpeg_partial or now - e.stat().st_mtime > max_age:
+                    os.remove(e.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+def publish(src: Path, dest: Path) -> Path:
+    """Move src to dest: rename if same filesystem, else copy to .<name>.part + rename."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if os.stat(src).st_dev == os.stat(dest.parent).st_dev:
+        os.replace(src, dest)
+        return dest
+    tmp = dest.with_name(f".{dest.name}.part")
+    try:
+        # copyfile uses sendfile() on Linux: big sequential writes over SMB
+        with metrics.span("transfer"):
+            shutil.copyfile(src, tmp)
+        tmp.replace(dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    src.unlink(missing_ok=True)
+    return dest
+
+class Stager:
+    def __init__(self, staging_dir: Path, transfer_jobs: int = 1):
+        self.dir = Path(staging_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        n = cleanup(self.dir)
+        if n:
+            print(f"==> Staging: {n} restos de una ejecución anterior borrados")
+        # One sequential stream is what a CIFS mount handles best
+        self._pool = ThreadPoolExecutor(max_workers=max(1, transfer_jobs), thread_name_prefix="transfer")
+
+    def workdir(self, slug: str) -> Path:
+        d = self.dir / slug
+        d.mkdir(parents=True, exist_ok=True)
+        return d
+
+    def publish(self, src: Path, dest: Path) -> Future:
+        """Queue src for transfer to dest. The future's result is dest."""
+        return self._pool.submit(publish, src, dest)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        # Drop empty per-channel dirs
+        for d in self.dir.iterdir():
+            try:
+                d.rmdir()
+            except OSError:
+                pass
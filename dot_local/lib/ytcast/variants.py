@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Low-bitrate variants of episodes for serve.py, made on first request.
+
+  /v/32k/audio/<slug>/<file>      (or /audio/<slug>/<file>?br=32k)
+  /feeds/<slug>.xml?br=32k        feed whose enclosures point at the variant
+
+Transcodes land in a size-bounded LRU disk cache (default
+~/.cache/ytcast/variants, 2G) and run in the background: no request waits
+for one, nor holds a server thread while it runs. Rendering a ?br= feed
+starts the transcodes of its newest episodes, so they are usually ready
+by the time the app downloads them; a request that still comes too early
+gets 503 + Retry-After (never the full-size original).
+"""
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from paths import cache_dir
+
+BITRATES = ("16k", "24k", "32k", "48k")
+# Seconds a client is told to wait for a variant being made
+RETRY_AFTER = 30
+MAX_BYTES = 2 << 30
+VARIANT_PATH_RE = re.compile(r"^/v/(\d{1,3}k)(/.*)$")
+
+# Same container/codec as the source, just a lower bitrate
+CODECS = {
+    ".opus": "libopus",
+    ".ogg": "libvorbis",
+    ".mp3": "libmp3lame",
+    ".m4a": "aac",
+    ".aac": "aac",
+}
+
+def default_cache_dir() -> Path:
+    return cache_dir() / "variants"
+
+def parse_bitrate(value: str | None) -> str | None:
+    """ "32k"/"32K" -> "32k" if it is an allowed variant, else None."""
+    if not value:
+        return None
+    value = value.strip().lower()
+    return value if value in BITRATES else None
+
+def split_variant(path: str) -> tuple[str | None, str]:
+    """URL path -> (bitrate or None, path without the /v/<br> prefix)."""
+    m = VARIANT_PATH_RE.match(path)
+    if not m:
+        return None, path
+    return parse_bitrate(m.group(1)), m.group(2)
+
+class VariantCache:
+    def __init__(self, cache_dir: Path | None = None, max_bytes: int = MAX_BYTES, ffmpeg_jobs: int = 1):
+        self.dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, ffmpeg_jobs), thread_name_prefix="variant")
+        # Keys being transcoded, and keys ffmpeg failed on (the key changes with the source file)
+        self._inflight: set[str] = set()
+        self._failed: set[str] = set()
+        # Bumped whenever the set of cached variants changes (feed lengths depend on it)
+        self.generation = 0
+        # name -> (size, last use = atime); dict order is not LRU, eviction sorts
+        self._files: dict[str, tuple[int, float]] = {}
+        self._total = 0
+        for e in os.scandir(self.dir):
+            if e.is_file() and not e.name.startswith("."):
+                st = e.stat()
+                self._files[e.name] = (st.st_size, st.st_atime)
+                self._total += st.st_size
+            elif e.name.startswith("."):
+                # Temp output of a transcode that never finished
+                os.remove(e.path)
+
+    def supported(self, src: Path) -> bool:
+        return src.suffix.lower() in CODECS
+
+    def _key(self, src: Path, st: os.stat_result, br: str) -> str:
+        raw = f"{src}\0{st.st_mtime_ns}\0{st.st_size}\0{br}".encode("utf-8")
+        return hashlib.sha1(raw).hexdigest()[:20] + f".{br}{src.suffix.lower()}"
+
+    def _lookup(self, src: Path, st: os.stat_result, br: str) -> tuple[str, Path, bool]:
+        """(key, path, cached); a miss starts the transcode. Lock held."""
+        key = self._key(src, st, br)
+        out = self.dir / key
+        if key in self._files and not out.exists():
+            # Deleted behind our back
+            self._total -= self._files.pop(key)[0]
+        if key in self._files:
+            return key, out, True
+        if key not in self._inflight and key not in self._failed:
+            self._inflight.add(key)
+            self._pool.submit(self._fill, src, br, out, key)
+        return key, out, False
+
+    def get(self, src: Path, br: str) -> Path | None:
+        """
+        Path of src transcoded to br, or None while it is not ready: a miss
+        starts the transcode in the background and returns right away.
+        RuntimeError if ffmpeg failed on this file.
+        """
+        st = src.stat()
+        with self._lock:
+            key, out, cached = self._lookup(src, st, br)
+            if key in self._failed:
+                raise RuntimeError(f"transcode failed: {src.name} @ {br}")
+            if not cached:
+                return None
+            self._files[key] = (self._files[key][0], time.time())
+        # atime = last use, so the LRU order survives restarts (mtime feeds the ETag)
+        try:
+            os.utime(out, ns=(time.time_ns(), out.stat().st_mtime_ns))
+        except FileNotFoundError:
+            pass
+        return out
+
+    def size(self, src: Path, br: str, make: bool = False) -> int | None:
+        """Size of the cached variant, None if it is not made (yet). make: start it on a miss."""
+        try:
+            st = src.stat()
+        except OSError:
+            return None
+        with self._lock:
+            if make:
+                key = self._lookup(src, st, br)[0]
+            else:
+                key = self._key(src, st, br)
+            hit = self._files.get(key)
+        return hit[0] if hit else None
+
+    def _fill(self, src: Path, br: str, out: Path, key: str):
+        try:
+            self._transcode(src, br, out)
+            size = out.stat().st_size
+        except (OSError, RuntimeError) as e:
+            print(f"WARNING: variante {br} de {src.name}: {e}", file=sys.stderr)
+            with self._lock:
+                self._inflight.discard(key)
+                self._failed.add(key)
+            return
+        with self._lock:
+            self._files[key] = (size, time.time())
+            self._total += size
+            self._inflight.discard(key)
+            self.generation += 1
+        self._evict(keep=key)
+
+    def _transcode(self, src: Path, br: str, out: Path):
+        tmp = out.with_name(f".{out.name}")
+        cmd = [
+            "ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+            "-i", str(src),
+            "-vn", "-map_metadata", "0",
+            "-c:a", CODECS[src.suffix.lower()], "-b:a", br,
+            "-f", {".m4a": "mp4", ".aac": "mp4"}.get(src.suffix.lower(), src.suffix.lower()[1:]),
+            str(tmp),
+        ]
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        if p.returncode != 0:
+            tmp.unlink(missing_ok=True)
+            raise RuntimeError(p.stderr.strip() or "ffmpeg failed")
+        tmp.replace(out)
+
+    def _evict(self, keep: str):
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            victims = []
+            for name, (size, used) in sorted(self._files.items(), key=lambda kv: kv[1][1]):
+                if self._total <= self.max_bytes:
+                    break
+                if name == keep or name in self._inflight:
+                    continue
+                del self._files[name]
+                self._total -= size
+                victims.append(name)
+            self.generation += 1
+        # Open file handles keep streaming after unlink
+        for name in victims:
+            (self.dir / name).unlink(missing_ok=True)
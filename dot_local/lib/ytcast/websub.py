@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+WebSub (PubSubHubbub) subscriber for channel feeds: new uploads are
+pushed by the hub instead of waiting for the next RSS poll.
+
+- renew(): (re)subscribes every channel whose lease is unknown or about to
+  expire. Callback URL: <callback-base>/<slug>, which must reach serve.py
+  from the internet (tunnel / reverse proxy).
+- WebSubCallback: what serve.py runs for /websub/<slug>. GET answers the
+  hub's verification challenge and records the lease; POST checks the
+  HMAC signature, parses the Atom notification with atom.parse
+  and queues (slug, video) jobs in the spool.
+- Spool: JSON lines on local disk; download.py (--websub) or the daemon
+  drains it and downloads just those videos; the ones that fail (premieres,
+  live streams still on air) are queued again, up to MAX_TRIES attempts.
+
+State: ~/.local/state/ytcast/websub.json {slug: {"topic", "secret",
+"requested", "lease_expires", "status"}} and websub-queue.jsonl (+ .lock files).
+
+CLI: websub.py renew --channels ... --callback https://host/websub [--hub ...]
+"""
+import argparse
+import fcntl
+import hmac
+import json
+import secrets
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+import atom
+from backlog import Candidate
+from feedcache import USER_AGENT
+import metrics
+from paths import state_dir
+import registry
+
+HUB = "https://pubsubhubbub.appspot.com/subscribe"
+LEASE = 10 * 86400
+RENEW_MARGIN = 86400
+# Notifications are a few KB of Atom
+MAX_BODY = 1 << 20
+# Download attempts per pushed video: premieres and live streams are
+# notified hours before they can be downloaded (about a day of hourly cycles)
+MAX_TRIES = 24
+
+def default_state_path() -> Path:
+    return state_dir() / "websub.json"
+
+def default_spool_path() -> Path:
+    return state_dir() / "websub-queue.jsonl"
+
+@contextmanager
+def _flocked(path: Path, kind: int = fcntl.LOCK_EX):
+    """flock on <path>.lock: serve.py, renew, download.py and the daemon may be separate processes."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.with_name(path.name + ".lock").open("a") as f:
+        fcntl.flock(f, kind)
+        yield
+
+class Subscriptions:
+    """websub.json, re-read under the file lock before every change: serve.py and renew may be different processes."""
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path else default_state_path()
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, slug: str) -> dict | None:
+        return self.load().get(slug)
+
+    def update(self, slug: str, **fields):
+        with self._lock, _flocked(self.path):
+            data = self.load()
+            data.setdefault(slug, {}).update(fields)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(data, indent=1, sort_keys=True), encoding="utf-8")
+            tmp.replace(self.path)
+
+class Spool:
+    """
+    Appends (serve.py, requeues) hold the file lock shared and drain
+    (download.py --websub, the daemon) exclusive, so no line is written to
+    a work file that is being read and two drains never take the same jobs.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path else default_spool_path()
+        self._lock = threading.Lock()
+
+    def append(self, slug: str, items: list[atom.Entry], tries: int = 0):
+        """tries: failed download attempts so far (requeued jobs)."""
+        if not items:
+            return
+        with self._lock, _flocked(self.path, fcntl.LOCK_SH), self.path.open("a", encoding="utf-8") as f:
+            for published, vid, watch in items:
+                f.write(json.dumps({"slug": slug, "published": published, "id": vid, "url": watch, "tries": tries}) + "\n")
+
+    def drain(self) -> list[Candidate]:
+        """Take every queued job, deduplicated (the last line of a video wins)."""
+        with self._lock, _flocked(self.path):
+            try:
+                # rename is atomic: appends from now on go to a fresh file
+                self.path.replace(self.path.with_name(f"{self.path.name}.work-{time.time_ns()}"))
+            except FileNotFoundError:
+                pass
+            # Plus whatever a crashed run had taken but not finished reading
+            works = sorted(self.path.parent.glob(f"{self.path.name}.work*"))
+            out: dict[tuple[str, str], Candidate] = {}
+            for work in works:
+                for line in work.read_text(encoding="utf-8", errors="replace").splitlines():
+                    try:
+                        j = json.loads(line)
+                        out[(j["slug"], j["id"])] = Candidate(
+                            j["slug"], atom.Entry(j.get("published", ""), j["id"], j["url"]), int(j.get("tries", 0))
+                        )
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            for work in works:
+                work.unlink(missing_ok=True)
+        return list(out.values())
+
+def subscribe(hub: str, topic: str, callback: str, secret: str, lease: int = LEASE, mode: str = "subscribe") -> int:
+    """Ask the hub to (un)subscribe; it verifies asynchronously against callback. Returns HTTP status."""
+    form = urllib.parse.urlencode({
+        "hub.mode": mode,
+        "hub.topic": topic,
+        "hub.callback": callback,
+        "hub.verify": "async",
+        "hub.lease_seconds": str(lease),
+        "hub.secret": secret,
+    }).encode("ascii")
+    req = urllib.request.Request(hub, data=form, headers={"User-Agent": USER_AGENT})
+    try:
+        with urllib.request.urlopen(req, timeout=20) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"hub {e.code}: {e.read()[:200]!r}") from None
+
+def renew(
+    channels: list[dict],
+    callback_base: str,
+    hub: str = HUB,
+    subs: Subscriptions | None = None,
+    lease: int = LEASE,
+    margin: int = RENEW_MARGIN,
+    drop: list[str] | None = None,
+) -> int:
+    """
+    Subscribe channels with no lease or one expiring within margin, and
+    unsubscribe the drop slugs (removed/disabled channels). Returns requests sent.
+    """
+    subs = subs or Subscriptions()
+    now = time.time()
+    sent = 0
+    for slug in drop or []:
+        st = subs.get(slug) or {}
+        if not st.get("topic") or st.get("status") == "unsubscribed":
+            continue
+        # Marked first: the hub may verify before subscribe() returns
+        subs.update(slug, status="unsubscribed", lease_expires=0)
+        callback = f"{callback_base.rstrip('/')}/{urllib.parse.quote(slug)}"
+        try:
+            subscribe(hub, st["topic"], callback, st.get("secret", ""), lease, mode="unsubscribe")
+        except (OSError, RuntimeError) as e:
+            print(f"WARNING: websub unsubscribe failed for {slug}: {e}", file=sys.stderr)
+            continue
+        metrics.count("unsubscribe_requests", channel=slug)
+        sent += 1
+    for ch in channels:
+        if not ch["enabled"]:
+            continue
+        slug, topic = ch["slug"], ch["url"]
+        st = subs.get(slug) or {}
+        fresh = st.get("topic") == topic and st.get("lease_expires", 0) - now > margin
+        # Verification pending: give the hub a while before asking again
+        pending = st.get("topic") == topic and now - st.get("requested", 0) < margin and st.get("status") == "requested"
+        if fresh or pending:
+            continue
+        secret = st.get("secret") if st.get("topic") == topic and st.get("secret") else secrets.token_hex(16)
+        callback = f"{callback_base.rstrip('/')}/{urllib.parse.quote(slug)}"
+        # Recorded first: the hub may verify before subscribe() returns
+        subs.update(slug, topic=topic, secret=secret, requested=now, status="requested")
+        try:
+            subscribe(hub, topic, callback, secret, lease)
+        except (OSError, RuntimeError) as e:
+            print(f"WARNING: websub subscribe failed for {slug}: {e}", file=sys.stderr)
+            metrics.count("subscribe_errors", channel=slug)
+            # Not pending: the next renew asks again
+            subs.update(slug, status="error")
+            continue
+        metrics.count("subscribe_requests", channel=slug)
+        sent += 1
+    if sent:
+        print(f"==> WebSub: {sent} suscripciones pedidas/renovadas/canceladas")
+    return sent
+
+class WebSubCallback:
+    def __init__(self, subs: Subscriptions | None = None, spool: Spool | None = None, on_notify=None):
+        self.subs = subs or Subscriptions()
+        self.spool = spool or Spool()
+        # Called with the slug after jobs are queued (daemon: wake the ingest worker)
+        self.on_notify = on_notify
+
+    def verify(self, slug: str, query: str) -> tuple[int, bytes]:
+        """Hub verification GET -> (status, body)."""
+        q = urllib.parse.parse_qs(query)
+        mode = q.get("hub.mode", [""])[0]
+        topic = q.get("hub.topic", [""])[0]
+        challenge = q.get("hub.challenge", [""])[0]
+        st = self.subs.get(slug)
+
+        if mode == "subscribe":
+            if not st or st.get("topic") != topic or not challenge:
+                return 404, b""
+            try:
+                lease = int(q.get("hub.lease_seconds", [str(LEASE)])[0])
+            except ValueError:
+                lease = LEASE
+            self.subs.update(slug, lease_expires=time.time() + lease, status="active")
+            return 200, challenge.encode("utf-8")
+        if mode == "unsubscribe":
+            # Only confirm if we really don't want it any more
+            if st and st.get("topic") == topic and st.get("status") != "unsubscribed":
+                return 404, b""
+            return 200, challenge.encode("utf-8")
+        if mode == "denied":
+            if st and st.get("topic") == topic:
+                self.subs.update(slug, status="denied", lease_expires=0)
+            return 200, b""
+        return 400, b""
+
+    def notify(self, slug: str, body: bytes, signature: str | None) -> int:
+        """Content distribution POST. Always 2xx for the hub; returns jobs queued."""
+        st = self.subs.get(slug)
+        if not st or not st.get("secret"):
+            return 0
+        # X-Hub-Signature: sha1=<hex hmac of the raw body>
+        algo, _, digest = (signature or "").partition("=")
+        if algo not in ("sha1", "sha256", "sha384", "sha512"):
+            return 0
+        expected = hmac.new(st["secret"].encode("utf-8"), body, algo).hexdigest()
+        if not hmac.compare_digest(expected, digest.strip()):
+            print(f"WARNING: websub firma inválida para {slug}", file=sys.stderr)
+            return 0
+        try:
+            items = atom.parse(body)
+        except Exception as e:
+            print(f"WARNING: websub notificación ilegible para {slug}: {e}", file=sys.stderr)
+            return 0
+        self.spool.append(slug, items)
+        if items and self.on_notify is not None:
+            self.on_notify(slug)
+        return len(items)
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("renew", help="suscribir/renovar canales en el hub")
+    r.add_argument("--channels", required=True)
+    r.add_argument("--callback", required=True, help="URL pública base, p.ej. https://mi.host/websub")
+    r.add_argument("--hub", default=HUB)
+    r.add_argument("--state", default=None, help="default: ~/.local/state/ytcast/websub.json")
+    r.add_argument("--lease", type=int, default=LEASE)
+    args = ap.parse_args()
+
+    reg = registry.Registry(Path(args.channels))
+    channels = registry.load(reg)
+    changes = reg.changes("websub")
+    with metrics.stage("websub"):
+        renew(
+            channels,
+            args.callback,
+            hub=args.hub,
+            subs=Subscriptions(Path(args.state) if args.state else None),
+            lease=args.lease,
+            drop=changes.dropped(),
+        )
+        reg.mark_seen("websub", changes)
+
+if __name__ == "__main__":
+    main()